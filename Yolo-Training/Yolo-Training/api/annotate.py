@@ -0,0 +1,208 @@
+# /my_streaming_project/api/annotate.py
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+from api.config import (ANNOTATE_FORMAT, ANNOTATE_MAX_DIM, ANNOTATE_QUALITY, ANNOTATE_STORE_ITEMS,
+                        ANNOTATE_STORE_TTL_S, ANNOTATE_WORKERS)
+from api.ingest import DecodedImage, decode_image
+from api.postprocess import RECORD_BOX, Detections, extract
+
+# Vẽ box + mã hoá ảnh kết quả cho các endpoint /detect/: thu nhỏ ảnh về cạnh dài
+# ANNOTATE_MAX_DIM trước khi vẽ, chỉ đổi RGB -> BGR một lần, vẽ mọi khung bằng một
+# lệnh polylines và mã hoá JPEG/WebP với chất lượng cấu hình được, trong thread pool
+# riêng thay vì trên event loop.
+
+_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+_BOX_COLOR = (0, 255, 0)  # BGR, xanh lá
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _render_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, ANNOTATE_WORKERS), thread_name_prefix="yolo-render")
+    return _executor
+
+
+class RenderedImage:
+    __slots__ = ("data", "media_type", "size", "render_ms")
+
+    def __init__(self, data: bytes, media_type: str, size: Tuple[int, int], render_ms: float):
+        self.data = data
+        self.media_type = media_type
+        self.size = size  # (width, height) của ảnh trả về
+        self.render_ms = render_ms
+
+
+def draw_detections(canvas: np.ndarray, dets: Detections, scale: float = 1.0, label_background: bool = False):
+    """Vẽ khung + nhãn trực tiếp lên `canvas` (BGR); box nhân với `scale` trước khi vẽ."""
+    boxes = np.rint(dets.xyxy * scale).astype(np.int32).reshape(-1, 4)
+    if not len(boxes):
+        return
+    x1, y1, x2, y2 = boxes.T
+    corners = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1),
+                        np.stack([x2, y2], 1), np.stack([x1, y2], 1)], axis=1)
+    cv2.polylines(canvas, list(corners), True, _BOX_COLOR, 2)
+    for (bx1, by1, _, _), conf, label in zip(boxes.tolist(), dets.conf.tolist(), dets.labels.tolist()):
+        text = f"{label} {conf:.2f}"
+        if label_background:
+            (tw, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+            cv2.rectangle(canvas, (bx1, by1 - 20), (bx1 + tw, by1), _BOX_COLOR, -1)
+            cv2.putText(canvas, text, (bx1, by1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+        else:
+            cv2.putText(canvas, text, (bx1, by1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, _BOX_COLOR, 2)
+
+
+def render_annotated(image_rgb: np.ndarray, dets: Detections, fmt: str = ANNOTATE_FORMAT,
+                     quality: int = ANNOTATE_QUALITY, max_dim: int = ANNOTATE_MAX_DIM,
+                     label_background: bool = False) -> RenderedImage:
+    """
+    Vẽ box + nhãn lên ảnh RGB (box theo toạ độ của chính ảnh này) rồi mã hoá.
+    `label_background`: nền đặc dưới nhãn, chữ đen (kiểu của mainV2).
+    """
+    if fmt not in _FORMATS:
+        raise ValueError(f"Định dạng ảnh không hỗ trợ: {fmt} (chọn {', '.join(_FORMATS)})")
+    started = time.perf_counter()
+    ext, media_type, quality_flag = _FORMATS[fmt]
+
+    height, width = image_rgb.shape[:2]
+    scale = 1.0
+    if max_dim > 0 and max(height, width) > max_dim:
+        # Thu nhỏ trước khi vẽ: ít pixel phải vẽ và mã hoá hơn, nét vẽ không bị thu mảnh theo
+        scale = max_dim / float(max(height, width))
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        image_rgb = cv2.resize(image_rgb, (width, height), interpolation=cv2.INTER_AREA)
+    # cvtColor luôn trả mảng mới nên vẽ thẳng lên đó, không cần copy ảnh gốc
+    canvas = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+
+    draw_detections(canvas, dets, scale, label_background)
+
+    ok, buffer = cv2.imencode(ext, canvas, [int(quality_flag), int(min(max(quality, 1), 100))])
+    if not ok:
+        raise RuntimeError(f"Không mã hoá được ảnh {fmt}")
+    return RenderedImage(buffer.tobytes(), media_type, (width, height),
+                         round((time.perf_counter() - started) * 1000.0, 2))
+
+
+async def render_annotated_async(image_rgb: np.ndarray, dets: Detections, **options) -> RenderedImage:
+    """render_annotated trong thread pool vẽ ảnh (cv2 nhả GIL khi resize / mã hoá)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_executor(), lambda: render_annotated(image_rgb, dets, **options))
+
+
+async def render_original_async(contents: bytes, decoded: DecodedImage, dets: Detections,
+                                **options) -> RenderedImage:
+    """
+    Như render_annotated_async nhưng vẽ trên ảnh gốc (box `dets` theo toạ độ của `decoded`):
+    ảnh đã giải mã giảm thì được giải mã đầy đủ lại trong thread pool vẽ ảnh, box quy về
+    toạ độ gốc. Dùng cho /detect/ trả ảnh, nơi client vẽ chồng lên ảnh gốc của mình.
+    """
+    def run():
+        full = decode_image(contents, reduced=False) if decoded.reduced else decoded
+        return render_annotated(np.asarray(full.image), decoded.to_original(dets), **options)
+
+    return await asyncio.get_running_loop().run_in_executor(_render_executor(), run)
+
+
+class RenderedImageStore:
+    """Giữ tạm ảnh kết quả (LRU + TTL) để response JSON chỉ trả về URL của ảnh."""
+
+    def __init__(self, max_items: int = ANNOTATE_STORE_ITEMS, ttl_s: float = ANNOTATE_STORE_TTL_S):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._items: "OrderedDict[str, Tuple[float, RenderedImage]]" = OrderedDict()
+
+    def put(self, rendered: RenderedImage) -> str:
+        image_id = uuid.uuid4().hex
+        self._items[image_id] = (time.monotonic(), rendered)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return image_id
+
+    def get(self, image_id: str) -> Optional[RenderedImage]:
+        item = self._items.get(image_id)
+        if item is None:
+            return None
+        if time.monotonic() - item[0] > self.ttl_s:
+            del self._items[image_id]
+            return None
+        return item[1]
+
+
+def multipart_response(payload: Dict[str, Any], rendered: RenderedImage) -> Response:
+    """multipart/mixed gồm hai phần: JSON kết quả rồi ảnh đã vẽ box."""
+    boundary = uuid.uuid4().hex
+    extension = "webp" if rendered.media_type == "image/webp" else "jpg"
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json\r\n"
+        f"Content-Disposition: inline; name=\"result\"\r\n\r\n".encode(),
+        json.dumps(payload).encode(),
+        f"\r\n--{boundary}\r\nContent-Type: {rendered.media_type}\r\n"
+        f"Content-Disposition: inline; name=\"image\"; filename=\"annotated.{extension}\"\r\n\r\n".encode(),
+        rendered.data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+
+
+def annotated_router(scheduler, prefix: str = "/detect", relabel: Optional[Dict[str, str]] = None,
+                     label_background: bool = False, record_style: str = RECORD_BOX) -> APIRouter:
+    """
+    Endpoint trả kết quả + ảnh đã vẽ box trong một response:
+      POST {prefix}/annotated?response=multipart|json&format=jpeg|webp&quality=85&max_dim=1280
+      GET  {prefix}/annotated/{image_id}   (ảnh được tham chiếu từ response JSON)
+    Box trong JSON luôn theo toạ độ ảnh gốc.
+    """
+    router = APIRouter()
+    store = RenderedImageStore()
+
+    @router.post(f"{prefix}/annotated")
+    async def detect_annotated(file: UploadFile = File(...),
+                               response: str = Query("multipart", pattern="^(multipart|json)$"),
+                               image_format: str = Query(ANNOTATE_FORMAT, alias="format", pattern="^(jpeg|webp)$"),
+                               quality: int = Query(ANNOTATE_QUALITY, ge=1, le=100),
+                               max_dim: int = Query(ANNOTATE_MAX_DIM, ge=0)):
+        decoded = decode_image(await file.read())
+        # Model nhận ảnh PIL (ultralytics tự đổi RGB -> BGR); ndarray RGB chỉ dùng để vẽ box
+        r, timing = await scheduler.submit(decoded.image)
+        image_np = np.asarray(decoded.image)
+
+        dets = extract(r, relabel)
+        rendered = await render_annotated_async(image_np, dets, fmt=image_format, quality=quality,
+                                                max_dim=max_dim, label_background=label_background)
+        payload = {
+            "detections": decoded.to_original(dets).to_records(record_style),
+            "orig_shape": [decoded.orig_size[1], decoded.orig_size[0]],
+            "image_size": list(rendered.size),
+            "timing": {**timing, "render_ms": rendered.render_ms},
+        }
+        if response == "json":
+            image_id = store.put(rendered)
+            payload["image"] = {"url": f"{prefix}/annotated/{image_id}", "media_type": rendered.media_type,
+                                "expires_in_s": store.ttl_s}
+            return JSONResponse(payload)
+        return multipart_response(payload, rendered)
+
+    @router.get(f"{prefix}/annotated/{{image_id}}")
+    async def annotated_image(image_id: str):
+        rendered = store.get(image_id)
+        if rendered is None:
+            raise HTTPException(status_code=404, detail="Ảnh không tồn tại hoặc đã hết hạn")
+        return Response(rendered.data, media_type=rendered.media_type)
+
+    return router
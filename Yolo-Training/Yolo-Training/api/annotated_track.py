@@ -0,0 +1,62 @@
+# /my_streaming_project/api/annotated_track.py
+
+import asyncio
+import time
+
+from aiortc import MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
+from av import VideoFrame
+
+from api.annotate import draw_detections
+from api.postprocess import Detections
+from api.stream_processing import YOLOv8FrameProcessor
+
+
+class AnnotatedRoomTrack(MediaStreamTrack):
+    """
+    Video của phòng với box đã vẽ sẵn phía server, cho viewer không tự vẽ overlay được
+    (máy tính bảng yếu). Đọc frame từ `source` (một nhánh relay của track broadcaster),
+    lấy box hiện tại từ processor của phòng. Mỗi frame chỉ được vẽ MỘT lần rồi chia cho
+    mọi viewer qua MediaRelay; frame không có box nào được chuyển thẳng, không tốn công vẽ.
+    """
+    kind = "video"
+
+    def __init__(self, processor: YOLOv8FrameProcessor, source: MediaStreamTrack):
+        super().__init__()
+        self.processor = processor
+        self.source = source
+        self.relay = MediaRelay()
+        self.frames_rendered = 0
+        self.frames_passed = 0
+
+    def subscribe(self) -> MediaStreamTrack:
+        """Track riêng cho một viewer; không buffer, viewer chậm chỉ nhận frame mới nhất."""
+        return self.relay.subscribe(self, buffered=False)
+
+    async def recv(self):
+        frame = await self.source.recv()
+        dets = self.processor.overlay(time.perf_counter())
+        if dets is None or not len(dets):
+            self.frames_passed += 1
+            return frame
+        # Đổi màu + vẽ + đóng gói lại frame trong executor, không chặn event loop
+        annotated = await asyncio.get_running_loop().run_in_executor(None, self._render, frame, dets)
+        self.frames_rendered += 1
+        return annotated
+
+    @staticmethod
+    def _render(frame, dets: Detections):
+        image = frame.to_ndarray(format="bgr24")
+        draw_detections(image, dets)
+        annotated = VideoFrame.from_ndarray(image, format="bgr24")
+        annotated.pts = frame.pts
+        if frame.time_base is not None:
+            annotated.time_base = frame.time_base
+        return annotated
+
+    def stop(self):
+        super().stop()
+        self.source.stop()
+
+    def stats(self):
+        return {"annotated_frames_rendered": self.frames_rendered, "annotated_frames_passed": self.frames_passed}
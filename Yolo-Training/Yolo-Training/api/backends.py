@@ -0,0 +1,292 @@
+# /my_streaming_project/api/backends.py
+
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from api.config import (
+    DEFAULT_BACKEND, EXPORT_IMGSZ, INT8_BACKEND, MODEL_BACKENDS, PARITY_INT8_MIN_MATCH_RATE,
+    PARITY_INT8_SCORE_TOL, PARITY_IOU_MIN, PARITY_MAX_SAMPLES, PARITY_MIN_MATCH_RATE,
+    PARITY_SAMPLES_DIR, PARITY_SCORE_TOL, QUANT_CALIB_SAMPLES, QUANT_DATA,
+)
+
+# Backend -> tham số `format` của ultralytics export
+BACKEND_FORMATS = {"onnx": "onnx", "openvino": "openvino"}
+
+
+def parse_variant(model_name: str) -> Tuple[str, str]:
+    """"apple-leaf:int8" -> ("apple-leaf", "int8"); không có hậu tố -> "fp32"."""
+    base, _, precision = model_name.partition(":")
+    precision = precision or "fp32"
+    if precision not in ("fp32", "int8"):
+        raise ValueError(f"Độ chính xác không hợp lệ cho model '{model_name}': '{precision}' (fp32|int8)")
+    return base, precision
+
+
+def backend_for(model_name: str) -> str:
+    base, precision = parse_variant(model_name)
+    backend = MODEL_BACKENDS.get(model_name, MODEL_BACKENDS.get(base, DEFAULT_BACKEND))
+    if precision == "int8" and backend == "torch":
+        backend = INT8_BACKEND
+    if backend != "torch" and backend not in BACKEND_FORMATS:
+        raise ValueError(f"Backend không hợp lệ cho model '{model_name}': '{backend}' (torch|onnx|openvino)")
+    return backend
+
+
+def exported_path(weights: str, backend: str, int8: bool = False, imgsz: int = EXPORT_IMGSZ) -> Path:
+    """Vị trí file/thư mục export, nằm cạnh file .pt; tên gồm imgsz để mỗi kích thước có bản export riêng."""
+    path = Path(weights)
+    suffix = f"_int8_{imgsz}" if int8 else f"_{imgsz}"
+    if backend == "openvino":
+        return path.with_name(f"{path.stem}{suffix}_openvino_model")
+    return path.with_name(f"{path.stem}{suffix}.{BACKEND_FORMATS[backend]}")
+
+
+def _is_fresh(target: Path, weights: str) -> bool:
+    # File export chỉ dùng lại được nếu mới hơn file trọng số gốc
+    return target.exists() and (not os.path.exists(weights) or
+                                os.path.getmtime(target) >= os.path.getmtime(weights))
+
+
+def export_model(weights: str, backend: str, imgsz: int = EXPORT_IMGSZ, int8: bool = False) -> str:
+    """Export .pt sang ONNX/OpenVINO (batch động để vẫn gom batch được); dùng lại nếu đã có."""
+    target = exported_path(weights, backend, int8, imgsz)
+    if _is_fresh(target, weights):
+        return str(target)
+
+    from ultralytics import YOLO
+
+    logging.info(f"Đang export '{weights}' sang {backend}{' INT8' if int8 else ''} (imgsz={imgsz})...")
+    if int8 and backend == "onnx":
+        fp32 = export_model(weights, "onnx", imgsz)
+        return quantize_onnx_int8(fp32, str(target), load_calibration_images(), imgsz)
+    if int8:
+        # OpenVINO: ultralytics lượng tử hoá bằng NNCF, hiệu chỉnh trên split val của QUANT_DATA
+        return _store_export(YOLO(weights).export(format=BACKEND_FORMATS[backend], imgsz=imgsz, dynamic=True,
+                                                  int8=True, data=QUANT_DATA), target)
+    return _store_export(YOLO(weights).export(format=BACKEND_FORMATS[backend], imgsz=imgsz, dynamic=True), target)
+
+
+def _store_export(produced: str, target: Path) -> str:
+    # Ultralytics luôn export ra tên cố định (không có imgsz) -> chuyển sang tên theo imgsz
+    if Path(produced).resolve() != target.resolve():
+        if target.is_dir():
+            shutil.rmtree(target)
+        elif target.exists():
+            target.unlink()
+        shutil.move(produced, target)
+    return str(target)
+
+
+# --- LƯỢNG TỬ HOÁ INT8 ---
+def dataset_split_dir(data_yaml: str = QUANT_DATA, split: str = "val") -> Path:
+    """Thư mục ảnh của một split trong file dataset YOLO (vd. val: val/images)."""
+    import yaml
+
+    with open(data_yaml, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    root = Path(data.get("path") or Path(data_yaml).parent)
+    split_dir = Path(data[split])
+    return split_dir if split_dir.is_absolute() else root / split_dir
+
+
+def load_calibration_images(data_yaml: str = QUANT_DATA,
+                            max_samples: int = QUANT_CALIB_SAMPLES) -> List[np.ndarray]:
+    images = load_parity_samples(str(dataset_split_dir(data_yaml)), max_samples)
+    if not images:
+        raise FileNotFoundError(f"Không có ảnh calibration trong split val của '{data_yaml}'")
+    return images
+
+
+def _letterbox_tensor(image: np.ndarray, imgsz: int) -> np.ndarray:
+    # Tiền xử lý giống ultralytics: giữ tỉ lệ, pad 114, BGR->RGB, CHW, [0, 1]
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    canvas[top:top + nh, left:left + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def quantize_onnx_int8(fp32_path: str, target: str, calibration: List[np.ndarray], imgsz: int) -> str:
+    """Lượng tử hoá tĩnh (QDQ, activation uint8 / weight int8 theo kênh) bằng ONNX Runtime."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter(calibration)
+
+        def get_next(self):
+            image = next(self._images, None)
+            return None if image is None else {input_name: _letterbox_tensor(image, imgsz)}
+
+    quantize_static(fp32_path, target, _Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return target
+
+
+# --- KIỂM TRA PARITY ---
+def _default_parity_dirs() -> List[str]:
+    dirs = [PARITY_SAMPLES_DIR]
+    try:
+        dirs.append(str(dataset_split_dir()))
+    except Exception:
+        pass  # không có dataset.yaml trên máy phục vụ
+    return dirs
+
+
+def load_parity_samples(samples_dir: Optional[str] = None,
+                        max_samples: int = PARITY_MAX_SAMPLES) -> List[np.ndarray]:
+    """
+    Ảnh BGR thật từ split val (YOLO_PARITY_SAMPLES, rồi split val của dataset.yaml).
+    Không có ảnh thì trả về rỗng: ảnh nhiễu không cho ra box nào nên không kiểm tra được gì.
+    """
+    for directory in [samples_dir] if samples_dir else _default_parity_dirs():
+        if not os.path.isdir(directory):
+            continue
+        files = sorted(p for p in Path(directory).rglob("*")
+                       if p.suffix.lower() in (".jpg", ".jpeg", ".png"))[:max_samples]
+        images = [img for img in (cv2.imread(str(p)) for p in files) if img is not None]
+        if images:
+            return images
+    logging.warning(f"Không tìm thấy ảnh mẫu ({samples_dir or ', '.join(_default_parity_dirs())}) để kiểm tra parity.")
+    return []
+
+
+def _iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def _match_detections(ref: np.ndarray, cand: np.ndarray,
+                      score_tol: float = PARITY_SCORE_TOL) -> Tuple[int, float]:
+    """
+    Ghép tham lam từng box của PyTorch với box cùng lớp có IoU cao nhất của backend mới.
+    `ref`/`cand`: mảng (N, 6) [x1, y1, x2, y2, conf, cls]. Trả về (số box khớp, lệch score lớn nhất).
+    """
+    used = np.zeros(len(cand), dtype=bool)
+    matched, max_score_diff = 0, 0.0
+    for row in ref[np.argsort(-ref[:, 4])] if len(ref) else []:
+        candidates = np.where(~used & (cand[:, 5] == row[5]))[0]
+        if len(candidates) == 0:
+            continue
+        ious = _iou(row[:4], cand[candidates, :4])
+        best = candidates[int(np.argmax(ious))]
+        score_diff = abs(float(cand[best, 4] - row[4]))
+        if ious.max() >= PARITY_IOU_MIN and score_diff <= score_tol:
+            used[best] = True
+            matched += 1
+            max_score_diff = max(max_score_diff, score_diff)
+    return matched, max_score_diff
+
+
+def _boxes_array(result) -> np.ndarray:
+    return result.boxes.cpu().numpy().data[:, :6].astype(np.float32)
+
+
+def check_parity(reference, candidate, samples: List[np.ndarray], imgsz: int = EXPORT_IMGSZ,
+                 conf: float = 0.25, score_tol: float = PARITY_SCORE_TOL,
+                 min_match_rate: float = PARITY_MIN_MATCH_RATE) -> Dict[str, Any]:
+    """So sánh box + score của backend mới với PyTorch trên tập ảnh mẫu."""
+    total_ref = total_cand = total_matched = 0
+    max_score_diff = 0.0
+    ref_ms = cand_ms = 0.0
+    for image in samples:
+        started = time.perf_counter()
+        ref = _boxes_array(reference.predict(source=image, verbose=False, imgsz=imgsz, conf=conf)[0])
+        ref_ms += (time.perf_counter() - started) * 1000.0
+        started = time.perf_counter()
+        cand = _boxes_array(candidate.predict(source=image, verbose=False, imgsz=imgsz, conf=conf)[0])
+        cand_ms += (time.perf_counter() - started) * 1000.0
+
+        matched, score_diff = _match_detections(ref, cand, score_tol)
+        total_ref += len(ref)
+        total_cand += len(cand)
+        total_matched += matched
+        max_score_diff = max(max_score_diff, score_diff)
+
+    denominator = max(total_ref, total_cand)
+    match_rate = total_matched / denominator if denominator else 0.0
+    # Không có ảnh mẫu, hoặc PyTorch không phát hiện được gì trên ảnh mẫu -> chưa kiểm tra được gì, không cho qua
+    if not samples:
+        reason = "không có ảnh mẫu"
+    elif total_ref == 0:
+        reason = "PyTorch không phát hiện box nào trên ảnh mẫu"
+    elif match_rate < min_match_rate:
+        reason = f"tỉ lệ box khớp {match_rate:.2%} < {min_match_rate:.2%}"
+    else:
+        reason = None
+    return {
+        "samples": len(samples),
+        "reference_boxes": total_ref,
+        "candidate_boxes": total_cand,
+        "matched_boxes": total_matched,
+        "match_rate": round(match_rate, 4),
+        "max_score_diff": round(max_score_diff, 4),
+        "reference_ms_per_image": round(ref_ms / max(len(samples), 1), 2),
+        "candidate_ms_per_image": round(cand_ms / max(len(samples), 1), 2),
+        "passed": reason is None,
+        "reason": reason,
+    }
+
+
+def _parity_report_path(exported: str) -> Path:
+    path = Path(exported)
+    return path.with_name(f"{path.name}.parity.json")
+
+
+def load_with_backend(weights: str, backend: str, int8: bool = False) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Export + load model với backend mới (FP32 hoặc INT8) và kiểm tra parity với PyTorch.
+    Trả về (model, báo cáo parity); người gọi chỉ được phục vụ bằng model này
+    khi report["passed"]. Báo cáo được lưu cạnh file export để các worker khác dùng lại.
+    """
+    from ultralytics import YOLO
+
+    exported = export_model(weights, backend, int8=int8)
+    candidate = YOLO(exported, task="detect")
+
+    report_path = _parity_report_path(exported)
+    report: Optional[Dict[str, Any]] = None
+    if _is_fresh(report_path, exported):
+        report = json.loads(report_path.read_text())
+        # Báo cáo cũ "đạt" mà không có box tham chiếu nào (ảnh nhiễu) -> kiểm tra lại
+        if not report.get("reference_boxes"):
+            report = None
+    if report is None:
+        tolerances = ({"score_tol": PARITY_INT8_SCORE_TOL, "min_match_rate": PARITY_INT8_MIN_MATCH_RATE}
+                      if int8 else {})
+        report = check_parity(YOLO(weights), candidate, load_parity_samples(), **tolerances)
+        report.update({"backend": backend, "int8": int8, "weights": weights, "exported": exported})
+        report_path.write_text(json.dumps(report, indent=2))
+    return candidate, report
+
+
+if __name__ == "__main__":
+    # python -m api.backends apple-leaf openvino       -> export + in báo cáo parity
+    # python -m api.backends apple-leaf:int8 onnx
+    from api.model_registry import registry
+
+    model_name = sys.argv[1] if len(sys.argv) > 1 else "apple-leaf"
+    backend_name = sys.argv[2] if len(sys.argv) > 2 else backend_for(model_name)
+    _, parity = load_with_backend(registry.resolve(model_name), backend_name,
+                                  int8=parse_variant(model_name)[1] == "int8")
+    print(json.dumps(parity, indent=2))
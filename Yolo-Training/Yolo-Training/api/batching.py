@@ -0,0 +1,184 @@
+# /my_streaming_project/api/batching.py
+
+import asyncio
+import logging
+import time
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from api.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_STATS_WINDOW, INFERENCE_MAX_QUEUE
+from api.inference_pool import PRIORITY_INTERACTIVE, InferencePool, InferenceQueueFull, inference_pool
+from api.metrics import registry as metrics
+
+# Mọi scheduler đang tồn tại, để /metrics đọc độ sâu hàng đợi từng scheduler
+_schedulers: "weakref.WeakSet[BatchScheduler]" = weakref.WeakSet()
+
+
+class _PendingRequest:
+    __slots__ = ("image", "future", "enqueued_at")
+
+    def __init__(self, image, future: asyncio.Future):
+        self.image = image
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class BatchScheduler:
+    """
+    Gom các request đến gần nhau (tối đa `max_batch_size` ảnh hoặc `max_wait_ms` ms)
+    thành một lần gọi `model.predict` duy nhất, rồi trả kết quả riêng cho từng request.
+    Batch được chạy trên `InferencePool` với độ ưu tiên `priority`; khi đã có quá
+    `max_pending` request chờ thì `submit` ném InferenceQueueFull (-> 503).
+    """
+
+    def __init__(self, model, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS, name: str = "default",
+                 priority: int = PRIORITY_INTERACTIVE, pool: Optional[InferencePool] = None,
+                 max_pending: int = INFERENCE_MAX_QUEUE, **predict_kwargs):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self.priority = priority
+        self.pool = pool or inference_pool
+        self.max_pending = max(1, max_pending)
+        self.predict_kwargs = predict_kwargs
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Giới hạn số batch chạy đồng thời = số worker của pool; khi mọi worker
+        # đều bận, request tiếp tục dồn vào hàng đợi và batch sau sẽ lớn hơn
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        # Thống kê để tinh chỉnh đánh đổi throughput / độ trễ
+        self._latencies: Deque[Tuple[float, float, float]] = deque(maxlen=BATCH_STATS_WINDOW)
+        self._batch_sizes: Deque[int] = deque(maxlen=BATCH_STATS_WINDOW)
+        self.total_requests = 0
+        self.total_batches = 0
+        self.rejected = 0
+        _schedulers.add(self)
+
+    def _ensure_started(self):
+        # Queue và task phải được tạo trong event loop đang chạy (không phải lúc import)
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Tối đa max_workers batch cùng lúc; batch trên cùng một model vẫn chạy lần lượt
+            # vì registry khoá predict theo model (Predictor không thread-safe)
+            self._slots = asyncio.Semaphore(self.pool.max_workers)
+            self._worker = loop.create_task(self._run(), name=f"batch-scheduler-{self.name}")
+
+    async def submit(self, image) -> Tuple[Any, Dict[str, float]]:
+        """
+        Đưa một ảnh vào hàng đợi và chờ kết quả.
+        Trả về (results của ảnh đó, thông tin độ trễ của request).
+        """
+        self._ensure_started()
+        if self._queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            raise InferenceQueueFull(self.pool.retry_after())
+        request = _PendingRequest(image, self._loop.create_future())
+        await self._queue.put(request)
+        return await request.future
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            first = await self._queue.get()
+            batch = [first]
+            deadline = self._loop.time() + self.max_wait
+
+            # Gom thêm request cho tới khi đủ batch hoặc hết cửa sổ chờ
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - self._loop.time()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+
+            task = self._loop.create_task(self._run_batch(batch))
+            task.add_done_callback(lambda _: self._slots.release())
+
+    async def _run_batch(self, batch: List[_PendingRequest]):
+        # Bỏ qua các request mà client đã huỷ trong lúc chờ
+        batch = [req for req in batch if not req.future.done()]
+        if not batch:
+            return
+
+        images = [req.image for req in batch]
+        started = time.perf_counter()
+        try:
+            # model.predict là hàm blocking -> chạy trong pool để không chặn event loop
+            results = await self.pool.predict(self.model, images, priority=self.priority,
+                                              **self.predict_kwargs)
+        except Exception as e:
+            if not isinstance(e, InferenceQueueFull):
+                logging.error(f"Lỗi khi chạy batch YOLO ({self.name}, {len(batch)} ảnh): {e}")
+            for req in batch:
+                if not req.future.done():
+                    req.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        inference_ms = (finished - started) * 1000.0
+        self.total_batches += 1
+        self._batch_sizes.append(len(batch))
+
+        for req, result in zip(batch, results):
+            queue_ms = (started - req.enqueued_at) * 1000.0
+            total_ms = (finished - req.enqueued_at) * 1000.0
+            self.total_requests += 1
+            self._latencies.append((queue_ms, inference_ms, total_ms))
+            timing = {
+                "queue_ms": round(queue_ms, 2),
+                "inference_ms": round(inference_ms, 2),
+                "total_ms": round(total_ms, 2),
+                "batch_size": len(batch),
+            }
+            if not req.future.done():
+                req.future.set_result((result, timing))
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê độ trễ và kích thước batch trên cửa sổ request gần nhất."""
+        totals = sorted(t for _, _, t in self._latencies)
+        queues = sorted(q for q, _, _ in self._latencies)
+        batch_sizes = list(self._batch_sizes)
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "rejected": self.rejected,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "avg_batch_size": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0,
+            "latency_ms": {
+                "p50": round(_percentile(totals, 50), 2),
+                "p95": round(_percentile(totals, 95), 2),
+                "p99": round(_percentile(totals, 99), 2),
+            },
+            "queue_ms": {
+                "p50": round(_percentile(queues, 50), 2),
+                "p95": round(_percentile(queues, 95), 2),
+            },
+        }
+
+
+metrics.gauge("yolo_batch_pending", "Số request chờ gom batch", ("scheduler",)).add_collector(
+    lambda: [({"scheduler": s.name}, s._queue.qsize() if s._queue else 0) for s in list(_schedulers)])
+metrics.gauge("yolo_batch_rejected_total", "Số request bị từ chối vì hàng đợi của scheduler đầy",
+              ("scheduler",), kind="counter").add_collector(
+    lambda: [({"scheduler": s.name}, s.rejected) for s in list(_schedulers)])
@@ -0,0 +1,199 @@
+# /my_streaming_project/api/bulk_processing.py
+
+import asyncio
+import json
+import logging
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, File, UploadFile
+from fastapi.responses import StreamingResponse
+
+from api.batching import BatchScheduler
+from api.config import (BULK_BATCH_MAX_SIZE, BULK_BATCH_MAX_WAIT_MS, BULK_DECODE_WORKERS, BULK_MAX_IMAGE_MB,
+                        BULK_MAX_IN_FLIGHT, PREDICT_CLASSES, PREDICT_MODEL)
+from api.inference_pool import PRIORITY_BACKGROUND, InferenceQueueFull
+from api.ingest import decode_image
+from api.postprocess import extract
+
+# Xử lý hàng loạt: nhận nhiều file ảnh (multipart) hoặc archive ZIP / tar, chạy theo
+# pipeline đọc -> giải mã -> suy luận theo batch, và stream về mỗi ảnh một dòng NDJSON
+# ngay khi có kết quả. Số ảnh đang xử lý bị giới hạn nên bộ nhớ không tăng theo số ảnh.
+
+router = APIRouter()
+# Độ ưu tiên thấp nhất: ảnh chụp từ dashboard và frame stream vẫn được chạy trước
+scheduler = BatchScheduler(PREDICT_MODEL, max_batch_size=BULK_BATCH_MAX_SIZE, max_wait_ms=BULK_BATCH_MAX_WAIT_MS,
+                           name="predict_bulk", priority=PRIORITY_BACKGROUND,
+                           max_pending=BULK_MAX_IN_FLIGHT + 1, conf=0.25, imgsz=640)
+
+_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+_TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+_MAX_IMAGE_BYTES = int(BULK_MAX_IMAGE_MB * 1024 * 1024)
+
+_decode_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(max_workers=max(1, BULK_DECODE_WORKERS),
+                                              thread_name_prefix="yolo-bulk-decode")
+    return _decode_executor
+
+
+def _is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in _IMAGE_EXTENSIONS
+
+
+def _read_member(read, size: int):
+    """Đọc một member của archive; member lỗi (dữ liệu nén hỏng, đọc thiếu...) trả về chính exception."""
+    if size > _MAX_IMAGE_BYTES:
+        return None
+    try:
+        return read()
+    except Exception as e:
+        return e
+
+
+def iter_images(upload: UploadFile) -> Iterator[Tuple[str, Union[bytes, Exception, None]]]:
+    """
+    Duyệt lần lượt các ảnh trong một file upload (ảnh đơn, ZIP hoặc tar), đọc từng ảnh một.
+    Ảnh vượt quá BULK_MAX_IMAGE_MB trả về nội dung None, member đọc lỗi trả về exception.
+    """
+    name = upload.filename or "image"
+    lower = name.lower()
+    if lower.endswith(".zip"):
+        with zipfile.ZipFile(upload.file) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image(info.filename):
+                    continue
+                # Member hỏng không ảnh hưởng member khác (ZIP đọc theo offset của từng member)
+                yield info.filename, _read_member(lambda: archive.read(info), info.file_size)
+    elif lower.endswith(_TAR_EXTENSIONS):
+        # Chế độ stream ("r|*"): không cần seek, không giữ danh sách member.
+        # Luồng nén hỏng thì lần duyệt member kế tiếp sẽ lỗi -> _iter_all báo lỗi cả archive
+        with tarfile.open(fileobj=upload.file, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not _is_image(member.name):
+                    continue
+                yield member.name, _read_member(lambda: archive.extractfile(member).read(), member.size)
+    else:
+        contents = upload.file.read(_MAX_IMAGE_BYTES + 1)
+        yield name, contents if len(contents) <= _MAX_IMAGE_BYTES else None
+
+
+def _iter_all(files: List[UploadFile]) -> Iterator[Tuple[str, Union[bytes, Exception, None]]]:
+    for upload in files:
+        # Archive hỏng (BadZipFile, TarError, zlib.error, EOFError, OSError...) chỉ thành một dòng lỗi,
+        # các ảnh đã đọc trước đó và các file sau vẫn được xử lý
+        try:
+            yield from iter_images(upload)
+        except Exception as e:
+            yield upload.filename or "archive", e
+
+
+def _line(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _process_one(index: int, name: str, contents: bytes) -> dict:
+    loop = asyncio.get_running_loop()
+    decoded = await loop.run_in_executor(_executor(), decode_image, contents)
+    while True:
+        try:
+            r, timing = await scheduler.submit(decoded.image)
+            break
+        except InferenceQueueFull as e:
+            # Job nền nhường chỗ khi hệ thống quá tải, thử lại thay vì huỷ cả job
+            await asyncio.sleep(min(e.retry_after, 2))
+    dets = decoded.to_original(extract(r, classes=PREDICT_CLASSES))
+    return {"index": index, "name": name, "detections": dets.to_records(),
+            "orig_shape": list(dets.orig_shape), "timing": timing}
+
+
+async def bulk_results(files: List[UploadFile]) -> AsyncIterator[bytes]:
+    """Chạy pipeline và trả về các dòng NDJSON theo thứ tự xong trước trả trước ("index" = thứ tự đầu vào)."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    # Mỗi ảnh giữ một chỗ trong in_flight từ lúc đọc tới khi dòng NDJSON của nó đã được gửi đi,
+    # nên `out` không bao giờ chứa quá BULK_MAX_IN_FLIGHT dòng dù client đọc chậm
+    out: asyncio.Queue = asyncio.Queue()
+    in_flight = asyncio.Semaphore(max(1, BULK_MAX_IN_FLIGHT))
+    tasks = set()
+    counts = {"images": 0, "errors": 0}
+    done = object()
+
+    async def run_one(index: int, name: str, contents):
+        try:
+            if isinstance(contents, Exception):
+                line = {"index": index, "name": name, "error": f"Không đọc được file: {contents}"}
+            elif contents is None:
+                line = {"index": index, "name": name, "error": f"Ảnh lớn hơn {BULK_MAX_IMAGE_MB:g} MB"}
+            else:
+                line = await _process_one(index, name, contents)
+        except Exception as e:
+            logging.error(f"Lỗi khi xử lý ảnh {name} trong job hàng loạt: {e}")
+            line = {"index": index, "name": name, "error": "Không thể xử lý ảnh."}
+        counts["errors" if "error" in line else "images"] += 1
+        await out.put(line)
+
+    async def produce():
+        entries = _iter_all(files)
+        index = 0
+        try:
+            while True:
+                # Chỉ đọc ảnh tiếp theo khi còn chỗ trong pipeline
+                await in_flight.acquire()
+                entry = await loop.run_in_executor(_executor(), next, entries, None)
+                if entry is None:
+                    in_flight.release()
+                    break
+                task = loop.create_task(run_one(index, *entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+        except Exception as e:
+            logging.error(f"Lỗi khi đọc file trong job hàng loạt: {e}")
+            counts["errors"] += 1
+            await out.put({"index": index, "name": None, "error": "Không thể đọc tiếp các file còn lại."})
+        finally:
+            # Kể cả khi dừng giữa chừng: chờ các ảnh đã bắt đầu xong (đã đưa dòng vào `out`) rồi mới kết thúc
+            if tasks:
+                await asyncio.wait(list(tasks))
+            await out.put(done)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            line = await out.get()
+            if line is done:
+                break
+            yield _line(line)
+            # Dòng đã được gửi cho client -> nhả chỗ cho ảnh tiếp theo
+            in_flight.release()
+        yield _line({"summary": {**counts, "elapsed_s": round(time.perf_counter() - started, 3)}})
+    finally:
+        # Client ngắt kết nối giữa chừng -> dừng đọc và huỷ các ảnh đang chờ
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+@router.post("/bulk")
+async def predict_bulk(files: List[UploadFile] = File(...)):
+    """
+    Nhận nhiều ảnh hoặc archive ZIP / tar trong một request multipart (trường "files"),
+    trả về NDJSON: mỗi ảnh một dòng {"index", "name", "detections", "orig_shape", "timing"}
+    (hoặc {"index", "name", "error"}), dòng cuối là {"summary": {...}}.
+    """
+    logging.info(f"Nhận job hàng loạt: {len(files)} file")
+    return StreamingResponse(bulk_results(files), media_type="application/x-ndjson")
+
+
+@router.get("/bulk/stats")
+def predict_bulk_stats():
+    return scheduler.stats()
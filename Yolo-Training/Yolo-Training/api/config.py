@@ -0,0 +1,236 @@
+# /my_streaming_project/api/config.py
+
+import os
+import socket
+
+# Mọi tham số vận hành đều đọc từ biến môi trường để có thể tinh chỉnh
+# mà không phải sửa code (ví dụ: YOLO_BATCH_MAX_SIZE=16 uvicorn mainV5:app).
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_list(name: str, default: list) -> list:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _env_mapping(name: str) -> dict:
+    # Định dạng: "ten1=gia_tri1,ten2=gia_tri2"
+    mapping = {}
+    for item in _env_list(name, []):
+        key, _, value = item.partition("=")
+        if key and value:
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+# --- MODEL ---
+# Các model có thể chọn theo tên. Thêm/ghi đè bằng YOLO_MODELS="ten=duong_dan,..."
+MODEL_WEIGHTS = {
+    "coco": "yolov8n.pt",
+    "apple-leaf": "runs/detect/apple-leaf-detect2/weights/best.pt",
+}
+MODEL_WEIGHTS.update(_env_mapping("YOLO_MODELS"))
+# Model dùng cho từng nhóm endpoint (tên trong MODEL_WEIGHTS hoặc đường dẫn trực tiếp)
+PREDICT_MODEL = os.getenv("YOLO_PREDICT_MODEL", "coco")        # /predict/image
+STREAM_MODEL = os.getenv("YOLO_STREAM_MODEL", "coco")          # luồng WebRTC
+DETECT_MODEL = os.getenv("YOLO_DETECT_MODEL", "apple-leaf")    # /detect/ trong main.py
+# Các model được load + chạy thử trước khi /api/ready báo sẵn sàng
+WARMUP_MODELS = _env_list("YOLO_WARMUP_MODELS", list(dict.fromkeys([PREDICT_MODEL, STREAM_MODEL])))
+WARMUP_IMGSZ = _env_int("YOLO_WARMUP_IMGSZ", 640)
+
+
+# --- GOM BATCH ĐỘNG (MICRO-BATCHING) ---
+# Số ảnh tối đa trong một lần gọi model.predict
+BATCH_MAX_SIZE = _env_int("YOLO_BATCH_MAX_SIZE", 8)
+# Thời gian tối đa (ms) chờ gom thêm request sau request đầu tiên của batch
+BATCH_MAX_WAIT_MS = _env_float("YOLO_BATCH_MAX_WAIT_MS", 10.0)
+# Số request gần nhất dùng để tính thống kê độ trễ (p50/p95...)
+BATCH_STATS_WINDOW = _env_int("YOLO_BATCH_STATS_WINDOW", 1000)
+
+# --- POOL SUY LUẬN (CHẠY NGOÀI EVENT LOOP) ---
+# "thread" (mặc định), "process" (mỗi process tự load model của mình) hoặc
+# "shm" (N process con, frame/ảnh truyền qua ring buffer bộ nhớ chia sẻ)
+INFERENCE_EXECUTOR = os.getenv("YOLO_INFERENCE_EXECUTOR", "thread")
+# Số worker chạy predict song song. Chế độ thread: các worker dùng chung một model và predict
+# trên cùng một model bị khoá tuần tự, nên mặc định 1 (muốn song song thật thì dùng process / shm)
+INFERENCE_WORKERS = _env_int("YOLO_INFERENCE_WORKERS", 1 if INFERENCE_EXECUTOR == "thread" else 2)
+# Số job/request tối đa được xếp hàng; vượt quá -> trả 503 + Retry-After
+INFERENCE_MAX_QUEUE = _env_int("YOLO_INFERENCE_MAX_QUEUE", 32)
+# Số chỗ cuối hàng đợi chỉ dành cho request interactive: frame stream và job nền bị từ chối khi
+# hàng đợi đã có (MAX_QUEUE - số này) job, nên job nền tự thử lại không chiếm hết chỗ của dashboard
+INFERENCE_RESERVED_INTERACTIVE = _env_int("YOLO_INFERENCE_RESERVED_INTERACTIVE", max(1, INFERENCE_MAX_QUEUE // 4))
+
+# --- WORKER ĐA PROCESS + BỘ NHỚ CHIA SẺ (YOLO_INFERENCE_EXECUTOR=shm) ---
+# Số slot trong ring buffer và kích thước mỗi slot (MB); ảnh lớn hơn slot được gửi qua pickle
+SHM_SLOTS = _env_int("YOLO_SHM_SLOTS", 32)
+SHM_SLOT_MB = _env_float("YOLO_SHM_SLOT_MB", 8.0)
+# Số thread torch trong mỗi process worker (1 -> scale gần tuyến tính theo số core)
+INFERENCE_THREADS_PER_WORKER = _env_int("YOLO_INFERENCE_THREADS_PER_WORKER", 1)
+# Chu kỳ kiểm tra worker còn sống; worker chết được khởi động lại tối đa N lần (mỗi worker),
+# quá số lần đó thì bỏ worker, không còn worker nào -> pool báo lỗi thay vì treo request
+SHM_MONITOR_INTERVAL_S = _env_float("YOLO_SHM_MONITOR_INTERVAL_S", 0.5)
+SHM_WORKER_MAX_RESTARTS = _env_int("YOLO_SHM_WORKER_MAX_RESTARTS", 3)
+
+# --- BACKEND SUY LUẬN (CPU) ---
+# "torch" (mặc định), "onnx" (ONNX Runtime) hoặc "openvino"; ghi đè theo từng model
+# bằng YOLO_BACKENDS="apple-leaf=openvino,coco=onnx"
+DEFAULT_BACKEND = os.getenv("YOLO_BACKEND", "torch")
+MODEL_BACKENDS = _env_mapping("YOLO_BACKENDS")
+EXPORT_IMGSZ = _env_int("YOLO_EXPORT_IMGSZ", 640)
+# Kiểm tra parity với PyTorch trước khi backend mới được phép phục vụ
+PARITY_SAMPLES_DIR = os.getenv("YOLO_PARITY_SAMPLES", "val/images")  # split val trong dataset.yaml
+PARITY_MAX_SAMPLES = _env_int("YOLO_PARITY_MAX_SAMPLES", 16)
+PARITY_IOU_MIN = _env_float("YOLO_PARITY_IOU_MIN", 0.9)          # IoU tối thiểu để 2 box được coi là khớp
+PARITY_SCORE_TOL = _env_float("YOLO_PARITY_SCORE_TOL", 0.05)     # lệch confidence tối đa
+PARITY_MIN_MATCH_RATE = _env_float("YOLO_PARITY_MIN_MATCH", 0.95)  # tỉ lệ box khớp tối thiểu
+
+# --- MODEL LƯỢNG TỬ HOÁ INT8 ---
+# Chọn biến thể INT8 bằng hậu tố tên model, ví dụ YOLO_DETECT_MODEL=apple-leaf:int8
+# Backend mặc định cho INT8 khi backend chung là torch (PyTorch CPU không chạy INT8)
+INT8_BACKEND = os.getenv("YOLO_INT8_BACKEND", "openvino")
+# Dữ liệu hiệu chỉnh (calibration) lấy từ split val của dataset.yaml
+QUANT_DATA = os.getenv("YOLO_QUANT_DATA", "dataset.yaml")
+QUANT_CALIB_SAMPLES = _env_int("YOLO_QUANT_CALIB_SAMPLES", 300)
+# INT8 luôn lệch một chút so với FP32 -> ngưỡng parity riêng, nới hơn
+PARITY_INT8_SCORE_TOL = _env_float("YOLO_PARITY_INT8_SCORE_TOL", 0.1)
+PARITY_INT8_MIN_MATCH_RATE = _env_float("YOLO_PARITY_INT8_MIN_MATCH", 0.85)
+
+# --- XỬ LÝ LUỒNG WEBRTC ---
+# FPS suy luận mục tiêu mặc định của mỗi phòng (client có thể đổi theo phòng)
+STREAM_TARGET_FPS = _env_float("YOLO_STREAM_TARGET_FPS", 10.0)
+STREAM_MAX_FPS = _env_float("YOLO_STREAM_MAX_FPS", 30.0)
+STREAM_IMGSZ = _env_int("YOLO_STREAM_IMGSZ", 320)
+STREAM_CONF = _env_float("YOLO_STREAM_CONF", 0.25)
+# Một scheduler chung gom frame mới nhất của mọi phòng thành một batch suy luận
+STREAM_BATCH_MAX_SIZE = _env_int("YOLO_STREAM_BATCH_MAX_SIZE", 16)
+# Phòng sắp tới lượt trong cửa sổ này được gom luôn vào batch hiện tại
+STREAM_BATCH_WINDOW_MS = _env_float("YOLO_STREAM_BATCH_WINDOW_MS", 20.0)
+# Tracker giữa các lần suy luận: gán track ID và nội suy box cho các frame bị bỏ qua
+STREAM_TRACKING = _env_int("YOLO_STREAM_TRACKING", 1) == 1
+STREAM_TRACK_IOU = _env_float("YOLO_STREAM_TRACK_IOU", 0.3)
+STREAM_TRACK_MAX_AGE_S = _env_float("YOLO_STREAM_TRACK_MAX_AGE_S", 1.0)
+# Tần suất tối đa gửi box nội suy cho viewer (0 = chỉ gửi kết quả suy luận thật)
+STREAM_INTERP_FPS = _env_float("YOLO_STREAM_INTERP_FPS", 30.0)
+# Bỏ qua detector khi cảnh gần như không đổi (camera cố định), dùng lại kết quả cũ
+STREAM_MOTION_GATING = _env_int("YOLO_STREAM_MOTION_GATING", 1) == 1
+# Tỉ lệ pixel (ảnh xám thu nhỏ) thay đổi hơn PIXEL_DELTA mức xám -> coi là có chuyển động
+STREAM_MOTION_THRESHOLD = _env_float("YOLO_STREAM_MOTION_THRESHOLD", 0.01)
+STREAM_MOTION_PIXEL_DELTA = _env_int("YOLO_STREAM_MOTION_PIXEL_DELTA", 25)
+STREAM_MOTION_THUMB_WIDTH = _env_int("YOLO_STREAM_MOTION_THUMB_WIDTH", 64)
+# Dù cảnh tĩnh vẫn chạy lại detector sau tối đa khoảng này (giây)
+STREAM_MOTION_MAX_INTERVAL_S = _env_float("YOLO_STREAM_MOTION_MAX_INTERVAL_S", 2.0)
+
+# --- CACHE KẾT QUẢ /predict/image ---
+CACHE_ENABLED = _env_int("YOLO_CACHE_ENABLED", 1) == 1
+CACHE_MAX_MB = _env_float("YOLO_CACHE_MAX_MB", 32.0)
+CACHE_TTL_S = _env_float("YOLO_CACHE_TTL_S", 600.0)
+# Khớp ảnh gần giống theo dHash (tuỳ chọn, tắt mặc định): khoảng cách Hamming tối đa giữa hai
+# dHash 64 bit để coi là "gần giống"; < 0 = chỉ khớp chính xác. Ảnh hai cây cạnh nhau có thể
+# chỉ lệch vài bit, nên chỉ bật khi ảnh gửi lại đúng là cùng một cảnh (vd. camera cố định)
+CACHE_PHASH_DISTANCE = _env_int("YOLO_CACHE_PHASH_DISTANCE", -1)
+# Chỉ so dHash với ngần này entry dùng gần nhất (quét tuần tự trên event loop)
+CACHE_PHASH_MAX_SCAN = _env_int("YOLO_CACHE_PHASH_MAX_SCAN", 1024)
+
+# --- HẬU XỬ LÝ ---
+# Chỉ trả về các class này (tên hoặc id, vd. "apple,leaf"); rỗng = tất cả
+PREDICT_CLASSES = _env_list("YOLO_PREDICT_CLASSES", [])
+STREAM_CLASSES = _env_list("YOLO_STREAM_CLASSES", [])
+
+# --- GIẢI MÃ ẢNH UPLOAD ---
+# JPEG được giải mã thẳng ở độ phân giải gần kích thước suy luận (scale DCT 1/2, 1/4, 1/8)
+REDUCED_DECODE = _env_int("YOLO_REDUCED_DECODE", 1) == 1
+# Cạnh ngắn của ảnh giải mã không nhỏ hơn giá trị này (nên >= imgsz của model)
+DECODE_TARGET_SIZE = _env_int("YOLO_DECODE_TARGET_SIZE", 640)
+
+# --- ẢNH KẾT QUẢ CÓ VẼ BOX ---
+# Định dạng ảnh trả về: "jpeg" hoặc "webp"; chất lượng 1-100
+ANNOTATE_FORMAT = os.getenv("YOLO_ANNOTATE_FORMAT", "jpeg").lower()
+ANNOTATE_QUALITY = _env_int("YOLO_ANNOTATE_QUALITY", 85)
+# Cạnh dài tối đa của ảnh trả về (0 = giữ nguyên kích thước ảnh đã giải mã)
+ANNOTATE_MAX_DIM = _env_int("YOLO_ANNOTATE_MAX_DIM", 1280)
+# Số thread vẽ + mã hoá ảnh (không chạy trên event loop)
+ANNOTATE_WORKERS = _env_int("YOLO_ANNOTATE_WORKERS", 2)
+# Ảnh của response JSON được giữ tạm để client tải về qua URL
+ANNOTATE_STORE_ITEMS = _env_int("YOLO_ANNOTATE_STORE_ITEMS", 64)
+ANNOTATE_STORE_TTL_S = _env_float("YOLO_ANNOTATE_STORE_TTL_S", 60.0)
+
+# --- XỬ LÝ HÀNG LOẠT (/predict/bulk) ---
+# Số ảnh đang đọc / giải mã / suy luận cùng lúc (giới hạn bộ nhớ, đủ để model luôn bận)
+BULK_MAX_IN_FLIGHT = _env_int("YOLO_BULK_MAX_IN_FLIGHT", 32)
+BULK_DECODE_WORKERS = _env_int("YOLO_BULK_DECODE_WORKERS", 4)
+# Job nền không cần độ trễ thấp -> batch lớn hơn, chờ gom lâu hơn
+BULK_BATCH_MAX_SIZE = _env_int("YOLO_BULK_BATCH_MAX_SIZE", 16)
+BULK_BATCH_MAX_WAIT_MS = _env_float("YOLO_BULK_BATCH_MAX_WAIT_MS", 50.0)
+# Bỏ qua ảnh (trong archive) lớn hơn giới hạn này
+BULK_MAX_IMAGE_MB = _env_float("YOLO_BULK_MAX_IMAGE_MB", 50.0)
+
+# --- SUY LUẬN TRÊN FILE VIDEO (/predict/video) ---
+# Mặc định lấy 1 frame trong mỗi VIDEO_STRIDE frame (ghi đè bằng ?stride=)
+VIDEO_STRIDE = _env_int("YOLO_VIDEO_STRIDE", 5)
+# Số frame đã giải mã đang chờ / đang suy luận (bộ nhớ không phụ thuộc độ dài video)
+VIDEO_MAX_IN_FLIGHT = _env_int("YOLO_VIDEO_MAX_IN_FLIGHT", 16)
+# Video kết quả có vẽ box (?annotate=true): thư mục lưu, codec, thời gian giữ file
+VIDEO_OUTPUT_DIR = os.getenv("YOLO_VIDEO_OUTPUT_DIR", "runs/video_outputs")
+VIDEO_OUTPUT_CODEC = os.getenv("YOLO_VIDEO_OUTPUT_CODEC", "libx264")
+VIDEO_OUTPUT_TTL_S = _env_float("YOLO_VIDEO_OUTPUT_TTL_S", 3600.0)
+
+# --- VIDEO CÓ VẼ BOX PHÍA SERVER (theo phòng) ---
+# Mặc định cho phòng mới; broadcaster bật/tắt riêng bằng trường "annotated_video" trong offer
+STREAM_ANNOTATED_VIDEO = _env_int("YOLO_STREAM_ANNOTATED_VIDEO", 0) == 1
+
+# --- GỬI KẾT QUẢ CHO VIEWER (pub/sub theo phòng) ---
+# Số message tối đa chờ gửi cho mỗi viewer; đầy thì bỏ message cũ nhất (giữ kết quả mới nhất)
+STREAM_VIEWER_QUEUE = _env_int("YOLO_STREAM_VIEWER_QUEUE", 2)
+# Gửi một message quá thời gian này -> coi viewer đã treo, ngắt kết nối
+STREAM_VIEWER_SEND_TIMEOUT_S = _env_float("YOLO_STREAM_VIEWER_SEND_TIMEOUT_S", 5.0)
+# Bị bỏ >= DOWNGRADE_DROPS message trong LAG_WINDOW_S giây -> hạ cấp: chỉ nhận kết quả suy luận,
+# không nhận box nội suy (0 = không hạ cấp); không bị bỏ message nào trong RECOVER_S giây -> khôi phục
+STREAM_VIEWER_DOWNGRADE_DROPS = _env_int("YOLO_STREAM_VIEWER_DOWNGRADE_DROPS", 10)
+STREAM_VIEWER_LAG_WINDOW_S = _env_float("YOLO_STREAM_VIEWER_LAG_WINDOW_S", 5.0)
+STREAM_VIEWER_RECOVER_S = _env_float("YOLO_STREAM_VIEWER_RECOVER_S", 10.0)
+
+# --- TRẠNG THÁI PHÒNG DÙNG CHUNG (nhiều worker / node) ---
+# memory: một process (mặc định); redis: mọi server nói giao thức Redis (Redis, KeyDB, Valkey...)
+ROOM_BACKEND = os.getenv("YOLO_ROOM_BACKEND", "memory")
+ROOM_BACKEND_URL = os.getenv("YOLO_ROOM_BACKEND_URL", "redis://localhost:6379/0")
+# Định danh node (mỗi worker uvicorn là một node); media của phòng luôn nằm ở node giữ phòng
+ROOM_NODE_ID = os.getenv("YOLO_ROOM_NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Quyền giữ phòng hết hạn sau TTL nếu node chết (được gia hạn định kỳ khi node còn sống)
+ROOM_OWNER_TTL_S = _env_float("YOLO_ROOM_OWNER_TTL_S", 15.0)
+# Số message chờ publish lên backend; đầy thì bỏ message cũ nhất
+ROOM_PUBLISH_QUEUE = _env_int("YOLO_ROOM_PUBLISH_QUEUE", 1000)
+# Số message chờ chuyển tiếp tới mỗi client nối qua node khác; đầy -> coi client đã treo, ngắt kết nối
+ROOM_FORWARD_QUEUE = _env_int("YOLO_ROOM_FORWARD_QUEUE", 32)
+
+# --- METRIC (/metrics, định dạng Prometheus) ---
+# Mốc bucket (giây) của histogram thời gian từng bước xử lý
+METRICS_LATENCY_BUCKETS_S = [float(b) for b in _env_list(
+    "YOLO_METRICS_LATENCY_BUCKETS_S",
+    [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0])]
+
+# --- PROFILE THEO YÊU CẦU ---
+# Tắt (mặc định): không gắn middleware / endpoint nào, không tốn gì
+PROFILING_ENABLED = _env_int("YOLO_PROFILING_ENABLED", 0) == 1
+# Nếu đặt: bật profile và gọi /admin/profiles phải kèm header X-Profile-Token (WebSocket: trường "token")
+PROFILING_TOKEN = os.getenv("YOLO_PROFILING_TOKEN", "")
+PROFILING_DIR = os.getenv("YOLO_PROFILING_DIR", "runs/profiles")
+# Giữ tối đa N profile gần nhất trên đĩa
+PROFILING_MAX_PROFILES = _env_int("YOLO_PROFILING_MAX_PROFILES", 50)
+# Số profile chạy cùng lúc (mỗi profile lấy mẫu có một thread riêng)
+PROFILING_MAX_ACTIVE = _env_int("YOLO_PROFILING_MAX_ACTIVE", 2)
+# Chu kỳ lấy mẫu stack của mọi thread
+PROFILING_SAMPLE_INTERVAL_S = _env_float("YOLO_PROFILING_SAMPLE_INTERVAL_S", 0.005)
+# Profile stream: số frame suy luận tối đa và thời gian tối đa của một lần profile
+PROFILING_MAX_FRAMES = _env_int("YOLO_PROFILING_MAX_FRAMES", 300)
+PROFILING_STREAM_TIMEOUT_S = _env_float("YOLO_PROFILING_STREAM_TIMEOUT_S", 60.0)
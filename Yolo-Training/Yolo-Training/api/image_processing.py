@@ -1,13 +1,25 @@
 # /my_streaming_project/api/image_processing.py
 
 from fastapi import APIRouter, File, UploadFile
-from ultralytics import YOLO
-from PIL import Image
-import io
+from fastapi.responses import JSONResponse
 import logging
 
+from api.batching import BatchScheduler
+from api.config import CACHE_ENABLED, PREDICT_CLASSES, PREDICT_MODEL
+from api.inference_pool import InferenceQueueFull, inference_pool
+from api.ingest import decode_image
+from api.metrics import (PIPELINE_IMAGE, STAGE_DECODE, STAGE_EXTRACT, STAGE_QUEUE, STAGE_SERIALIZE,
+                         STAGE_UPLOAD_READ, StageTimer, observe_model_speed, stage_seconds)
+from api.model_registry import registry
+from api.postprocess import extract
+from api.result_cache import ResultCache, content_hash, perceptual_hash
+
 router = APIRouter()
-model = YOLO("yolov8n.pt") 
+# Model được load lazy qua registry dùng chung; các request đến cùng lúc
+# được gom thành một lần predict duy nhất
+scheduler = BatchScheduler(PREDICT_MODEL, name="predict_image", conf=0.25, imgsz=640)
+# Dashboard hay gửi lại cùng một ảnh chụp -> cache kết quả theo nội dung ảnh
+cache = ResultCache() if CACHE_ENABLED else None
 
 @router.post("/image")
 async def predict_image(file: UploadFile = File(...)):
@@ -16,28 +28,73 @@ async def predict_image(file: UploadFile = File(...)):
     """
     logging.info("Nhận được yêu cầu xử lý ảnh...")
     try:
+        # Đo từng bước (đọc upload, giải mã, hàng đợi, model, trích kết quả, JSON) -> /metrics
+        timer = StageTimer(PIPELINE_IMAGE)
         # Đọc nội dung file ảnh
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-
-        # Chạy model. Chạy trên CPU sẽ chậm hơn.
-        results = model.predict(source=image, conf=0.25, verbose=False, imgsz=640)
-
-        # Trích xuất kết quả
-        detections = []
-        if results and len(results) > 0:
-            r = results[0]
-            orig_shape = r.orig_shape
-            for box in r.boxes:
-                x1, y1, x2, y2 = map(float, box.xyxy[0])
-                conf = float(box.conf[0])
-                cls_id = int(box.cls[0])
-                label = model.names[cls_id]
-                detections.append({"label": label, "confidence": conf, "box": [x1, y1, x2, y2]})
-        
+        timer.mark(STAGE_UPLOAD_READ)
+
+        # Tra cache trước khi decode ảnh: trùng nội dung -> trả kết quả cũ ngay
+        if cache is not None:
+            key = content_hash(contents)
+            model_version = registry.version(PREDICT_MODEL)
+            cached = cache.get(key, model_version)
+            if cached is not None:
+                return _respond(timer, {**cached, "cache": "hit"})
+
+        # JPEG được giải mã thẳng ở độ phân giải gần imgsz; box được quy về ảnh gốc bên dưới
+        decoded = decode_image(contents)
+        image = decoded.image
+        timer.mark(STAGE_DECODE)
+
+        phash = None
+        if cache is not None:
+            if cache.use_phash:
+                phash = perceptual_hash(image)
+                cached = cache.get_similar(phash, decoded.orig_size, model_version)
+                if cached is not None:
+                    # Không lưu kết quả mượn theo sha256 của ảnh này: khớp nhầm thì cũng không bị giữ tới hết TTL
+                    return _respond(timer, {**cached, "cache": "near_hit"})
+            cache.miss()
+
+        # Chạy model qua bộ gom batch. Chạy trên CPU sẽ chậm hơn.
+        r, timing = await scheduler.submit(image)
+        stage_seconds.observe_ms(timing["queue_ms"], PIPELINE_IMAGE, STAGE_QUEUE)
+        observe_model_speed(PIPELINE_IMAGE, r, timing["inference_ms"])
+        timer.restart()
+
+        # Trích xuất kết quả (theo cột, không duyệt từng box)
+        dets = decoded.to_original(extract(r, classes=PREDICT_CLASSES))
+        detections = dets.to_records()
+        orig_shape = dets.orig_shape
+        timer.mark(STAGE_EXTRACT)
+
         logging.info(f"Phát hiện được: {detections}")
-        return {"detections": detections, "orig_shape": orig_shape}
+        result = {"detections": detections, "orig_shape": list(orig_shape)}
+        if cache is not None:
+            cache.put(key, result, model_version, phash, decoded.orig_size)
+        return _respond(timer, {**result, "timing": timing, "cache": "miss" if cache is not None else "off"})
 
+    except InferenceQueueFull:
+        # Để exception handler của app trả 503 + Retry-After
+        raise
     except Exception as e:
         logging.error(f"Lỗi khi xử lý ảnh: {e}")
-        return {"error": "Không thể xử lý ảnh."}
\ No newline at end of file
+        return {"error": "Không thể xử lý ảnh."}
+
+
+def _respond(timer: StageTimer, content: dict) -> JSONResponse:
+    # Tự tạo JSONResponse (thay vì để FastAPI encode sau khi trả về) để đo được bước serialize
+    response = JSONResponse(content)
+    timer.mark(STAGE_SERIALIZE)
+    return response
+
+
+@router.get("/stats")
+def predict_stats():
+    """
+    Thống kê gom batch (kích thước batch trung bình, độ trễ p50/p95/p99 mỗi request),
+    trạng thái pool suy luận (độ sâu hàng đợi, số request bị từ chối) và cache kết quả.
+    """
+    return {**scheduler.stats(), "pool": inference_pool.stats(),
+            "cache": cache.stats() if cache is not None else None}
\ No newline at end of file
@@ -0,0 +1,236 @@
+# /my_streaming_project/api/inference_pool.py
+
+import asyncio
+import itertools
+import logging
+import math
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from api.config import INFERENCE_EXECUTOR, INFERENCE_MAX_QUEUE, INFERENCE_RESERVED_INTERACTIVE, INFERENCE_WORKERS
+from api.metrics import registry as metrics
+from api.model_registry import registry
+
+# --- ĐỘ ƯU TIÊN (số nhỏ hơn được chạy trước) ---
+PRIORITY_INTERACTIVE = 0   # Ảnh chụp nhanh từ dashboard, người dùng đang chờ
+PRIORITY_STREAM = 5        # Frame từ luồng WebRTC trực tiếp
+PRIORITY_BACKGROUND = 10   # Job chạy nền (xử lý hàng loạt, video...)
+
+
+class InferenceQueueFull(Exception):
+    """Hàng đợi suy luận đã đầy; client nên thử lại sau `retry_after` giây."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__(f"Hàng đợi suy luận đã đầy, thử lại sau {retry_after}s.")
+        self.retry_after = retry_after
+
+
+# --- PHẦN CHẠY TRONG PROCESS CON (chế độ "process") ---
+# Mỗi process con có registry riêng: model được load một lần rồi giữ lại cho các job sau
+def _predict_in_process(model_name: str, images, predict_kwargs: Dict[str, Any]):
+    results = registry.predict(model_name, images, **predict_kwargs)
+    # Không gửi ảnh gốc ngược về process chính (tốn thời gian pickle)
+    for r in results:
+        r.orig_img = None
+    return results
+
+
+def _warmup_in_process(model_names):
+    registry.warmup_all(model_names)
+
+
+def _predict_in_thread(model, images, predict_kwargs: Dict[str, Any]):
+    # Các thread worker dùng chung model của registry -> predict có khoá theo model
+    return registry.predict(model, images, **predict_kwargs)
+
+
+class InferencePool:
+    """
+    Chạy mọi lệnh predict (blocking) trong một executor riêng, phía sau một
+    hàng đợi có giới hạn và có độ ưu tiên, để event loop luôn rảnh cho
+    WebSocket/signaling.
+    """
+
+    def __init__(self, mode: str = INFERENCE_EXECUTOR, max_workers: int = INFERENCE_WORKERS,
+                 max_queue: int = INFERENCE_MAX_QUEUE, reserved_interactive: int = INFERENCE_RESERVED_INTERACTIVE):
+        if mode not in ("thread", "process", "shm"):
+            raise ValueError(f"YOLO_INFERENCE_EXECUTOR không hợp lệ: '{mode}' (thread|process|shm)")
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(1, max_queue)
+        # Luôn chừa ít nhất một chỗ cho job không interactive
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_queue - 1)
+
+        self._executor: Optional[Executor] = None
+        self._shm = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = itertools.count()
+
+        self.busy_workers = 0
+        self.rejected = 0
+        self.completed = 0
+        self._avg_job_s = 0.0
+
+    def _ensure_started(self, warmup_models: Iterable[str] = ()):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        if self.mode == "shm":
+            if self._shm is None:
+                from api.shm_workers import ShmWorkerPool
+
+                self._shm = ShmWorkerPool(self.max_workers)
+                self._shm.start(list(warmup_models))
+        elif self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="yolo-infer")
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [loop.create_task(self._worker(), name=f"inference-worker-{i}")
+                         for i in range(self.max_workers)]
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def retry_after(self) -> int:
+        """Ước lượng số giây cần chờ để hàng đợi hiện tại được xử lý hết."""
+        pending = self.queue_depth() + self.busy_workers
+        return max(1, math.ceil(pending * self._avg_job_s / self.max_workers))
+
+    def check_capacity(self, extra: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        """
+        Ném InferenceQueueFull nếu nhận thêm `extra` job sẽ vượt giới hạn hàng đợi.
+        Job kém ưu tiên hơn interactive có giới hạn thấp hơn `reserved_interactive` chỗ.
+        """
+        limit = self.max_queue
+        if priority > PRIORITY_INTERACTIVE:
+            limit -= self.reserved_interactive
+        if self.queue_depth() + extra >= limit:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after())
+
+    async def predict(self, model, images, priority: int = PRIORITY_INTERACTIVE, **predict_kwargs):
+        """
+        Chạy `model.predict(images)` trong executor và trả về danh sách Results.
+        `model` là tên trong registry (khuyên dùng) hoặc một đối tượng YOLO đã load.
+        """
+        self._ensure_started()
+        self.check_capacity(priority=priority)
+
+        if self.mode in ("process", "shm"):
+            if not isinstance(model, str):
+                raise TypeError(f"Chế độ {self.mode} cần tên model trong registry, không phải đối tượng YOLO.")
+            # Model không pickle được -> gửi tên, process con tự load qua registry của nó
+            job = (_predict_in_process, model, images, predict_kwargs)
+        else:
+            job = (_predict_in_thread, model, images, predict_kwargs)
+
+        future = self._loop.create_future()
+        await self._queue.put((priority, next(self._seq), job, future))
+        return await future
+
+    async def _worker(self):
+        while True:
+            _, _, (fn, *args), future = await self._queue.get()
+            if future.done():  # request đã bị huỷ trong lúc chờ
+                continue
+            self.busy_workers += 1
+            started = time.perf_counter()
+            try:
+                if self.mode == "shm":
+                    # Ảnh đi qua bộ nhớ chia sẻ, kết quả về dạng mảng gọn
+                    result = await self._shm.predict(*args)
+                else:
+                    result = await self._loop.run_in_executor(self._executor, fn, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.busy_workers -= 1
+                self.completed += 1
+                # Trung bình trượt thời gian một job, dùng để tính Retry-After
+                elapsed = time.perf_counter() - started
+                self._avg_job_s = elapsed if self._avg_job_s == 0 else 0.8 * self._avg_job_s + 0.2 * elapsed
+
+    async def warmup(self, model_names: Iterable[str]):
+        """Load + chạy thử các model trên chính các worker sẽ phục vụ request."""
+        model_names = list(model_names)
+        if self.mode in ("process", "shm"):
+            # Export ONNX/OpenVINO một lần ở process chính trước khi các worker cùng load
+            await asyncio.get_running_loop().run_in_executor(None, registry.prepare, model_names)
+        self._ensure_started(model_names)
+        if self.mode == "shm":
+            # Mỗi worker tự warmup ngay khi khởi động rồi báo "ready"
+            await self._shm.wait_ready()
+        elif self.mode == "process":
+            # Mỗi process con có bản model riêng -> warmup trên từng worker
+            await asyncio.gather(*(
+                self._loop.run_in_executor(self._executor, _warmup_in_process, model_names)
+                for _ in range(self.max_workers)
+            ))
+        else:
+            await self._loop.run_in_executor(self._executor, registry.warmup_all, model_names)
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "reserved_interactive": self.reserved_interactive,
+            "queue_depth": self.queue_depth(),
+            "busy_workers": self.busy_workers,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_job_ms": round(self._avg_job_s * 1000.0, 2),
+        }
+        if self._shm is not None:
+            stats["shm"] = self._shm.stats()
+        return stats
+
+
+# Pool dùng chung cho toàn bộ process
+inference_pool = InferencePool()
+
+metrics.gauge("yolo_inference_queue_depth", "Số job đang chờ worker suy luận").add_collector(
+    lambda: [({}, inference_pool.queue_depth())])
+metrics.gauge("yolo_inference_busy_workers", "Số worker suy luận đang chạy").add_collector(
+    lambda: [({}, inference_pool.busy_workers)])
+metrics.gauge("yolo_inference_rejected_total", "Số job bị từ chối vì hàng đợi đầy",
+              kind="counter").add_collector(lambda: [({}, inference_pool.rejected)])
+
+
+async def _queue_full_handler(request: Request, exc: InferenceQueueFull):
+    logging.warning(f"Từ chối request {request.url.path}: hàng đợi suy luận đã đầy.")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Server đang quá tải, vui lòng thử lại sau.", "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def install_overload_handler(app: FastAPI):
+    """Trả 503 + Retry-After thay vì để độ trễ dồn lên khi hàng đợi đầy."""
+    app.add_exception_handler(InferenceQueueFull, _queue_full_handler)
@@ -0,0 +1,92 @@
+# /my_streaming_project/api/ingest.py
+
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image
+
+from api.config import DECODE_TARGET_SIZE, REDUCED_DECODE
+from api.postprocess import Detections
+
+
+class DecodedImage:
+    """Ảnh đã giải mã (có thể ở độ phân giải giảm) kèm kích thước gốc để quy đổi box."""
+
+    __slots__ = ("image", "orig_size")
+
+    def __init__(self, image: Image.Image, orig_size: Tuple[int, int]):
+        self.image = image
+        self.orig_size = orig_size  # (width, height) của file gốc
+
+    @property
+    def orig_shape(self) -> Tuple[int, int]:
+        return self.orig_size[1], self.orig_size[0]
+
+    @property
+    def scale(self) -> Tuple[float, float]:
+        """Hệ số (x, y) từ toạ độ ảnh đã giải mã sang toạ độ ảnh gốc."""
+        return self.orig_size[0] / self.image.width, self.orig_size[1] / self.image.height
+
+    @property
+    def reduced(self) -> bool:
+        return self.image.size != self.orig_size
+
+    def to_original(self, dets: Detections) -> Detections:
+        """Đưa box về toạ độ ảnh gốc (không đổi gì nếu ảnh được giải mã đủ độ phân giải)."""
+        if not self.reduced:
+            return dets
+        sx, sy = self.scale
+        xyxy = dets.xyxy * [sx, sy, sx, sy]
+        return Detections(xyxy.astype(dets.xyxy.dtype), dets.conf, dets.cls, dets.labels, self.orig_shape)
+
+
+def decode_image(contents: bytes, target_size: int = DECODE_TARGET_SIZE,
+                 reduced: bool = REDUCED_DECODE) -> DecodedImage:
+    """
+    Giải mã ảnh upload sang RGB. Với JPEG, `draft` cho libjpeg giải mã thẳng ở
+    scale 1/2, 1/4 hoặc 1/8 (trong miền DCT) sao cho cạnh ngắn vẫn >= `target_size`:
+    ảnh 12MP từ điện thoại không bao giờ phải bung ra đủ kích thước rồi mới thu nhỏ.
+    Định dạng khác vẫn giải mã đầy đủ như trước.
+    """
+    image = Image.open(BytesIO(contents))
+    orig_size = image.size
+    if reduced and image.format == "JPEG" and target_size > 0:
+        # draft chọn mức giảm lớn nhất mà cả hai cạnh vẫn >= kích thước yêu cầu
+        image.draft("RGB", (target_size, target_size))
+    return DecodedImage(image.convert("RGB"), orig_size)
+
+
+def _peak_rss_mb(path: str, target_size: int, reduced: bool) -> float:
+    # Đo trong process mới: bộ nhớ đỉnh (RSS) tăng thêm khi giải mã một ảnh
+    import subprocess
+    import sys
+
+    code = ("import resource; from api.ingest import decode_image; "
+            f"c = open({path!r}, 'rb').read(); b = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss; "
+            f"decode_image(c, {target_size}, reduced={reduced}); "
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - b)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return int(out.stdout.strip()) / 1024.0
+
+
+if __name__ == "__main__":
+    # So sánh thời gian giải mã và bộ nhớ đỉnh: python -m api.ingest anh.jpg [target_size]
+    import sys
+    import time
+
+    path = sys.argv[1]
+    target = int(sys.argv[2]) if len(sys.argv) > 2 else DECODE_TARGET_SIZE
+    with open(path, "rb") as f:
+        contents = f.read()
+
+    # Đo bộ nhớ trước khi process này giải mã gì: process con thừa hưởng mức RSS đỉnh của process cha
+    peaks = {use_reduced: _peak_rss_mb(path, target, use_reduced) for use_reduced in (False, True)}
+    for label, use_reduced in (("đầy đủ", False), ("giảm", True)):
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            decoded = decode_image(contents, target, reduced=use_reduced)
+            timings.append((time.perf_counter() - started) * 1000.0)
+        w, h = decoded.image.size
+        print(f"{label:>7}: {w}x{h}  giải mã {min(timings):7.1f} ms"
+              f"  bộ nhớ đỉnh +{peaks[use_reduced]:6.1f} MB")
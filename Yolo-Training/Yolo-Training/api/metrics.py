@@ -0,0 +1,185 @@
+# /my_streaming_project/api/metrics.py
+
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from api.config import METRICS_LATENCY_BUCKETS_S
+
+# Metric dạng Prometheus (text exposition 0.0.4), không cần prometheus_client. Ghi một
+# mẫu chỉ là bisect + cộng vài số (luôn bật được); gauge như độ sâu hàng đợi, FPS theo
+# phòng, số viewer được đọc từ stats() sẵn có lúc /metrics được gọi, không tốn gì khi chạy.
+
+# Các bước được đo trong histogram yolo_stage_seconds
+STAGE_UPLOAD_READ = "upload_read"
+STAGE_DECODE = "decode"
+STAGE_QUEUE = "queue"
+STAGE_PREPROCESS = "preprocess"
+STAGE_INFERENCE = "inference"
+STAGE_POSTPROCESS = "postprocess"
+STAGE_EXTRACT = "extract"  # Results -> cột Detections -> bản ghi JSON (sau NMS của model)
+STAGE_SERIALIZE = "serialize"
+STAGE_SEND = "send"
+
+# Hàm thu thập gauge lúc scrape: trả về danh sách (nhãn, giá trị)
+Collector = Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS_S):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = sorted(float(b) for b in buckets if not math.isinf(float(b)))
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def observe(self, value: float, *labels: str):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(len(self.bounds) + 1)
+        # bucket "le" đầu tiên >= value; vượt mọi mốc -> bucket +Inf (phần tử cuối)
+        child.counts[bisect_left(self.bounds, value)] += 1
+        child.sum += value
+
+    def observe_ms(self, value_ms: float, *labels: str):
+        self.observe(value_ms / 1000.0, *labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + [math.inf], child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge (hoặc counter) mà giá trị được đọc lúc scrape qua các collector."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._collectors: List[Collector] = []
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for collector in self._collectors:
+            for labels, value in collector():
+                values = [labels.get(n, "") for n in self.labelnames]
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, documentation, labelnames, **kwargs)
+        return self._metrics[name]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), kind: str = "gauge") -> Gauge:
+        if name not in self._metrics:
+            self._metrics[name] = Gauge(name, documentation, labelnames, kind)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+PIPELINE_IMAGE = "predict_image"
+PIPELINE_STREAM = "stream"
+
+# Thời gian từng bước của mỗi pipeline
+stage_seconds = registry.histogram(
+    "yolo_stage_seconds", "Thời gian từng bước xử lý (giây)", ("pipeline", "stage"))
+
+
+class StageTimer:
+    """Đo lần lượt các bước của một request: mỗi lần mark() ghi thời gian từ lần mark trước."""
+    __slots__ = ("pipeline", "_last")
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self._last = time.perf_counter()
+
+    def restart(self):
+        """Bắt đầu đo lại từ bây giờ (bỏ qua đoạn vừa rồi, vd. đã được đo theo cách khác)."""
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        stage_seconds.observe(elapsed, self.pipeline, stage)
+        return elapsed * 1000.0
+
+
+def observe_model_speed(pipeline: str, r, fallback_inference_ms: Optional[float] = None):
+    """
+    Ghi preprocess / inference / postprocess mà Ultralytics đo cho mỗi ảnh (Results.speed, ms).
+    Kết quả không có speed (worker shm trả mảng gọn) -> chỉ ghi thời gian batch làm inference.
+    """
+    speed = getattr(r, "speed", None)
+    if speed:
+        for stage in (STAGE_PREPROCESS, STAGE_INFERENCE, STAGE_POSTPROCESS):
+            if speed.get(stage) is not None:
+                stage_seconds.observe(speed[stage] / 1000.0, pipeline, stage)
+    elif fallback_inference_ms is not None:
+        stage_seconds.observe(fallback_inference_ms / 1000.0, pipeline, STAGE_INFERENCE)
+
+
+def metrics_router() -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/metrics")
+    def metrics():
+        return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return router
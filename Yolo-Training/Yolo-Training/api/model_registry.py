@@ -0,0 +1,150 @@
+# /my_streaming_project/api/model_registry.py
+
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from api.backends import backend_for, export_model, load_with_backend, parse_variant
+from api.config import MODEL_WEIGHTS, PREDICT_MODEL, WARMUP_IMGSZ
+
+
+class ModelRegistry:
+    """
+    Nơi duy nhất load model YOLO trong một process. Mỗi model chỉ được load
+    một lần (lazy, lần đầu có người cần) và được dùng chung bởi mọi router.
+    Backend ONNX/OpenVINO chỉ được dùng khi đã qua kiểm tra parity với PyTorch.
+    Predictor của Ultralytics giữ trạng thái của lần gọi (args, dataset, batch) ngay trên
+    model nên không thread-safe: mọi lệnh predict phải đi qua predict() để được khoá theo model.
+    """
+
+    def __init__(self, weights: Dict[str, str]):
+        self._weights = dict(weights)
+        self._models: Dict[str, Any] = {}
+        self._warm: set = set()
+        self._load_ms: Dict[str, float] = {}
+        self._backends: Dict[str, str] = {}
+        self._parity: Dict[str, Dict[str, Any]] = {}
+        # _lock chỉ giữ trong chốc lát (tra / thêm khoá); load model dùng khoá riêng theo tên
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._predict_locks: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+
+    def resolve(self, name: str) -> str:
+        """
+        Tên model -> đường dẫn trọng số .pt. Tên lạ được coi là đường dẫn trực tiếp;
+        hậu tố biến thể (vd. "apple-leaf:int8") dùng chung trọng số với model gốc.
+        """
+        base, _ = parse_variant(name)
+        return self._weights.get(base, base)
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        # Khoá theo tên: load một model (export, calibration INT8, parity có thể mất vài phút)
+        # không chặn việc load model khác hay predict trên các model đã load
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            # Kiểm tra lại sau khi có lock: thread khác có thể vừa load xong
+            model = self._models.get(name)
+            if model is None:
+                weights = self.resolve(name)
+                logging.info(f"Đang load model '{name}' từ '{weights}'...")
+                started = time.perf_counter()
+                model = self._load(name, weights)
+                self._load_ms[name] = (time.perf_counter() - started) * 1000.0
+                self._models[name] = model
+        return model
+
+    def predict_lock(self, model) -> threading.Lock:
+        with self._lock:
+            lock = self._predict_locks.get(model)
+            if lock is None:
+                lock = self._predict_locks[model] = threading.Lock()
+            return lock
+
+    def predict(self, model, images, **predict_kwargs):
+        """model.predict() (model là tên hoặc đối tượng đã load), mỗi model chỉ một lệnh tại một thời điểm."""
+        if isinstance(model, str):
+            model = self.get(model)
+        with self.predict_lock(model):
+            return model.predict(source=images, verbose=False, **predict_kwargs)
+
+    def _load(self, name: str, weights: str):
+        from ultralytics import YOLO
+
+        backend = backend_for(name)
+        int8 = parse_variant(name)[1] == "int8"
+        if backend != "torch":
+            try:
+                candidate, report = load_with_backend(weights, backend, int8=int8)
+                self._parity[name] = report
+                if report["passed"]:
+                    self._backends[name] = f"{backend}-int8" if int8 else backend
+                    logging.info(f"Model '{name}' phục vụ bằng {backend} (parity {report['match_rate']:.2%}).")
+                    return candidate
+                logging.error(f"Parity {backend} của model '{name}' không đạt, dùng PyTorch FP32: {report}")
+            except Exception as e:
+                logging.error(f"Không dùng được backend {backend} cho model '{name}', dùng PyTorch FP32: {e}")
+        self._backends[name] = "torch"
+        return YOLO(weights)
+
+    def prepare(self, names: Iterable[str]):
+        """Export trước các model ONNX/OpenVINO để nhiều process worker không cùng export một lúc."""
+        for name in names:
+            backend = backend_for(name)
+            if backend != "torch":
+                try:
+                    export_model(self.resolve(name), backend, int8=parse_variant(name)[1] == "int8")
+                except Exception as e:
+                    logging.error(f"Lỗi export model '{name}' sang {backend}: {e}")
+
+    def warmup(self, name: str, imgsz: int = WARMUP_IMGSZ):
+        """Chạy thử một ảnh trống để khởi tạo trước (tránh cold-start ở request đầu)."""
+        started = time.perf_counter()
+        self.predict(name, np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz)
+        self._warm.add(name)
+        logging.info(f"Model '{name}' đã warmup ({(time.perf_counter() - started) * 1000.0:.0f} ms).")
+
+    def warmup_all(self, names: Iterable[str]):
+        for name in names:
+            self.warmup(name)
+
+    def is_warm(self, names: Iterable[str]) -> bool:
+        return all(name in self._warm for name in names)
+
+    def version(self, name: str) -> str:
+        """Định danh phiên bản model (đường dẫn + thời điểm sửa file trọng số)."""
+        weights = self.resolve(name)
+        try:
+            mtime = int(os.path.getmtime(weights))
+        except OSError:
+            mtime = 0
+        return f"{name}@{weights}:{mtime}"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "weights": self.resolve(name),
+                "loaded": name in self._models,
+                "warm": name in self._warm,
+                "load_ms": round(self._load_ms.get(name, 0.0), 1),
+                "backend": self._backends.get(name, backend_for(name)),
+                "parity": self._parity.get(name),
+            }
+            for name in sorted(set(self._weights) | set(self._models))
+        }
+
+
+# Registry dùng chung cho toàn bộ process
+registry = ModelRegistry(MODEL_WEIGHTS)
+
+
+def get_model(name: Optional[str] = None):
+    return registry.get(name or PREDICT_MODEL)
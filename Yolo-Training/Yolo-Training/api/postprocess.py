@@ -0,0 +1,110 @@
+# /my_streaming_project/api/postprocess.py
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Hậu xử lý kết quả YOLO theo cột: lấy box / điểm / class của cả ảnh một lần dưới
+# dạng mảng NumPy, đổi nhãn và lọc class bằng bảng tra (LUT) theo class id, rồi
+# serialize thẳng từ mảng (tolist) thay vì duyệt từng `box` của ultralytics.
+
+# Kiểu bản ghi mỗi detection mà các endpoint đang trả về
+RECORD_BOX = "box"          # {"label", "confidence", "box": [x1, y1, x2, y2]}
+RECORD_CORNERS = "corners"  # {"label", "confidence", "x1", "y1", "x2", "y2"}
+RECORD_BBOX = "bbox"        # {"label", "confidence", "bbox": [x1, y1, x2, y2]}
+
+
+@lru_cache(maxsize=64)
+def _label_tables(names: Tuple[Tuple[int, str], ...], relabel: Tuple[Tuple[str, str], ...],
+                  classes: Tuple[Any, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    size = max((cls_id for cls_id, _ in names), default=-1) + 1
+    labels = np.full(size, "", dtype=object)
+    keep = np.ones(size, dtype=bool)
+    relabel_map = {source.upper(): target for source, target in relabel}
+    # Class id có thể là số nguyên hoặc chuỗi số (từ biến môi trường)
+    wanted_ids = {int(c) for c in classes if isinstance(c, int) or str(c).isdigit()}
+    wanted_names = {str(c).upper() for c in classes}
+    for cls_id, name in names:
+        # Đổi nhãn không phân biệt hoa thường (như logic FRUIT_LABELS_TO_BE_APPLE cũ)
+        labels[cls_id] = relabel_map.get(name.upper(), name)
+        if classes:
+            keep[cls_id] = cls_id in wanted_ids or name.upper() in wanted_names
+    return labels, keep
+
+
+def label_tables(names, relabel: Optional[Dict[str, str]] = None,
+                 classes: Optional[Iterable[Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    LUT theo class id: (nhãn cuối cùng sau khi đổi tên, mặt nạ class được giữ lại).
+    `classes` gồm tên class (không phân biệt hoa thường) hoặc class id; rỗng = giữ tất cả.
+    Kết quả được cache theo bộ tham số, nên chỉ xây một lần cho mỗi model.
+    """
+    items = names.items() if isinstance(names, dict) else enumerate(names)
+    return _label_tables(tuple(sorted((int(k), str(v)) for k, v in items)),
+                         tuple(sorted((relabel or {}).items())),
+                         tuple(classes or ()))
+
+
+class Detections:
+    """Detection của một ảnh dạng cột: xyxy (N, 4), conf (N,), cls (N,), labels (N,)."""
+
+    __slots__ = ("xyxy", "conf", "cls", "labels", "orig_shape")
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, labels: np.ndarray,
+                 orig_shape: Tuple[int, int]):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.labels = labels
+        self.orig_shape = orig_shape
+
+    def __len__(self) -> int:
+        return len(self.conf)
+
+    def to_records(self, style: str = RECORD_BOX, decimals: Optional[int] = None,
+                   integer_boxes: bool = False) -> List[Dict[str, Any]]:
+        """Danh sách dict theo định dạng cũ của endpoint, tạo trực tiếp từ mảng."""
+        boxes = self.xyxy.astype(np.int64) if integer_boxes else self.xyxy.astype(np.float64)
+        conf = self.conf.astype(np.float64)
+        if decimals is not None:
+            conf = conf.round(decimals)
+        boxes, conf, labels = boxes.tolist(), conf.tolist(), self.labels.tolist()
+        if style == RECORD_CORNERS:
+            return [{"label": label, "confidence": c, "x1": b[0], "y1": b[1], "x2": b[2], "y2": b[3]}
+                    for label, c, b in zip(labels, conf, boxes)]
+        key = "bbox" if style == RECORD_BBOX else "box"
+        return [{"label": label, "confidence": c, key: b} for label, c, b in zip(labels, conf, boxes)]
+
+    def to_columns(self) -> Dict[str, Any]:
+        """Định dạng cột gọn cho JSON: mỗi trường là một danh sách."""
+        return {
+            "labels": self.labels.tolist(),
+            "confidences": self.conf.astype(np.float64).tolist(),
+            "boxes": self.xyxy.astype(np.float64).tolist(),
+        }
+
+
+def extract(r, relabel: Optional[Dict[str, str]] = None, classes: Optional[Iterable[Any]] = None) -> Detections:
+    """Lấy detection của một `Results` ultralytics thành mảng, áp dụng đổi nhãn / lọc class."""
+    data = r.boxes.cpu().numpy().data
+    data = np.asarray(data, dtype=np.float32).reshape(-1, data.shape[-1] if data.ndim == 2 else 6)
+    # Cột cuối luôn là (conf, cls); kết quả tracking của ultralytics có thêm cột id ở giữa
+    xyxy, conf, cls = data[:, :4], data[:, -2], data[:, -1].astype(np.int64)
+
+    labels_lut, keep_lut = label_tables(r.names, relabel, classes)
+    if len(labels_lut) == 0:
+        labels_lut, keep_lut = np.array([""], dtype=object), np.ones(1, dtype=bool)
+    lut_idx = np.clip(cls, 0, len(labels_lut) - 1)
+    keep = keep_lut[lut_idx]
+    if not keep.all():
+        xyxy, conf, cls, lut_idx = xyxy[keep], conf[keep], cls[keep], lut_idx[keep]
+    return Detections(xyxy, conf, cls, labels_lut[lut_idx], tuple(r.orig_shape))
+
+
+def set_record_box(record: Dict[str, Any], box: List[float], style: str = RECORD_BOX):
+    """Ghi toạ độ box vào một bản ghi theo đúng kiểu bản ghi (dùng cho box nội suy)."""
+    if style == RECORD_CORNERS:
+        record["x1"], record["y1"], record["x2"], record["y2"] = box
+    else:
+        record["bbox" if style == RECORD_BBOX else "box"] = box
@@ -0,0 +1,330 @@
+# /my_streaming_project/api/profiling.py
+
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse
+
+from api.config import (
+    PROFILING_DIR,
+    PROFILING_ENABLED,
+    PROFILING_MAX_ACTIVE,
+    PROFILING_MAX_FRAMES,
+    PROFILING_MAX_PROFILES,
+    PROFILING_SAMPLE_INTERVAL_S,
+    PROFILING_STREAM_TIMEOUT_S,
+    PROFILING_TOKEN,
+)
+
+# Profile theo yêu cầu cho một request HTTP (header X-Profile) hoặc N frame tiếp theo của
+# một phòng stream (message "profile" trên WebSocket signaling). Khi YOLO_PROFILING_ENABLED=0
+# không có middleware / endpoint nào được gắn, nên đường xử lý bình thường không đổi gì.
+#   sample  : một thread lấy mẫu stack của MỌI thread (event loop, thread suy luận, thread
+#             giải mã) -> file .folded (flamegraph.pl, speedscope.app)
+#   cprofile: cProfile trên thread event loop trong lúc request chạy (gồm cả coroutine khác
+#             chạy xen) -> file .pstats (python -m pstats, snakeviz)
+# Worker suy luận chạy ở process riêng (YOLO_INFERENCE_EXECUTOR=shm) không nằm trong profile.
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+TOKEN_HEADER = "X-Profile-Token"
+MODE_SAMPLE = "sample"
+MODE_CPROFILE = "cprofile"
+_PROFILE_ID = re.compile(r"[0-9a-f]{32}")
+_EXTENSIONS = {MODE_SAMPLE: ".folded", MODE_CPROFILE: ".pstats"}
+
+
+def check_token(value: Optional[str]) -> bool:
+    return not PROFILING_TOKEN or hmac.compare_digest(value or "", PROFILING_TOKEN)
+
+
+class SamplingProfiler:
+    """Lấy mẫu sys._current_frames() theo chu kỳ; gom stack dạng "thread;ngoài;...;trong" -> số mẫu."""
+
+    def __init__(self, interval_s: float = PROFILING_SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="yolo-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        # Lấy mẫu ngay khi bắt đầu: request rất ngắn vẫn có ít nhất một mẫu
+        while True:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if self._stop.wait(self.interval_s):
+                break
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self, top: int = 15) -> Dict[str, Any]:
+        # Hàm ở đỉnh stack xuất hiện nhiều nhất (gồm cả thread đang chờ: select, wait...)
+        self_counts: Counter = Counter()
+        threads: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            threads[frames[0]] += count
+            self_counts[frames[-1]] += count
+        return {"samples": self.samples, "interval_ms": self.interval_s * 1000.0,
+                "threads": dict(threads.most_common()),
+                "top_self": [[name, count] for name, count in self_counts.most_common(top)]}
+
+
+class CProfileProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path: str):
+        self.profile.dump_stats(path)
+
+    def summary(self, top: int = 15) -> Dict[str, Any]:
+        stats = sorted(self.profile.getstats(), key=lambda entry: entry.totaltime, reverse=True)[:top]
+        return {"top_cumulative": [[_code_label(entry.code), round(entry.totaltime * 1000.0, 3)] for entry in stats]}
+
+
+def _code_label(code) -> str:
+    if isinstance(code, str):
+        return code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileStore:
+    """Profile lưu thành <id>.json (mô tả) + <id>.folded | <id>.pstats; chỉ giữ N profile gần nhất."""
+
+    def __init__(self, directory: str = PROFILING_DIR, max_profiles: int = PROFILING_MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.active >= PROFILING_MAX_ACTIVE:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def save(self, meta: Dict[str, Any], profiler):
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump(os.path.join(self.directory, meta["id"] + _EXTENSIONS[meta["mode"]]))
+        with open(os.path.join(self.directory, meta["id"] + ".json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self._prune()
+
+    def _prune(self):
+        metas = self.list()
+        for meta in metas[self.max_profiles:]:
+            for ext in (".json", _EXTENSIONS.get(meta.get("mode"), "")):
+                try:
+                    os.remove(os.path.join(self.directory, meta["id"] + ext))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Mô tả mọi profile, mới nhất trước."""
+        if not os.path.isdir(self.directory):
+            return []
+        metas = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and _PROFILE_ID.fullmatch(name[:-5]):
+                try:
+                    with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                        metas.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(metas, key=lambda m: m.get("started_at", 0), reverse=True)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        if not _PROFILE_ID.fullmatch(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def data_path(self, meta: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, meta["id"] + _EXTENSIONS[meta["mode"]])
+
+
+store = ProfileStore()
+
+
+class Profile:
+    """Một lần profile đang chạy; finish() dừng profiler và ghi xuống store."""
+
+    def __init__(self, kind: str, target: str, mode: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.mode = mode
+        self.profiler = CProfileProfiler() if mode == MODE_CPROFILE else SamplingProfiler()
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.profiler.start()
+
+    def finish(self, **extra) -> Dict[str, Any]:
+        try:
+            self.profiler.stop()
+            meta = {"id": self.id, "kind": self.kind, "target": self.target, "mode": self.mode,
+                    "started_at": self.started_at,
+                    "duration_ms": round((time.perf_counter() - self._started) * 1000.0, 3),
+                    **extra, **self.profiler.summary()}
+            store.save(meta, self.profiler)
+            logging.info(f"🔬 Đã lưu profile {self.id} ({self.kind} {self.target}, {meta['duration_ms']:.0f} ms)")
+            return meta
+        finally:
+            store.release()
+
+
+def start_profile(kind: str, target: str, mode: str = MODE_SAMPLE) -> Optional[Profile]:
+    """Bắt đầu profile; None nếu đã đủ PROFILING_MAX_ACTIVE profile đang chạy (hoặc không bật được)."""
+    if not store.acquire():
+        logging.warning(f"Bỏ qua yêu cầu profile {kind} {target}: đã có {PROFILING_MAX_ACTIVE} profile đang chạy")
+        return None
+    try:
+        return Profile(kind, target, mode)
+    except ValueError as e:
+        # cProfile khác đang bật trên thread này
+        store.release()
+        logging.warning(f"Không bật được profile {mode} cho {kind} {target}: {e}")
+        return None
+
+
+def parse_frame_count(value) -> int:
+    """Số frame cần profile lấy từ message WebSocket; ValueError nếu không phải số nguyên dương."""
+    error = ValueError(f"'frames' phải là số nguyên dương, nhận được {value!r}")
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise error
+    try:
+        frames = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise error from None
+    if frames < 1:
+        raise error
+    return min(frames, PROFILING_MAX_FRAMES)
+
+
+async def profile_stream(processor, frames: int, target: str) -> Optional[Dict[str, Any]]:
+    """
+    Profile (lấy mẫu) trong lúc processor suy luận thêm `frames` frame, tối đa
+    PROFILING_STREAM_TIMEOUT_S giây hoặc tới khi track kết thúc. Chỉ theo dõi bộ đếm
+    frames_processed từ bên ngoài: đường xử lý frame không có thêm bước kiểm tra nào.
+    """
+    frames = max(1, min(frames, PROFILING_MAX_FRAMES))
+    profile = start_profile("stream", target)
+    if profile is None:
+        return None
+    loop = asyncio.get_running_loop()
+    first = processor.frames_processed
+    deadline = loop.time() + PROFILING_STREAM_TIMEOUT_S
+    try:
+        while (processor.frames_processed - first < frames and processor.readyState == "live"
+               and loop.time() < deadline):
+            await asyncio.sleep(0.05)
+    finally:
+        meta = profile.finish(frames_requested=frames, frames_processed=processor.frames_processed - first)
+    return meta
+
+
+def profiling_router() -> APIRouter:
+    router = APIRouter()
+
+    def _authorize(token: Optional[str]):
+        if not check_token(token):
+            raise HTTPException(status_code=403, detail="Sai hoặc thiếu X-Profile-Token")
+
+    @router.get("/admin/profiles")
+    def list_profiles(x_profile_token: Optional[str] = Header(None)):
+        _authorize(x_profile_token)
+        return {"active": store.active, "profiles": store.list()}
+
+    @router.get("/admin/profiles/{profile_id}")
+    def download_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+        _authorize(x_profile_token)
+        meta = store.get(profile_id)
+        if meta is None or not os.path.isfile(store.data_path(meta)):
+            raise HTTPException(status_code=404, detail="Profile không tồn tại hoặc đã bị xoá")
+        path = store.data_path(meta)
+        return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+
+    @router.get("/admin/profiles/{profile_id}/meta")
+    def profile_meta(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+        _authorize(x_profile_token)
+        meta = store.get(profile_id)
+        if meta is None:
+            raise HTTPException(status_code=404, detail="Profile không tồn tại hoặc đã bị xoá")
+        return meta
+
+    return router
+
+
+def install_profiling(app: FastAPI):
+    """Gắn middleware X-Profile + endpoint /admin/profiles; không làm gì khi YOLO_PROFILING_ENABLED=0."""
+    if not PROFILING_ENABLED:
+        return
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        mode = request.headers.get(PROFILE_HEADER)
+        if not mode or not check_token(request.headers.get(TOKEN_HEADER)):
+            return await call_next(request)
+        mode = MODE_CPROFILE if mode.lower() == MODE_CPROFILE else MODE_SAMPLE
+        profile = start_profile("http", f"{request.method} {request.url.path}", mode)
+        if profile is None:
+            return await call_next(request)
+        status = None
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            profile.finish(status_code=status)
+        response.headers[PROFILE_ID_HEADER] = profile.id
+        return response
+
+    app.include_router(profiling_router(), tags=["Root"])
+    logging.info(f"🔬 Profile theo yêu cầu đang bật (header {PROFILE_HEADER}, /admin/profiles)")
@@ -0,0 +1,150 @@
+# /my_streaming_project/api/result_cache.py
+
+import hashlib
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from api.config import CACHE_MAX_MB, CACHE_PHASH_DISTANCE, CACHE_PHASH_MAX_SCAN, CACHE_TTL_S
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """dHash 64 bit: so sánh độ sáng các pixel kề nhau trên ảnh xám 9x8."""
+    small = image.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return bits
+
+
+class _Entry:
+    __slots__ = ("value", "size", "created_at", "model_version", "phash", "image_size")
+
+    def __init__(self, value, size: int, model_version: str, phash: Optional[int], image_size):
+        self.value = value
+        self.size = size
+        self.created_at = time.monotonic()
+        self.model_version = model_version
+        self.phash = phash
+        self.image_size = image_size
+
+
+class ResultCache:
+    """
+    Cache LRU kết quả suy luận theo nội dung ảnh: khoá chính là sha256 của file
+    upload, tuỳ chọn kèm dHash để nhận ra ảnh gần giống (chụp lại cùng một cảnh). Mỗi entry
+    ghi phiên bản model; đổi model -> entry cũ tự mất hiệu lực. Giới hạn theo TTL
+    và tổng dung lượng (ước lượng theo kích thước JSON của kết quả).
+    """
+
+    def __init__(self, max_mb: float = CACHE_MAX_MB, ttl_s: float = CACHE_TTL_S,
+                 phash_distance: int = CACHE_PHASH_DISTANCE, phash_max_scan: int = CACHE_PHASH_MAX_SCAN):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_s = ttl_s
+        self.phash_distance = phash_distance
+        self.phash_max_scan = max(1, phash_max_scan)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    @property
+    def use_phash(self) -> bool:
+        return self.phash_distance >= 0
+
+    def _valid(self, key: str, entry: _Entry, model_version: str) -> bool:
+        if time.monotonic() - entry.created_at > self.ttl_s:
+            self.expired += 1
+        elif entry.model_version != model_version:
+            self.invalidated += 1
+        else:
+            return True
+        self._remove(key)
+        return False
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def get(self, key: str, model_version: str) -> Optional[Any]:
+        """Tra theo sha256 (không cần decode ảnh)."""
+        entry = self._entries.get(key)
+        if entry is None or not self._valid(key, entry, model_version):
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_similar(self, phash: int, image_size: Tuple[int, int], model_version: str) -> Optional[Any]:
+        """
+        Tra ảnh gần giống theo dHash; chỉ khớp ảnh cùng kích thước để toạ độ box vẫn đúng.
+        Chỉ xét `phash_max_scan` entry dùng gần nhất để mỗi lần miss tốn thời gian có giới hạn.
+        """
+        best_key, best_distance = None, self.phash_distance + 1
+        recent = list(itertools.islice(reversed(self._entries.items()), self.phash_max_scan))
+        for key, entry in recent:
+            if entry.phash is None or entry.image_size != image_size:
+                continue
+            distance = bin(entry.phash ^ phash).count("1")
+            if distance < best_distance and self._valid(key, entry, model_version):
+                best_key, best_distance = key, distance
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        self.near_hits += 1
+        return self._entries[best_key].value
+
+    def miss(self):
+        self.misses += 1
+
+    def put(self, key: str, value: Any, model_version: str, phash: Optional[int] = None, image_size=None):
+        size = len(json.dumps(value, default=str)) + len(key)
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = _Entry(value, size, model_version, phash, image_size)
+        self._bytes += size
+        # Bỏ entry ít dùng nhất cho tới khi về dưới giới hạn dung lượng
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_mb": round(self._bytes / 1024 / 1024, 3),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 3),
+            "ttl_s": self.ttl_s,
+            "phash_distance": self.phash_distance,
+            "phash_max_scan": self.phash_max_scan,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidated": self.invalidated,
+        }
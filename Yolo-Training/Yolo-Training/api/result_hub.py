@@ -0,0 +1,208 @@
+# /my_streaming_project/api/result_hub.py
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import WebSocket
+
+from api.config import (STREAM_VIEWER_DOWNGRADE_DROPS, STREAM_VIEWER_LAG_WINDOW_S, STREAM_VIEWER_QUEUE,
+                        STREAM_VIEWER_RECOVER_S, STREAM_VIEWER_SEND_TIMEOUT_S)
+from api.metrics import PIPELINE_STREAM, STAGE_SEND, STAGE_SERIALIZE, stage_seconds
+from api.wire_format import BinaryResultEncoder
+
+# Pub/sub kết quả YOLO theo phòng: publish() chỉ đặt message vào hàng đợi nhỏ của từng
+# viewer rồi trả về ngay, mỗi viewer có một task gửi riêng. Vòng suy luận không bao giờ
+# chờ socket của client; viewer chậm chỉ bỏ lỡ message cũ của chính nó.
+
+STATE_OK = "ok"
+STATE_DOWNGRADED = "downgraded"
+STATE_DROPPED = "dropped"
+
+
+class _Published:
+    """Message đã publish; JSON chỉ được encode một lần cho mọi viewer dùng JSON."""
+    __slots__ = ("message", "_text")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            started = time.perf_counter()
+            self._text = json.dumps(self.message)
+            stage_seconds.observe(time.perf_counter() - started, PIPELINE_STREAM, STAGE_SERIALIZE)
+        return self._text
+
+
+class ViewerSubscription:
+    def __init__(self, client_id: str, ws: WebSocket, encoder: Optional[BinaryResultEncoder] = None,
+                 max_queue: int = STREAM_VIEWER_QUEUE):
+        self.client_id = client_id
+        self.ws = ws
+        # Encoder nhị phân giữ trạng thái delta -> chỉ encode lúc thực sự gửi, đúng thứ tự gửi
+        self.encoder = encoder
+        self.queue: Deque[_Published] = deque()
+        self.max_queue = max(1, max_queue)
+        self.state = STATE_OK
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._drop_times: Deque[float] = deque()
+        self._last_drop_at = 0.0
+
+        self.sent = 0
+        self.coalesced = 0            # message cũ bị thay bằng message mới hơn vì viewer gửi không kịp
+        self.skipped_downgraded = 0   # box nội suy không gửi khi đang hạ cấp
+        self.downgrades = 0
+        self.send_ms_ema = 0.0
+        self.max_send_ms = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name=f"viewer-send-{self.client_id}")
+
+    def stop(self):
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self.queue.clear()
+
+    def offer(self, published: _Published, now: float):
+        """Không bao giờ chờ: đưa message vào hàng đợi, đầy thì bỏ message cũ nhất."""
+        if self.state == STATE_DROPPED:
+            return
+        if self.state == STATE_DOWNGRADED:
+            if published.message.get("interpolated"):
+                self.skipped_downgraded += 1
+                return
+            if now - self._last_drop_at >= STREAM_VIEWER_RECOVER_S:
+                self.state = STATE_OK
+                logging.info(f"Viewer '{self.client_id}' đã theo kịp, nhận lại box nội suy.")
+        self.queue.append(published)
+        if len(self.queue) > self.max_queue:
+            self.queue.popleft()
+            self._record_drop(now)
+        self._wakeup.set()
+
+    def _record_drop(self, now: float):
+        self.coalesced += 1
+        self._last_drop_at = now
+        if STREAM_VIEWER_DOWNGRADE_DROPS <= 0 or self.state != STATE_OK:
+            return
+        self._drop_times.append(now)
+        while self._drop_times and now - self._drop_times[0] > STREAM_VIEWER_LAG_WINDOW_S:
+            self._drop_times.popleft()
+        if len(self._drop_times) >= STREAM_VIEWER_DOWNGRADE_DROPS:
+            # Viewer liên tục không theo kịp -> bớt tải: chỉ gửi kết quả suy luận thật
+            self.state = STATE_DOWNGRADED
+            self.downgrades += 1
+            self._drop_times.clear()
+            logging.warning(f"Viewer '{self.client_id}' gửi không kịp, hạ cấp (bỏ box nội suy).")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.queue:
+                published = self.queue.popleft()
+                try:
+                    if self.encoder is not None and published.message.get("type") == "yolo_results":
+                        encode_started = time.perf_counter()
+                        data = self.encoder.encode(published.message)
+                        stage_seconds.observe(time.perf_counter() - encode_started, PIPELINE_STREAM,
+                                              STAGE_SERIALIZE)
+                        send = self.ws.send_bytes(data)
+                    else:
+                        send = self.ws.send_text(published.text)
+                    started = time.perf_counter()
+                    await asyncio.wait_for(send, STREAM_VIEWER_SEND_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    await self._drop(f"gửi quá {STREAM_VIEWER_SEND_TIMEOUT_S:g}s")
+                    return
+                except Exception as e:
+                    await self._drop(str(e) or type(e).__name__)
+                    return
+                send_ms = (time.perf_counter() - started) * 1000.0
+                stage_seconds.observe_ms(send_ms, PIPELINE_STREAM, STAGE_SEND)
+                self.sent += 1
+                self.max_send_ms = max(self.max_send_ms, send_ms)
+                self.send_ms_ema = send_ms if self.send_ms_ema == 0 else 0.8 * self.send_ms_ema + 0.2 * send_ms
+
+    async def _drop(self, reason: str):
+        # Viewer treo / đã ngắt: ngừng gửi và đóng socket; endpoint websocket sẽ tự dọn phòng
+        self.state = STATE_DROPPED
+        self.queue.clear()
+        logging.warning(f"Ngừng gửi kết quả cho viewer '{self.client_id}': {reason}")
+        try:
+            await asyncio.wait_for(self.ws.close(code=1013), 1.0)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "encoding": "binary" if self.encoder is not None else "json",
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "skipped_downgraded": self.skipped_downgraded,
+            "downgrades": self.downgrades,
+            "send_ms": round(self.send_ms_ema, 2),
+            "max_send_ms": round(self.max_send_ms, 2),
+        }
+
+
+class ResultHub:
+    """Phát kết quả của một phòng tới các viewer đã đăng ký."""
+
+    def __init__(self, room_name: str):
+        self.room_name = room_name
+        self.subscriptions: Dict[str, ViewerSubscription] = {}
+        self.published = 0
+        self.dropped_viewers = 0
+
+    def subscribe(self, client_id: str, ws: WebSocket,
+                  encoder: Optional[BinaryResultEncoder] = None) -> ViewerSubscription:
+        self.unsubscribe(client_id)
+        subscription = ViewerSubscription(client_id, ws, encoder)
+        self.subscriptions[client_id] = subscription
+        subscription.start()
+        return subscription
+
+    def unsubscribe(self, client_id: str):
+        subscription = self.subscriptions.pop(client_id, None)
+        if subscription is not None:
+            if subscription.state == STATE_DROPPED:
+                self.dropped_viewers += 1
+            subscription.stop()
+
+    def set_encoder(self, client_id: str, encoder: Optional[BinaryResultEncoder]):
+        subscription = self.subscriptions.get(client_id)
+        if subscription is not None:
+            subscription.encoder = encoder
+
+    def publish(self, message: Dict[str, Any]):
+        """Đồng bộ, không chờ socket nào."""
+        self.published += 1
+        published = _Published(message)
+        now = time.perf_counter()
+        for subscription in list(self.subscriptions.values()):
+            subscription.offer(published, now)
+
+    def close(self):
+        for client_id in list(self.subscriptions):
+            self.unsubscribe(client_id)
+
+    def stats(self) -> Dict[str, Any]:
+        subscriptions = list(self.subscriptions.values())
+        return {
+            "published": self.published,
+            "binary_viewers": sum(1 for s in subscriptions if s.encoder is not None),
+            "lagging_viewers": sum(1 for s in subscriptions if s.state != STATE_OK),
+            "dropped_viewers": self.dropped_viewers + sum(1 for s in subscriptions if s.state == STATE_DROPPED),
+            "viewer_stats": {s.client_id: s.stats() for s in subscriptions},
+        }
@@ -0,0 +1,371 @@
+# /my_streaming_project/api/room_backend.py
+
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from api.config import (ROOM_BACKEND, ROOM_BACKEND_URL, ROOM_NODE_ID, ROOM_OWNER_TTL_S,
+                        ROOM_PUBLISH_QUEUE)
+
+# Trạng thái phòng dùng chung giữa các worker / node: ai giữ phòng (node nhận media của
+# broadcaster), thành viên phòng và kênh pub/sub để chuyển tiếp signaling + kết quả YOLO
+# giữa các node. InMemoryBackend (mặc định) chỉ dùng trong một process; RedisBackend cho
+# phép chạy nhiều worker / node sau load balancer.
+
+MessageHandler = Callable[[Dict[str, Any]], None]
+# Gọi khi node mất quyền giữ một phòng (tham số: tên phòng)
+OwnershipLostHandler = Callable[[str], None]
+
+# Sự kiện phòng (đổi node giữ phòng) phát cho mọi node
+EVENTS_CHANNEL = "yolo:rooms:events"
+
+
+def node_channel(node_id: str) -> str:
+    """Kênh riêng của một node: nhận message client chuyển tới / message trả về client."""
+    return f"yolo:node:{node_id}"
+
+
+class RoomBackend(ABC):
+    """
+    Giao diện chung. Handler của subscribe() được gọi đồng bộ, theo đúng thứ tự publish
+    trên mỗi kênh, nên không được chờ I/O (việc lâu thì tự tạo task). Backend thiếu
+    phương thức nào thì lỗi ngay lúc khởi tạo (TypeError), không phải giữa request.
+    """
+
+    name = "base"
+
+    def __init__(self, node_id: str = ROOM_NODE_ID):
+        self.node_id = node_id
+        self._ownership_lost_handlers: List[OwnershipLostHandler] = []
+
+    def on_ownership_lost(self, handler: OwnershipLostHandler):
+        """Đăng ký handler khi node mất quyền giữ phòng (không gia hạn được trước khi hết TTL)."""
+        self._ownership_lost_handlers.append(handler)
+
+    def _ownership_lost(self, room_name: str):
+        for handler in list(self._ownership_lost_handlers):
+            try:
+                handler(room_name)
+            except Exception as e:
+                logging.error(f"Lỗi khi xử lý mất quyền giữ phòng '{room_name}': {e}")
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def claim_room(self, room_name: str) -> str:
+        """Nhận giữ phòng nếu chưa node nào giữ; trả về node đang giữ phòng."""
+
+    @abstractmethod
+    async def release_room(self, room_name: str):
+        """Bỏ giữ phòng (chỉ khi node này đang giữ)."""
+
+    @abstractmethod
+    async def room_owner(self, room_name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def add_member(self, room_name: str, client_id: str, role: str):
+        ...
+
+    @abstractmethod
+    async def remove_member(self, room_name: str, client_id: str):
+        ...
+
+    @abstractmethod
+    async def members(self, room_name: str) -> Dict[str, Dict[str, str]]:
+        """{client_id: {"role": "broadcaster" | "viewer", "node": node_id}}"""
+
+    @abstractmethod
+    def publish(self, channel: str, message: Dict[str, Any]):
+        """Không bao giờ chờ mạng."""
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "node": self.node_id}
+
+
+class InMemoryBackend(RoomBackend):
+    """Mọi thứ trong bộ nhớ của process: đủ cho một worker, không tốn thêm gì."""
+
+    name = "memory"
+
+    def __init__(self, node_id: str = ROOM_NODE_ID):
+        super().__init__(node_id)
+        self._owners: Dict[str, str] = {}
+        self._members: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self.published = 0
+
+    async def claim_room(self, room_name: str) -> str:
+        return self._owners.setdefault(room_name, self.node_id)
+
+    async def release_room(self, room_name: str):
+        if self._owners.get(room_name) == self.node_id:
+            del self._owners[room_name]
+
+    async def room_owner(self, room_name: str) -> Optional[str]:
+        return self._owners.get(room_name)
+
+    async def add_member(self, room_name: str, client_id: str, role: str):
+        self._members.setdefault(room_name, {})[client_id] = {"role": role, "node": self.node_id}
+
+    async def remove_member(self, room_name: str, client_id: str):
+        members = self._members.get(room_name)
+        if members is not None:
+            members.pop(client_id, None)
+            if not members:
+                del self._members[room_name]
+
+    async def members(self, room_name: str) -> Dict[str, Dict[str, str]]:
+        return dict(self._members.get(room_name, {}))
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        for handler in list(self._handlers.get(channel, ())):
+            _dispatch(handler, channel, message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        handlers = self._handlers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "rooms_owned": len(self._owners), "published": self.published}
+
+
+# So sánh rồi mới xoá / gia hạn: node không bao giờ xoá quyền giữ phòng của node khác
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+_REFRESH_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                   "return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0")
+
+
+class RedisBackend(RoomBackend):
+    """
+    Dùng một server nói giao thức Redis: quyền giữ phòng là key SET NX có TTL (gia hạn
+    định kỳ), thành viên là hash, chuyển tiếp giữa các node qua PUBLISH / SUBSCRIBE.
+    Cần gói `redis` (redis-py >= 4.2). `client` cho phép truyền client có sẵn (ví dụ
+    fakeredis khi thử trên máy không có server).
+    """
+
+    name = "redis"
+
+    def __init__(self, node_id: str = ROOM_NODE_ID, url: str = ROOM_BACKEND_URL, client=None,
+                 owner_ttl_s: float = ROOM_OWNER_TTL_S, max_queue: int = ROOM_PUBLISH_QUEUE):
+        super().__init__(node_id)
+        self.url = url
+        self.owner_ttl_ms = max(1000, int(owner_ttl_s * 1000))
+        self._redis = client
+        self._pubsub = None
+        # Phòng node này giữ -> thời điểm (monotonic) gia hạn thành công gần nhất
+        self._owned: Dict[str, float] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._queue: Deque[Tuple[str, str]] = deque()
+        self._max_queue = max(1, max_queue)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._reader: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.received = 0
+        self.publish_dropped = 0
+        self.publish_errors = 0
+
+    @staticmethod
+    def _owner_key(room_name: str) -> str:
+        return f"yolo:room:{room_name}:owner"
+
+    @staticmethod
+    def _members_key(room_name: str) -> str:
+        return f"yolo:room:{room_name}:members"
+
+    async def start(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._publisher(), name="room-backend-publish"),
+                       loop.create_task(self._keepalive(), name="room-backend-keepalive")]
+        logging.info(f"Room backend redis ({self.url}), node '{self.node_id}'")
+
+    async def close(self):
+        for task in self._tasks + ([self._reader] if self._reader else []):
+            task.cancel()
+        for room_name in list(self._owned):
+            await self.release_room(room_name)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def claim_room(self, room_name: str) -> str:
+        key = self._owner_key(room_name)
+        for _ in range(3):
+            if await self._redis.set(key, self.node_id, nx=True, px=self.owner_ttl_ms):
+                self._owned[room_name] = time.monotonic()
+                return self.node_id
+            owner = _text(await self._redis.get(key))
+            if owner is not None:  # None: key vừa hết hạn giữa SET và GET -> thử lại
+                if owner == self.node_id:
+                    self._owned.setdefault(room_name, time.monotonic())
+                return owner
+        return self.node_id
+
+    async def release_room(self, room_name: str):
+        self._owned.pop(room_name, None)
+        await self._redis.eval(_RELEASE_SCRIPT, 1, self._owner_key(room_name), self.node_id)
+
+    async def room_owner(self, room_name: str) -> Optional[str]:
+        return _text(await self._redis.get(self._owner_key(room_name)))
+
+    async def add_member(self, room_name: str, client_id: str, role: str):
+        await self._redis.hset(self._members_key(room_name), client_id,
+                               json.dumps({"role": role, "node": self.node_id}))
+
+    async def remove_member(self, room_name: str, client_id: str):
+        await self._redis.hdel(self._members_key(room_name), client_id)
+
+    async def members(self, room_name: str) -> Dict[str, Dict[str, str]]:
+        raw = await self._redis.hgetall(self._members_key(room_name))
+        return {_text(k): json.loads(v) for k, v in raw.items()}
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        # Task publisher gửi theo thứ tự; backend chậm / mất kết nối chỉ làm mất message cũ nhất
+        self._queue.append((channel, json.dumps(message)))
+        if len(self._queue) > self._max_queue:
+            self._queue.popleft()
+            self.publish_dropped += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _publisher(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue:
+                channel, data = self._queue[0]
+                try:
+                    await self._redis.publish(channel, data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.publish_errors += 1
+                    logging.warning(f"Không publish được lên room backend: {e}")
+                    await asyncio.sleep(1.0)
+                    continue
+                self._queue.popleft()
+                self.published += 1
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.owner_ttl_ms / 3000.0)
+            await self.refresh_owned()
+
+    async def refresh_owned(self):
+        """
+        Gia hạn mọi phòng đang giữ. Key đã thuộc node khác / đã hết hạn, hoặc không gia hạn
+        được trong cả một TTL (backend mất kết nối) -> coi như mất phòng và báo handler.
+        """
+        for room_name in list(self._owned):
+            try:
+                refreshed = await self._redis.eval(_REFRESH_SCRIPT, 1, self._owner_key(room_name),
+                                                   self.node_id, self.owner_ttl_ms)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Không gia hạn được quyền giữ phòng '{room_name}': {e}")
+                last_ok = self._owned.get(room_name)
+                refreshed = last_ok is not None and (time.monotonic() - last_ok) * 1000.0 < self.owner_ttl_ms
+                if refreshed:
+                    continue
+            if room_name not in self._owned:
+                continue  # phòng vừa được nhả trong lúc chờ backend
+            if refreshed:
+                self._owned[room_name] = time.monotonic()
+            else:
+                del self._owned[room_name]
+                logging.warning(f"Node '{self.node_id}' đã mất quyền giữ phòng '{room_name}'")
+                self._ownership_lost(room_name)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        handlers = self._handlers.setdefault(channel, [])
+        handlers.append(handler)
+        if len(handlers) == 1:
+            await self._pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read(), name="room-backend-read")
+
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        handlers = self._handlers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self._handlers[channel]
+                await self._pubsub.unsubscribe(channel)
+
+    async def _read(self):
+        while self._handlers:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Mất kết nối pub/sub của room backend: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+            self.received += 1
+            channel = _text(message["channel"])
+            payload = json.loads(message["data"])
+            for handler in list(self._handlers.get(channel, ())):
+                _dispatch(handler, channel, payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "rooms_owned": len(self._owned),
+            "published": self.published,
+            "received": self.received,
+            "publish_queued": len(self._queue),
+            "publish_dropped": self.publish_dropped,
+            "publish_errors": self.publish_errors,
+        }
+
+
+def _text(value) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _dispatch(handler: MessageHandler, channel: str, message: Dict[str, Any]):
+    try:
+        handler(message)
+    except Exception as e:
+        logging.error(f"Lỗi khi xử lý message kênh '{channel}': {e}")
+
+
+def create_room_backend(kind: str = ROOM_BACKEND) -> RoomBackend:
+    if kind == "memory":
+        return InMemoryBackend()
+    if kind == "redis":
+        return RedisBackend()
+    raise ValueError(f"Room backend không hợp lệ: '{kind}' (memory|redis)")
@@ -0,0 +1,359 @@
+# /my_streaming_project/api/shm_workers.py
+
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from api.config import (
+    INFERENCE_THREADS_PER_WORKER,
+    SHM_MONITOR_INTERVAL_S,
+    SHM_SLOT_MB,
+    SHM_SLOTS,
+    SHM_WORKER_MAX_RESTARTS,
+)
+
+# Frame gửi sang worker có dạng:
+#   ("shm", slot, shape, dtype)  -> dữ liệu nằm trong ring buffer, không pickle
+#   ("inline", ndarray)          -> ảnh quá lớn so với slot, gửi qua pickle
+FrameRef = Tuple
+
+
+def _as_bgr_array(image) -> np.ndarray:
+    """PIL (RGB) -> ndarray BGR như ultralytics mong đợi; ndarray được giữ nguyên."""
+    if isinstance(image, np.ndarray):
+        return image
+    return np.asarray(image.convert("RGB"))[:, :, ::-1]
+
+
+def _pack_result(r) -> Tuple[Tuple[int, int], int, bytes]:
+    # Kết quả gọn: một mảng float32 (N, 6) [x1, y1, x2, y2, conf, cls] dạng bytes
+    data = r.boxes.cpu().numpy().data.astype(np.float32, copy=False)
+    return tuple(r.orig_shape), data.shape[1] if data.ndim == 2 else 6, data.tobytes()
+
+
+def _unpack_result(orig_shape, ncols: int, data: bytes, names: Dict[int, str]):
+    from ultralytics.engine.results import Results
+
+    boxes = np.frombuffer(data, dtype=np.float32).reshape(-1, ncols)
+    # Results chỉ dùng orig_img để lấy kích thước -> mảng 0 kênh, không tốn bộ nhớ
+    return Results(np.empty((*orig_shape, 0), dtype=np.uint8), path="", names=names, boxes=boxes)
+
+
+# --- PHẦN CHẠY TRONG PROCESS CON ---
+def _worker_main(worker_id: int, shm_name: str, slot_bytes: int, tasks, results,
+                 threads: int, warmup_models: List[str]):
+    import torch
+
+    from api.model_registry import registry
+
+    torch.set_num_threads(max(1, threads))
+    # Process con dùng chung resource tracker với process chính (spawn), nên
+    # vùng nhớ chỉ được unlink một lần bởi process chính khi đóng pool
+    shm = SharedMemory(name=shm_name)
+
+    try:
+        registry.warmup_all(warmup_models)
+    except Exception as e:
+        logging.error(f"Worker {worker_id}: lỗi warmup {warmup_models}: {e}")
+    results.put(("ready", worker_id))
+
+    names_sent = set()
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        job_id, model_name, frames, predict_kwargs = job
+        try:
+            images = []
+            for ref in frames:
+                if ref[0] == "shm":
+                    _, slot, shape, dtype = ref
+                    images.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_bytes))
+                else:
+                    images.append(ref[1])
+            model = registry.get(model_name)
+            preds = registry.predict(model, images, **predict_kwargs)
+            del images  # nhả view vào shm trước khi báo xong
+            names = None if model_name in names_sent else dict(model.names)
+            names_sent.add(model_name)
+            results.put(("ok", job_id, model_name, [_pack_result(r) for r in preds], names))
+        except Exception as e:
+            results.put(("error", job_id, model_name, f"{type(e).__name__}: {e}", None))
+    shm.close()
+
+
+class SharedFrameRing:
+    """Ring buffer gồm `slots` slot cố định trong một khối SharedMemory."""
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = max(1, slots)
+        self.slot_bytes = slot_bytes
+        self.shm = SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self._free = list(range(self.slots))
+        self._cond: Optional[asyncio.Condition] = None
+
+    async def acquire(self, count: int) -> List[int]:
+        # Lấy đủ `count` slot một lần để các job không giữ slot dở dang của nhau
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        count = min(count, self.slots)
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self._free) >= count)
+            taken, self._free = self._free[:count], self._free[count:]
+            return taken
+
+    async def release(self, slots: List[int]):
+        if not slots:
+            return
+        async with self._cond:
+            self._free.extend(slots)
+            self._cond.notify_all()
+
+    def write(self, slot: int, array: np.ndarray) -> FrameRef:
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = array
+        return ("shm", slot, array.shape, array.dtype.str)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmWorkerUnavailable(RuntimeError):
+    """Worker đang chạy job đã chết, hoặc pool không còn worker nào sống."""
+
+
+class _Worker:
+    __slots__ = ("worker_id", "process", "tasks", "jobs", "restarts", "ready")
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process = None
+        self.tasks = None
+        self.jobs: Set[int] = set()  # job đã giao cho worker, chưa có kết quả
+        self.restarts = 0
+        self.ready = False
+
+
+class ShmWorkerPool:
+    """
+    N process worker, mỗi process có registry/model riêng. Process chính ghi
+    frame vào ring buffer bộ nhớ chia sẻ, chỉ gửi chỉ số slot qua hàng đợi;
+    worker trả về mảng box gọn thay vì đối tượng Results đầy đủ.
+    Mỗi worker có hàng đợi job riêng nên khi một worker chết, pool biết chính xác
+    job nào bị mất: báo lỗi cho các job đó, trả slot về ring và khởi động lại worker.
+    """
+
+    def __init__(self, num_workers: int, slots: int = SHM_SLOTS, slot_mb: float = SHM_SLOT_MB,
+                 threads_per_worker: int = INFERENCE_THREADS_PER_WORKER,
+                 max_restarts: int = SHM_WORKER_MAX_RESTARTS, monitor_interval_s: float = SHM_MONITOR_INTERVAL_S):
+        self.num_workers = max(1, num_workers)
+        self.ring = SharedFrameRing(slots, int(slot_mb * 1024 * 1024))
+        self.threads_per_worker = threads_per_worker
+        self.max_restarts = max_restarts
+        self.monitor_interval_s = monitor_interval_s
+
+        self._ctx = mp.get_context("spawn")  # không fork process đang có thread của torch/uvicorn
+        self._results = self._ctx.Queue()
+        self._workers = [_Worker(i) for i in range(self.num_workers)]
+        self._warmup_models: List[str] = []
+        self._reader: Optional[threading.Thread] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+
+        self._job_ids = itertools.count()
+        # job_id -> (future, slot đang giữ, worker được giao)
+        self._pending: Dict[int, Tuple[asyncio.Future, List[int], int]] = {}
+        self._names: Dict[str, Dict[int, str]] = {}
+        self._ready: Optional[asyncio.Event] = None
+        self.unhealthy: Optional[str] = None
+        self.inline_frames = 0
+        self.shm_frames = 0
+        self.worker_deaths = 0
+        self.jobs_failed = 0
+
+    def start(self, warmup_models: List[str]):
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._warmup_models = list(warmup_models)
+        for worker in self._workers:
+            self._spawn(worker)
+        self._reader = threading.Thread(target=self._read_results, name="yolo-shm-results", daemon=True)
+        self._reader.start()
+        self._monitor = self._loop.create_task(self._watch_workers(), name="yolo-shm-monitor")
+
+    def _spawn(self, worker: _Worker):
+        # Hàng đợi mới: job còn nằm trong hàng đợi của process cũ đã được báo lỗi
+        worker.tasks = self._ctx.Queue()
+        worker.ready = False
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.worker_id, self.ring.shm.name, self.ring.slot_bytes, worker.tasks, self._results,
+                  self.threads_per_worker, self._warmup_models),
+            name=f"yolo-shm-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    async def wait_ready(self):
+        await self._ready.wait()
+        if self.unhealthy:
+            raise ShmWorkerUnavailable(self.unhealthy)
+
+    def _alive_workers(self) -> List[_Worker]:
+        return [w for w in self._workers if w.process is not None]
+
+    def _update_ready(self):
+        # Sẵn sàng khi mọi worker còn được dùng đã warmup xong (hoặc pool đã hỏng -> wait_ready báo lỗi)
+        alive = self._alive_workers()
+        if self.unhealthy or (alive and all(w.ready for w in alive)):
+            self._ready.set()
+
+    async def _watch_workers(self):
+        while not self._closing:
+            await asyncio.sleep(self.monitor_interval_s)
+            for worker in self._alive_workers():
+                if not worker.process.is_alive() and not self._closing:
+                    self._on_worker_died(worker)
+
+    def _on_worker_died(self, worker: _Worker):
+        self.worker_deaths += 1
+        exitcode = worker.process.exitcode
+        logging.error(f"Worker shm {worker.worker_id} đã dừng (exitcode={exitcode}), "
+                      f"{len(worker.jobs)} job bị huỷ")
+        error = ShmWorkerUnavailable(f"Worker suy luận {worker.worker_id} đã dừng (exitcode={exitcode})")
+        for job_id in list(worker.jobs):
+            self._finish_job(job_id, error=error)
+        worker.jobs.clear()
+        worker.process.join(timeout=0)
+        worker.tasks.close()
+        if worker.restarts < self.max_restarts:
+            worker.restarts += 1
+            logging.warning(f"Khởi động lại worker shm {worker.worker_id} (lần {worker.restarts})")
+            self._spawn(worker)
+        else:
+            logging.error(f"Worker shm {worker.worker_id} chết quá {self.max_restarts} lần, bỏ worker này")
+            worker.process = None
+            worker.ready = False
+            if not self._alive_workers():
+                self._mark_unhealthy("Không còn worker suy luận nào chạy được")
+        self._update_ready()
+
+    def _mark_unhealthy(self, reason: str):
+        self.unhealthy = reason
+        logging.error(f"Pool shm hỏng: {reason}")
+        error = ShmWorkerUnavailable(reason)
+        for job_id in list(self._pending):
+            self._finish_job(job_id, error=error)
+
+    def _finish_job(self, job_id: int, result=None, error: Optional[Exception] = None):
+        future, slots, worker_id = self._pending.pop(job_id, (None, [], None))
+        if worker_id is not None:
+            self._workers[worker_id].jobs.discard(job_id)
+        self._loop.create_task(self.ring.release(slots))
+        if future is None or future.done():
+            return
+        if error is not None:
+            self.jobs_failed += 1
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _read_results(self):
+        # Thread riêng chờ kết quả từ worker rồi chuyển về event loop
+        while True:
+            msg = self._results.get()
+            if msg is None:
+                break
+            self._loop.call_soon_threadsafe(self._on_message, msg)
+
+    def _on_message(self, msg):
+        if msg[0] == "ready":
+            worker = self._workers[msg[1]]
+            if worker.process is not None:
+                worker.ready = True
+                self._update_ready()
+            return
+
+        status, job_id, model_name, payload, names = msg
+        if names is not None:
+            self._names[model_name] = names
+        if status == "ok":
+            names = self._names.get(model_name, {})
+            self._finish_job(job_id, [_unpack_result(shape, ncols, data, names) for shape, ncols, data in payload])
+        else:
+            self._finish_job(job_id, error=RuntimeError(f"Worker suy luận lỗi: {payload}"))
+
+    def _pick_worker(self) -> _Worker:
+        # Worker ít job nhất trong số worker đã sẵn sàng (chưa có thì lấy mọi worker còn sống)
+        alive = self._alive_workers()
+        if self.unhealthy or not alive:
+            raise ShmWorkerUnavailable(self.unhealthy or "Không còn worker suy luận nào chạy được")
+        ready = [w for w in alive if w.ready] or alive
+        return min(ready, key=lambda w: len(w.jobs))
+
+    async def predict(self, model_name: str, images, predict_kwargs: Dict[str, Any]):
+        self._pick_worker()  # báo lỗi ngay nếu pool đã hỏng, trước khi giữ slot
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        arrays = [_as_bgr_array(image) for image in images]
+        fits = [a for a in arrays if a.nbytes <= self.ring.slot_bytes]
+        slots = await self.ring.acquire(len(fits)) if fits else []
+
+        frames, free_slots = [], iter(slots)
+        for array in arrays:
+            slot = next(free_slots, None) if array.nbytes <= self.ring.slot_bytes else None
+            if slot is None:
+                self.inline_frames += 1
+                frames.append(("inline", np.ascontiguousarray(array)))
+            else:
+                self.shm_frames += 1
+                frames.append(self.ring.write(slot, array))
+
+        try:
+            worker = self._pick_worker()
+        except ShmWorkerUnavailable:
+            await self.ring.release(slots)
+            raise
+        job_id = next(self._job_ids)
+        future = self._loop.create_future()
+        self._pending[job_id] = (future, slots, worker.worker_id)
+        worker.jobs.add(job_id)
+        worker.tasks.put((job_id, model_name, frames, predict_kwargs))
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers_alive": sum(1 for w in self._alive_workers() if w.process.is_alive()),
+            "workers_ready": sum(1 for w in self._workers if w.ready),
+            "worker_deaths": self.worker_deaths,
+            "worker_restarts": sum(w.restarts for w in self._workers),
+            "jobs_failed": self.jobs_failed,
+            "unhealthy": self.unhealthy,
+            "slots_total": self.ring.slots,
+            "slot_mb": round(self.ring.slot_bytes / 1024 / 1024, 2),
+            "shm_frames": self.shm_frames,
+            "inline_frames": self.inline_frames,
+            "jobs_in_flight": len(self._pending),
+        }
+
+    def close(self):
+        self._closing = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        workers = self._alive_workers()
+        for worker in workers:
+            worker.tasks.put(None)
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._results.put(None)
+        self.ring.close()
@@ -0,0 +1,539 @@
+# /my_streaming_project/api/stream_processing.py
+
+import asyncio
+import inspect
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from api.batching import _percentile
+from api.config import (BATCH_STATS_WINDOW, STREAM_BATCH_MAX_SIZE, STREAM_BATCH_WINDOW_MS, STREAM_CONF,
+                        STREAM_IMGSZ, STREAM_INTERP_FPS, STREAM_MAX_FPS, STREAM_MODEL,
+                        STREAM_MOTION_GATING, STREAM_MOTION_MAX_INTERVAL_S, STREAM_MOTION_PIXEL_DELTA,
+                        STREAM_MOTION_THRESHOLD, STREAM_MOTION_THUMB_WIDTH, STREAM_CLASSES, STREAM_TARGET_FPS,
+                        STREAM_TRACKING)
+from api.inference_pool import PRIORITY_STREAM, InferencePool, InferenceQueueFull, inference_pool
+from api.metrics import (PIPELINE_STREAM, STAGE_DECODE, STAGE_EXTRACT, STAGE_QUEUE, observe_model_speed,
+                         stage_seconds)
+from api.postprocess import RECORD_BOX, Detections, extract, set_record_box
+from api.tracking import MultiObjectTracker
+
+# Hàm nhận message kết quả (dict) để gửi cho người xem trong phòng. Nên là hàm đồng bộ
+# không chờ socket (vd. ResultHub.publish); coroutine vẫn được chấp nhận và chạy thành task riêng.
+ResultCallback = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+
+
+def parse_target_fps(value) -> float:
+    """FPS mục tiêu lấy từ message client; ValueError nếu không phải số dương hữu hạn."""
+    error = ValueError(f"'fps' phải là số dương, nhận được {value!r}")
+    if isinstance(value, bool):
+        raise error
+    try:
+        fps = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise error from None
+    # NaN lọt qua min/max và làm lịch suy luận của phòng đứng yên
+    if not math.isfinite(fps) or fps <= 0:
+        raise error
+    return min(max(fps, 0.1), STREAM_MAX_FPS)
+
+
+class YOLOv8FrameProcessor(MediaStreamTrack):
+    """
+    Track video trung gian: trả frame gốc cho người xem ngay lập tức và chỉ giữ
+    lại frame MỚI NHẤT. Việc suy luận do `StreamBatchScheduler` đảm nhận: mỗi lượt
+    nó lấy frame mới nhất của mọi phòng đã tới hạn (theo FPS mục tiêu của phòng)
+    và chạy chung một batch, nên không phòng nào bị tụt lại phía sau luồng video.
+    Giữa hai lần suy luận, tracker nội suy vị trí box (kèm track ID ổn định) để
+    overlay không bị giật dù detector chạy thưa. Với camera cố định, frame gần
+    như giống frame đã suy luận trước đó thì bỏ qua detector và dùng lại kết quả cũ.
+    """
+    kind = "video"
+    # Hậu xử lý: đổi nhãn (không phân biệt hoa thường), lọc class, kiểu bản ghi gửi đi
+    relabel: Optional[Dict[str, str]] = None
+    classes: List[str] = STREAM_CLASSES
+    record_style: str = RECORD_BOX
+
+    def __init__(self, track: MediaStreamTrack, room_name: str, on_result: ResultCallback,
+                 target_fps: float = STREAM_TARGET_FPS, model: str = STREAM_MODEL,
+                 scheduler: Optional["StreamBatchScheduler"] = None):
+        super().__init__()
+        self.track = track
+        self.room_name = room_name
+        self.on_result = on_result
+        self.model = model
+        self.target_fps = target_fps
+        self.scheduler = scheduler or stream_scheduler
+
+        self._latest = None
+        self._latest_seq = 0
+        self._latest_at = 0.0
+        self._processed_seq = 0
+        self._registered = False
+        # Task tự đọc frame (start()) khi processor không được viewer nào kéo frame
+        self._consumer: Optional[asyncio.Task] = None
+        # Đang nằm trong một batch chưa xong -> scheduler không lấy thêm frame
+        self.in_flight = False
+        self.next_due_at = 0.0
+
+        # Tracker + gửi box nội suy cho các frame không được suy luận
+        self.tracker: Optional[MultiObjectTracker] = MultiObjectTracker() if STREAM_TRACKING else None
+        self.interp_fps = STREAM_INTERP_FPS
+        self._orig_shape: Optional[List[int]] = None
+        self._last_sent_at = 0.0
+        self._last_sent_count = 0
+        self._send_task: Optional[asyncio.Task] = None
+
+        # Motion gate: so sánh ảnh xám thu nhỏ với frame được suy luận gần nhất
+        self.motion_gating = STREAM_MOTION_GATING
+        self.motion_threshold = STREAM_MOTION_THRESHOLD
+        self.motion_max_interval = STREAM_MOTION_MAX_INTERVAL_S
+        self.motion_score = 0.0
+        self._ref_thumb: Optional[np.ndarray] = None
+        self._ref_at = 0.0
+        self._last_detections: Optional[List[Dict[str, Any]]] = None
+        # Kết quả gần nhất dạng cột, dùng để vẽ box lên video phía server (AnnotatedRoomTrack)
+        self._last_dets: Optional[Detections] = None
+
+        # Thống kê
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_rejected = 0
+        self.frames_motion_skipped = 0
+        self.interpolated_sent = 0
+        self.infer_ms_ema = 0.0
+        self.processed_fps_ema = 0.0
+        self._last_processed_at: Optional[float] = None
+        self._latencies: Deque[float] = deque(maxlen=BATCH_STATS_WINDOW)
+        self._batch_sizes: Deque[int] = deque(maxlen=BATCH_STATS_WINDOW)
+
+    @property
+    def target_fps(self) -> float:
+        return self._target_fps
+
+    @target_fps.setter
+    def target_fps(self, fps: float):
+        self._target_fps = parse_target_fps(fps)
+
+    def effective_fps(self) -> float:
+        """FPS thực sự đạt được: thấp hơn FPS mục tiêu nếu predict chậm hơn."""
+        if self.infer_ms_ema <= 0:
+            return self.target_fps
+        return min(self.target_fps, 1000.0 / self.infer_ms_ema)
+
+    async def recv(self):
+        frame = await self.track.recv()
+        self.frames_received += 1
+        # Chỉ giữ frame mới nhất; passthrough không bao giờ chờ suy luận
+        self._latest = frame
+        self._latest_seq += 1
+        self._latest_at = time.perf_counter()
+        if not self._registered:
+            self._registered = True
+            self.scheduler.register(self)
+        self.scheduler.notify()
+        self._maybe_send_interpolated(self._latest_at)
+        return frame
+
+    def _maybe_send_interpolated(self, now: float):
+        if self.tracker is None or self.interp_fps <= 0 or now - self._last_sent_at < 1.0 / self.interp_fps:
+            return
+        # Viewer chậm: chưa gửi xong message trước thì bỏ lượt này, không dồn hàng
+        if self._send_task is not None and not self._send_task.done():
+            return
+        tracked = self.tracker.predict_boxes(now)
+        if not tracked and self._last_sent_count == 0:
+            return
+        detections = []
+        for track, box in tracked:
+            detection = dict(track.payload or {})
+            self.place_box(detection, box)
+            detection["track_id"] = track.track_id
+            detections.append(detection)
+        message = {
+            "type": "yolo_results",
+            "detections": detections,
+            "orig_shape": self._orig_shape,
+            "frame_seq": self._latest_seq,
+            "interpolated": True,
+        }
+        self._last_sent_at, self._last_sent_count = now, len(detections)
+        self.interpolated_sent += 1
+        self._send_task = self.emit(message)
+
+    def emit(self, message: Dict[str, Any]) -> Optional[asyncio.Task]:
+        """Giao message cho on_result mà không bao giờ chờ client; callback async chạy thành task."""
+        try:
+            result = self.on_result(message)
+        except Exception as e:
+            logging.error(f"Lỗi gửi kết quả YOLO trong phòng '{self.room_name}': {e}")
+            return None
+        if inspect.isawaitable(result):
+            return asyncio.ensure_future(result)
+        return None
+
+    def start(self):
+        """
+        Tự đọc frame từ track nguồn thay vì chờ viewer kéo frame qua processor
+        (dùng khi processor là một nhánh riêng của MediaRelay trong phòng).
+        """
+        if self._consumer is None:
+            self._consumer = asyncio.get_running_loop().create_task(self._consume(),
+                                                                    name=f"yolo-consume-{self.room_name}")
+
+    async def _consume(self):
+        try:
+            while self.readyState == "live":
+                await self.recv()
+        except MediaStreamError:
+            logging.info(f"Track nguồn của phòng '{self.room_name}' đã kết thúc")
+        finally:
+            self.stop()
+
+    def stop(self):
+        super().stop()
+        if self._consumer is not None and self._consumer is not asyncio.current_task():
+            self._consumer.cancel()
+        if self._registered:
+            self._registered = False
+            self.scheduler.unregister(self)
+
+    # --- Giao tiếp với StreamBatchScheduler ---
+    def has_new_frame(self) -> bool:
+        return not self.in_flight and self._latest_seq > self._processed_seq
+
+    def is_due(self, now: float) -> bool:
+        return self.has_new_frame() and now >= self.next_due_at
+
+    def take_latest(self, now: float):
+        """Lấy frame mới nhất để suy luận; các frame đến trong lúc chờ bị bỏ (latest-frame-wins)."""
+        frame, seq = self._latest, self._latest_seq
+        self.frames_dropped += max(0, seq - self._processed_seq - 1)
+        self._processed_seq = seq
+        self.in_flight = True
+        # Giữ nhịp theo FPS mục tiêu của phòng
+        self.next_due_at = now + 1.0 / self.target_fps
+        return frame, seq, self._latest_at
+
+    def reject(self, retry_after: float):
+        # Pool đang quá tải: bỏ frame này, chờ rồi thử frame mới nhất
+        self.frames_rejected += 1
+        self.in_flight = False
+        self.next_due_at = time.perf_counter() + min(retry_after, 1.0)
+
+    def motion_thumbnail(self, frame) -> np.ndarray:
+        # swscale thu nhỏ + chuyển xám trực tiếp, rẻ hơn nhiều so với to_ndarray cả frame
+        width = STREAM_MOTION_THUMB_WIDTH
+        height = max(1, round(width * frame.height / max(frame.width, 1)))
+        return frame.reformat(width=width, height=height, format="gray").to_ndarray()
+
+    def is_static(self, frame, captured_at: float) -> bool:
+        """
+        True nếu frame gần như không đổi so với frame suy luận gần nhất -> bỏ qua detector.
+        Chạy trong executor (cùng lúc chuyển đổi frame), không chặn event loop.
+        """
+        if not self.motion_gating or self._last_detections is None:
+            return False
+        thumb = self.motion_thumbnail(frame)
+        ref = self._ref_thumb
+        if ref is None or ref.shape != thumb.shape:
+            return False
+        changed = np.abs(thumb.astype(np.int16) - ref) > STREAM_MOTION_PIXEL_DELTA
+        self.motion_score = float(np.count_nonzero(changed)) / changed.size
+        # Buộc làm mới sau khoảng tối đa dù cảnh tĩnh (vd. đối tượng mới đứng yên xuất hiện dần)
+        return self.motion_score < self.motion_threshold and captured_at - self._ref_at < self.motion_max_interval
+
+    def set_reference(self, frame, captured_at: float):
+        """Ghi nhớ ảnh thu nhỏ của frame sắp được suy luận làm mốc so sánh."""
+        if self.motion_gating:
+            self._ref_thumb = self.motion_thumbnail(frame).astype(np.int16)
+            self._ref_at = captured_at
+
+    def build_reused_message(self, seq: int, received_at: float) -> Dict[str, Any]:
+        self.frames_motion_skipped += 1
+        if self.tracker is not None:
+            # Cảnh tĩnh: giữ các track hiện tại đứng yên thay vì để chúng hết hạn
+            self.tracker.hold(received_at)
+        detections = [dict(d) for d in self._last_detections]
+        self._last_sent_at, self._last_sent_count = time.perf_counter(), len(detections)
+        return {
+            "type": "yolo_results",
+            "detections": detections,
+            "orig_shape": self._orig_shape,
+            "frame_seq": seq,
+            "interpolated": False,
+            "reused": True,
+        }
+
+    def build_message(self, r, seq: int, received_at: float, infer_ms: float, batch_size: int) -> Dict[str, Any]:
+        now = time.perf_counter()
+        latency_ms = (now - received_at) * 1000.0
+        self._update_stats(infer_ms, latency_ms, batch_size, now)
+        dets = extract(r, relabel=self.relabel, classes=self.classes)
+        detections = self.build_detections(dets)
+        if self.tracker is not None:
+            # Bản ghi cùng thứ tự với các cột của dets -> track ID khớp theo chỉ số
+            track_ids = self.tracker.update(dets.xyxy, dets.cls, received_at, payloads=detections)
+            for detection, track_id in zip(detections, track_ids):
+                detection["track_id"] = track_id
+        self._orig_shape = list(dets.orig_shape)
+        self._last_detections = [dict(d) for d in detections]
+        self._last_dets = dets
+        self._last_sent_at, self._last_sent_count = now, len(detections)
+        return {
+            "type": "yolo_results",
+            "detections": detections,
+            "orig_shape": self._orig_shape,
+            "frame_seq": seq,
+            "latency_ms": round(latency_ms, 1),
+            "batch_size": batch_size,
+            "interpolated": False,
+            "reused": False,
+        }
+
+    def _update_stats(self, infer_ms: float, latency_ms: float, batch_size: int, now: float):
+        self.frames_processed += 1
+        self._latencies.append(latency_ms)
+        self._batch_sizes.append(batch_size)
+        self.infer_ms_ema = infer_ms if self.infer_ms_ema == 0 else 0.8 * self.infer_ms_ema + 0.2 * infer_ms
+        if self._last_processed_at is not None:
+            fps = 1.0 / max(now - self._last_processed_at, 1e-6)
+            self.processed_fps_ema = fps if self.processed_fps_ema == 0 else 0.8 * self.processed_fps_ema + 0.2 * fps
+        self._last_processed_at = now
+
+    def overlay(self, now: float) -> Optional[Detections]:
+        """Box cần vẽ lên frame tại `now`: vị trí nội suy của tracker nếu bật, nếu không là kết quả gần nhất."""
+        if self.tracker is None:
+            return self._last_dets
+        tracked = self.tracker.predict_boxes(now)
+        if not tracked:
+            return None
+        payloads = [track.payload or {} for track, _ in tracked]
+        return Detections(np.array([box for _, box in tracked], dtype=np.float32).reshape(-1, 4),
+                          np.array([p.get("confidence", 0.0) for p in payloads], dtype=np.float32),
+                          np.array([track.cls for track, _ in tracked], dtype=np.int64),
+                          np.array([p.get("label", "") for p in payloads], dtype=object),
+                          tuple(self._orig_shape or ()))
+
+    def build_detections(self, dets: Detections) -> List[Dict[str, Any]]:
+        return dets.to_records(self.record_style)
+
+    def place_box(self, detection: Dict[str, Any], box: List[float]):
+        """Ghi toạ độ box nội suy vào detection theo đúng định dạng của build_detections."""
+        set_record_box(detection, box, self.record_style)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        batch_sizes = list(self._batch_sizes)
+        return {
+            "target_fps": self.target_fps,
+            "effective_fps": round(self.effective_fps(), 2),
+            "processed_fps": round(self.processed_fps_ema, 2),
+            "inference_ms": round(self.infer_ms_ema, 1),
+            "latency_ms": {
+                "p50": round(_percentile(latencies, 50), 2),
+                "p95": round(_percentile(latencies, 95), 2),
+                "p99": round(_percentile(latencies, 99), 2),
+            },
+            "avg_batch_size": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0,
+            "frames_received": self.frames_received,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "frames_rejected": self.frames_rejected,
+            "frames_motion_skipped": self.frames_motion_skipped,
+            # Tỉ lệ lần tới lượt mà detector được bỏ qua nhờ motion gate (~ CPU tiết kiệm được)
+            "skip_ratio": round(self.frames_motion_skipped
+                                / max(self.frames_motion_skipped + self.frames_processed, 1), 3),
+            "motion_score": round(self.motion_score, 4),
+            "interpolated_sent": self.interpolated_sent,
+            "active_tracks": len(self.tracker.tracks) if self.tracker is not None else 0,
+        }
+
+
+class StreamBatchScheduler:
+    """
+    Một vòng lặp chung cho mọi phòng đang phát: mỗi lượt gom frame mới nhất của
+    các phòng đã tới hạn (cùng model) thành MỘT lần predict thay vì mỗi phòng
+    một batch 1 ảnh, rồi gửi kết quả về đúng phòng. Số batch chạy đồng thời
+    không vượt quá số worker của pool suy luận.
+    """
+
+    def __init__(self, max_batch_size: int = STREAM_BATCH_MAX_SIZE,
+                 window_ms: float = STREAM_BATCH_WINDOW_MS, pool: Optional[InferencePool] = None,
+                 **predict_kwargs):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.pool = pool or inference_pool
+        self.predict_kwargs = predict_kwargs or {"conf": STREAM_CONF, "imgsz": STREAM_IMGSZ}
+
+        self._processors: List[YOLOv8FrameProcessor] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._batch_sizes: Deque[int] = deque(maxlen=BATCH_STATS_WINDOW)
+        self.total_batches = 0
+        self.total_frames = 0
+        self.motion_skipped = 0
+
+    def _ensure_started(self):
+        # Event và task phải được tạo trong event loop đang chạy (không phải lúc import)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            # Tối đa max_workers batch cùng lúc; batch trên cùng một model vẫn chạy lần lượt
+            # vì registry khoá predict theo model (Predictor không thread-safe)
+            self._slots = asyncio.Semaphore(self.pool.max_workers)
+            self._task = loop.create_task(self._run(), name="yolo-stream-scheduler")
+
+    def register(self, processor: YOLOv8FrameProcessor):
+        self._ensure_started()
+        if processor not in self._processors:
+            self._processors.append(processor)
+
+    def unregister(self, processor: YOLOv8FrameProcessor):
+        if processor in self._processors:
+            self._processors.remove(processor)
+        if not self._processors and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            # Chờ tới khi có worker rảnh; trong lúc đó frame mới tiếp tục ghi đè frame cũ
+            await self._slots.acquire()
+            while True:
+                now = time.perf_counter()
+                # Phòng sắp tới hạn trong cửa sổ nhỏ cũng được gom luôn để batch lớn hơn
+                due = [p for p in self._processors if p.is_due(now + self.window)]
+                if due:
+                    break
+                waiting = [p.next_due_at - now for p in self._processors if p.has_new_frame()]
+                await self._wait(max(0.0, min(waiting)) if waiting else None)
+
+            # Mỗi slot chạy một batch; các nhóm còn lại vẫn tới hạn và được lấy ở lượt sau
+            due.sort(key=lambda p: p.next_due_at)
+            batch = self._group(due)[0]
+            taken = [(p, *p.take_latest(now)) for p in batch]
+            task = self._loop.create_task(self._run_batch(taken))
+            task.add_done_callback(lambda _: (self._slots.release(), self.notify()))
+
+    def _group(self, due: List[YOLOv8FrameProcessor]) -> List[List[YOLOv8FrameProcessor]]:
+        # Chỉ gom chung các phòng dùng cùng model, tối đa max_batch_size ảnh mỗi batch
+        groups: Dict[str, List[YOLOv8FrameProcessor]] = {}
+        for processor in due:
+            groups.setdefault(processor.model, []).append(processor)
+        batches = []
+        for processors in groups.values():
+            for i in range(0, len(processors), self.max_batch_size):
+                batches.append(processors[i:i + self.max_batch_size])
+        return batches
+
+    @staticmethod
+    def _prepare(taken) -> Tuple[List[Optional[np.ndarray]], List[float]]:
+        # Chạy trong executor: motion gate + chuyển frame sang ndarray cho các phòng cần suy luận
+        images, convert_s = [], []
+        for processor, frame, _, received_at in taken:
+            if processor.is_static(frame, received_at):
+                images.append(None)
+                continue
+            processor.set_reference(frame, received_at)
+            started = time.perf_counter()
+            images.append(frame.to_ndarray(format="bgr24"))
+            convert_s.append(time.perf_counter() - started)
+        return images, convert_s
+
+    async def _run_batch(self, taken):
+        try:
+            images, convert_s = await self._loop.run_in_executor(None, self._prepare, taken)
+        except Exception as e:
+            logging.error(f"Lỗi chuẩn bị frame cho batch {len(taken)} phòng: {e}")
+            for processor, *_ in taken:
+                processor.in_flight = False
+            return
+        # Ghi metric trên event loop (histogram không dùng khoá giữa các thread)
+        for seconds in convert_s:
+            stage_seconds.observe(seconds, PIPELINE_STREAM, STAGE_DECODE)
+
+        # Cảnh tĩnh: trả lại kết quả cũ, không tốn lượt detector
+        for (processor, _, seq, received_at), image in zip(taken, images):
+            if image is None:
+                processor.in_flight = False
+                self.motion_skipped += 1
+                processor.emit(processor.build_reused_message(seq, received_at))
+        run = [(item, image) for item, image in zip(taken, images) if image is not None]
+        if run:
+            await self._infer(run)
+
+    async def _infer(self, run):
+        processors = [processor for (processor, *_), _ in run]
+        started = time.perf_counter()
+        try:
+            results = await self.pool.predict(processors[0].model, [image for _, image in run],
+                                              priority=PRIORITY_STREAM, **self.predict_kwargs)
+        except InferenceQueueFull as e:
+            for processor in processors:
+                processor.reject(e.retry_after)
+            return
+        except Exception as e:
+            logging.error(f"Lỗi xử lý YOLO cho batch {len(run)} phòng: {e}")
+            for processor in processors:
+                processor.in_flight = False
+            return
+
+        infer_ms = (time.perf_counter() - started) * 1000.0
+        self.total_batches += 1
+        self.total_frames += len(run)
+        self._batch_sizes.append(len(run))
+
+        # Kết quả được giao cho hub của từng phòng rồi đi tiếp ngay: batch kế tiếp
+        # không bao giờ phải chờ socket của viewer nào
+        for ((processor, _, seq, received_at), _), r in zip(run, results):
+            processor.in_flight = False
+            # Frame chờ từ lúc nhận tới lúc batch bắt đầu chạy
+            stage_seconds.observe(started - received_at, PIPELINE_STREAM, STAGE_QUEUE)
+            observe_model_speed(PIPELINE_STREAM, r, infer_ms)
+            extract_started = time.perf_counter()
+            try:
+                message = processor.build_message(r, seq, received_at, infer_ms, len(run))
+            except Exception as e:
+                logging.error(f"Lỗi xử lý kết quả YOLO trong phòng '{processor.room_name}': {e}")
+                continue
+            stage_seconds.observe(time.perf_counter() - extract_started, PIPELINE_STREAM, STAGE_EXTRACT)
+            processor.emit(message)
+
+    def stats(self) -> Dict[str, Any]:
+        batch_sizes = list(self._batch_sizes)
+        return {
+            "active_rooms": len(self._processors),
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000.0,
+            "total_batches": self.total_batches,
+            "total_frames": self.total_frames,
+            "motion_skipped": self.motion_skipped,
+            "avg_batch_size": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0,
+        }
+
+
+# Scheduler dùng chung cho mọi phòng trong process
+stream_scheduler = StreamBatchScheduler()
@@ -0,0 +1,185 @@
+# /my_streaming_project/api/tracking.py
+
+import itertools
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from api.config import STREAM_TRACK_IOU, STREAM_TRACK_MAX_AGE_S
+
+# Tracker nhiều đối tượng kiểu SORT (Kalman + ghép IoU / khoảng cách tâm), chỉ dùng numpy/CPU.
+# Thời gian tính bằng giây (không phải số frame) vì frame được suy luận không đều.
+
+
+def _xyxy_to_cxcywh(box) -> np.ndarray:
+    x1, y1, x2, y2 = box
+    return np.array([(x1 + x2) / 2.0, (y1 + y2) / 2.0, max(x2 - x1, 1.0), max(y2 - y1, 1.0)])
+
+
+def _cxcywh_to_xyxy(state) -> List[float]:
+    cx, cy, w, h = state[:4]
+    w, h = max(w, 1.0), max(h, 1.0)
+    return [float(cx - w / 2.0), float(cy - h / 2.0), float(cx + w / 2.0), float(cy + h / 2.0)]
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU giữa từng cặp box (M, 4) x (N, 4) dạng xyxy."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class KalmanBoxTrack:
+    """
+    Một đối tượng đang được theo dõi. Trạng thái [cx, cy, w, h, vx, vy, vw, vh],
+    mô hình vận tốc không đổi; nhiễu tỉ lệ theo chiều cao box như DeepSORT.
+    """
+
+    _POS_STD = 0.05   # độ lệch đo vị trí / chiều cao box
+    _VEL_STD = 0.5    # nhiễu gia tốc (chiều cao box / giây)
+
+    def __init__(self, track_id: int, box, cls: int, now: float, payload: Any = None):
+        self.track_id = track_id
+        self.cls = cls
+        self.payload = payload
+        self.x = np.zeros(8)
+        self.x[:4] = _xyxy_to_cxcywh(box)
+        h = self.x[3]
+        # Chưa biết vận tốc -> phương sai lớn
+        self.P = np.diag(np.square([2 * self._POS_STD * h] * 4 + [10 * self._VEL_STD * h] * 4))
+        self.t = now
+        self.last_seen = now
+        self.hits = 1
+        # Số lần suy luận liên tiếp không thấy track này (chỉ hiển thị khi = 0)
+        self.misses = 0
+
+    def _transition(self, dt: float) -> np.ndarray:
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        return F
+
+    def predict(self, now: float):
+        dt = max(0.0, now - self.t)
+        if dt == 0:
+            return
+        F = self._transition(dt)
+        h = max(self.x[3], 1.0)
+        q_pos = (self._POS_STD * h) ** 2 * dt
+        q_vel = (self._VEL_STD * h) ** 2 * dt
+        Q = np.diag([q_pos] * 4 + [q_vel] * 4)
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        self.t = now
+
+    def update(self, box, now: float, payload: Any = None):
+        self.predict(now)
+        z = _xyxy_to_cxcywh(box)
+        H = np.hstack([np.eye(4), np.zeros((4, 4))])
+        R = np.diag(np.square([self._POS_STD * max(z[3], 1.0)] * 4))
+        S = H @ self.P @ H.T + R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - H @ self.x)
+        self.P = (np.eye(8) - K @ H) @ self.P
+        self.last_seen = now
+        self.hits += 1
+        self.misses = 0
+        if payload is not None:
+            self.payload = payload
+
+    def hold(self, now: float):
+        """Cảnh không đổi: giữ box tại chỗ (vận tốc = 0) và coi như vừa thấy lại."""
+        self.x[4:] = 0.0
+        self.predict(now)
+        self.last_seen = now
+
+    def box_at(self, now: float) -> List[float]:
+        """Vị trí dự đoán tại thời điểm `now` (không thay đổi trạng thái)."""
+        dt = max(0.0, now - self.t)
+        return _cxcywh_to_xyxy(self.x[:4] + self.x[4:] * dt)
+
+
+class MultiObjectTracker:
+    """Gán track ID ổn định cho các detection giữa những lần suy luận thưa."""
+
+    def __init__(self, iou_threshold: float = STREAM_TRACK_IOU, max_age_s: float = STREAM_TRACK_MAX_AGE_S,
+                 max_center_dist: float = 1.0):
+        self.iou_threshold = iou_threshold
+        self.max_center_dist = max_center_dist
+        self.max_age_s = max_age_s
+        self.tracks: List[KalmanBoxTrack] = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes: np.ndarray, classes: np.ndarray, now: float,
+               payloads: Optional[List[Any]] = None) -> List[int]:
+        """
+        Cập nhật tracker bằng detection của frame chụp tại `now`.
+        Trả về track ID tương ứng với từng detection (cùng thứ tự).
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        classes = np.asarray(classes).reshape(-1)
+        payloads = payloads if payloads is not None else [None] * len(boxes)
+        for track in self.tracks:
+            track.predict(now)
+
+        predicted = np.array([_cxcywh_to_xyxy(t.x) for t in self.tracks]).reshape(-1, 4)
+        ious = iou_matrix(predicted, boxes)
+        # Chỉ ghép track với detection cùng class
+        if ious.size:
+            ious[np.array([t.cls for t in self.tracks])[:, None] != classes[None, :]] = 0.0
+
+        # Khoảng cách tâm chuẩn hoá theo đường chéo box dự đoán: dùng khi IoU quá thấp
+        # (vật di chuyển nhanh giữa hai lần suy luận thưa, track mới chưa biết vận tốc)
+        dists = np.full(ious.shape, np.inf)
+        if ious.size:
+            centers = (predicted[:, None, :2] + predicted[:, None, 2:]) / 2.0
+            det_centers = (boxes[None, :, :2] + boxes[None, :, 2:]) / 2.0
+            diag = np.hypot(predicted[:, 2] - predicted[:, 0], predicted[:, 3] - predicted[:, 1])
+            dists = np.linalg.norm(centers - det_centers, axis=2) / np.maximum(diag[:, None], 1e-9)
+            dists[np.array([t.cls for t in self.tracks])[:, None] != classes[None, :]] = np.inf
+
+        ids: List[Optional[int]] = [None] * len(boxes)
+        used_tracks = set()
+        # Ghép tham lam (đủ tốt với số đối tượng nhỏ, không cần scipy): trước theo IoU giảm dần,
+        # sau đó các cặp còn lại theo khoảng cách tâm tăng dần
+        pairs = [(ti, di) for ti, di in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape))
+                 if ious[ti, di] >= self.iou_threshold]
+        pairs += [(ti, di) for ti, di in zip(*np.unravel_index(np.argsort(dists, axis=None), dists.shape))
+                  if dists[ti, di] <= self.max_center_dist]
+        for ti, di in pairs:
+            if ti in used_tracks or ids[di] is not None:
+                continue
+            track = self.tracks[ti]
+            track.update(boxes[di], now, payloads[di])
+            used_tracks.add(ti)
+            ids[di] = track.track_id
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+        for di, track_id in enumerate(ids):
+            if track_id is None:
+                track = KalmanBoxTrack(next(self._ids), boxes[di], int(classes[di]), now, payloads[di])
+                self.tracks.append(track)
+                ids[di] = track.track_id
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age_s]
+        return ids
+
+    def predict_boxes(self, now: float) -> List[Tuple[KalmanBoxTrack, List[float]]]:
+        """Vị trí nội suy của mọi track còn sống tại `now` (dùng cho các frame không suy luận)."""
+        # Track vừa bị lỡ ở lần suy luận gần nhất được giữ lại để ghép lại, nhưng không hiển thị
+        return [(t, t.box_at(now)) for t in self.tracks
+                if t.misses == 0 and now - t.last_seen <= self.max_age_s]
+
+    def hold(self, now: float):
+        """Giữ nguyên các track đang hiển thị khi detector được bỏ qua vì cảnh tĩnh."""
+        for track in self.tracks:
+            if track.misses == 0:
+                track.hold(now)
@@ -0,0 +1,242 @@
+# /my_streaming_project/api/video_processing.py
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import av
+import numpy as np
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+
+from api.annotate import draw_detections
+from api.batching import BatchScheduler
+from api.config import (BULK_BATCH_MAX_SIZE, BULK_BATCH_MAX_WAIT_MS, PREDICT_CLASSES, PREDICT_MODEL,
+                        VIDEO_MAX_IN_FLIGHT, VIDEO_OUTPUT_CODEC, VIDEO_OUTPUT_DIR, VIDEO_OUTPUT_TTL_S,
+                        VIDEO_STRIDE)
+from api.inference_pool import PRIORITY_BACKGROUND, InferenceQueueFull
+from api.postprocess import Detections, extract
+
+# Suy luận trên file video upload: PyAV giải mã lần lượt từng frame (trong một thread
+# riêng), lấy mẫu 1/stride frame, suy luận theo batch ở độ ưu tiên nền và stream kết quả
+# từng frame dạng NDJSON theo đúng thứ tự frame. Tối đa VIDEO_MAX_IN_FLIGHT frame nằm
+# trong bộ nhớ cùng lúc, dù video dài bao nhiêu.
+
+router = APIRouter()
+scheduler = BatchScheduler(PREDICT_MODEL, max_batch_size=BULK_BATCH_MAX_SIZE, max_wait_ms=BULK_BATCH_MAX_WAIT_MS,
+                           name="predict_video", priority=PRIORITY_BACKGROUND,
+                           max_pending=VIDEO_MAX_IN_FLIGHT + 1, conf=0.25, imgsz=640)
+
+_VIDEO_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def _line(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def video_info(container, stride: int) -> Dict[str, Any]:
+    stream = container.streams.video[0]
+    fps = float(stream.average_rate) if stream.average_rate else None
+    return {
+        "width": stream.codec_context.width,
+        "height": stream.codec_context.height,
+        "fps": round(fps, 3) if fps else None,
+        "frames": stream.frames or None,  # 0 = container không ghi số frame
+        "duration_s": round(float(container.duration) / av.time_base, 3) if container.duration else None,
+        "stride": stride,
+    }
+
+
+def iter_frames(container, stride: int) -> Iterator[Tuple[int, Optional[float], np.ndarray]]:
+    """(số thứ tự frame, thời điểm (giây), ảnh BGR) của mỗi frame được lấy mẫu."""
+    stream = container.streams.video[0]
+    stream.thread_type = "AUTO"  # decoder tự chia nhiều thread
+    for index, frame in enumerate(container.decode(stream)):
+        # Frame bỏ qua vẫn phải giải mã (frame sau phụ thuộc frame trước) nhưng không đổi sang mảng
+        if index % stride == 0:
+            yield index, frame.time, frame.to_ndarray(format="bgr24")
+
+
+class AnnotatedVideoWriter:
+    """Ghi các frame đã lấy mẫu (có vẽ box) thành video, fps = fps gốc / stride."""
+
+    def __init__(self, path: str, width: int, height: int, fps: float, codec: str = VIDEO_OUTPUT_CODEC):
+        self.path = path
+        self.container = av.open(path, mode="w")
+        rate = Fraction(fps).limit_denominator(1000)
+        try:
+            self.stream = self.container.add_stream(codec, rate=rate)
+        except ValueError:
+            logging.warning(f"Không có codec {codec}, ghi video kết quả bằng mpeg4")
+            self.stream = self.container.add_stream("mpeg4", rate=rate)
+        # yuv420p cần kích thước chẵn
+        self.stream.width, self.stream.height = width - width % 2, height - height % 2
+        self.stream.pix_fmt = "yuv420p"
+        self.frames = 0
+
+    def write(self, image_bgr: np.ndarray, dets: Detections):
+        draw_detections(image_bgr, dets)
+        frame = av.VideoFrame.from_ndarray(image_bgr, format="bgr24")
+        frame = frame.reformat(width=self.stream.width, height=self.stream.height, format="yuv420p")
+        frame.pts = self.frames
+        self.frames += 1
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+
+    def close(self):
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+
+
+def _cleanup_outputs():
+    # Xoá video kết quả quá hạn (gọi mỗi khi có job mới)
+    if not os.path.isdir(VIDEO_OUTPUT_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(VIDEO_OUTPUT_DIR):
+        path = os.path.join(VIDEO_OUTPUT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > VIDEO_OUTPUT_TTL_S:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+async def _infer(image: np.ndarray):
+    while True:
+        try:
+            return await scheduler.submit(image)
+        except InferenceQueueFull as e:
+            # Job nền nhường chỗ khi hệ thống quá tải, thử lại thay vì huỷ cả video
+            await asyncio.sleep(min(e.retry_after, 2))
+
+
+async def video_results(container, decode_executor: ThreadPoolExecutor, stride: int,
+                        annotate: bool) -> AsyncIterator[bytes]:
+    """
+    Dòng đầu {"video": {...}}, sau đó mỗi frame được lấy mẫu một dòng
+    {"frame", "time", "detections", "timing"}, dòng cuối {"summary": {...}}.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    info = video_info(container, stride)
+    frames = iter_frames(container, stride)
+    pending: deque = deque()
+    next_frame: Optional[asyncio.Future] = None
+    writer: Optional[AnnotatedVideoWriter] = None
+    write_future: Optional[asyncio.Future] = None
+    video_id = None
+    processed = 0
+    finished = False
+
+    try:
+        yield _line({"video": info})
+        if annotate:
+            os.makedirs(VIDEO_OUTPUT_DIR, exist_ok=True)
+            video_id = uuid.uuid4().hex
+            writer = AnnotatedVideoWriter(os.path.join(VIDEO_OUTPUT_DIR, f"{video_id}.mp4"),
+                                          info["width"], info["height"], (info["fps"] or 30.0) / stride)
+
+        next_frame = loop.run_in_executor(decode_executor, next, frames, None)
+        while True:
+            # Giữ pipeline đầy: frame kế tiếp luôn được giải mã trong lúc chờ kết quả frame đầu hàng
+            while next_frame is not None and len(pending) < VIDEO_MAX_IN_FLIGHT:
+                item = await next_frame
+                if item is None:
+                    next_frame = None
+                    break
+                pending.append((item, loop.create_task(_infer(item[2]))))
+                next_frame = loop.run_in_executor(decode_executor, next, frames, None)
+            if not pending:
+                break
+
+            (index, frame_time, image), task = pending.popleft()
+            r, timing = await task
+            dets = extract(r, classes=PREDICT_CLASSES)
+            if writer is not None:
+                # Ghi tuần tự, tối đa một frame đang ghi để bộ nhớ không dồn lên
+                if write_future is not None:
+                    await write_future
+                write_future = loop.run_in_executor(decode_executor, writer.write, image, dets)
+            processed += 1
+            yield _line({"frame": index, "time": round(frame_time, 3) if frame_time is not None else None,
+                         "detections": dets.to_records(), "timing": timing})
+
+        summary = {"frames_processed": processed, "elapsed_s": round(time.perf_counter() - started, 3)}
+        if writer is not None:
+            if write_future is not None:
+                await write_future
+            await loop.run_in_executor(decode_executor, writer.close)
+            writer = None
+            summary["annotated_url"] = f"/predict/video/{video_id}"
+        finished = True
+        yield _line({"summary": summary})
+    finally:
+        # Client ngắt kết nối hoặc lỗi giữa chừng -> huỷ frame đang chờ, đóng decoder, bỏ video dở
+        for _, task in pending:
+            task.cancel()
+        if next_frame is not None:
+            next_frame.cancel()
+        decode_executor.submit(frames.close)
+        decode_executor.submit(container.close)
+        if writer is not None:
+            decode_executor.submit(writer.container.close)
+        if video_id is not None and not finished:
+            decode_executor.submit(_remove_quietly, os.path.join(VIDEO_OUTPUT_DIR, f"{video_id}.mp4"))
+        decode_executor.shutdown(wait=False)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@router.post("/video")
+async def predict_video(file: UploadFile = File(...), stride: int = Query(VIDEO_STRIDE, ge=1),
+                        annotate: bool = Query(False)):
+    """
+    Nhận một file video, trả về NDJSON kết quả từng frame (1 frame mỗi `stride` frame).
+    `annotate=true`: ghi thêm video có vẽ box, tải về qua "annotated_url" ở dòng cuối.
+    """
+    logging.info(f"Nhận video {file.filename} (stride={stride}, annotate={annotate})")
+    _cleanup_outputs()
+    # Mỗi video một thread giải mã riêng (container PyAV chỉ được dùng từ một thread tại một thời điểm)
+    decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yolo-video-decode")
+    loop = asyncio.get_running_loop()
+    try:
+        container = await loop.run_in_executor(decode_executor, lambda: av.open(file.file, mode="r"))
+        if not container.streams.video:
+            container.close()
+            raise HTTPException(status_code=400, detail="File không có luồng video.")
+    except av.FFmpegError as e:
+        decode_executor.shutdown(wait=False)
+        raise HTTPException(status_code=400, detail=f"Không đọc được video: {e}")
+    except HTTPException:
+        decode_executor.shutdown(wait=False)
+        raise
+    return StreamingResponse(video_results(container, decode_executor, stride, annotate),
+                             media_type="application/x-ndjson")
+
+
+@router.get("/video/stats")
+def predict_video_stats():
+    return scheduler.stats()
+
+
+@router.get("/video/{video_id}")
+def annotated_video(video_id: str):
+    path = os.path.join(VIDEO_OUTPUT_DIR, f"{video_id}.mp4")
+    if not _VIDEO_ID.fullmatch(video_id) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Video không tồn tại hoặc đã hết hạn")
+    return FileResponse(path, media_type="video/mp4", filename=f"{video_id}.mp4")
@@ -101,11 +101,24 @@
 # /my_streaming_project/api/webrtc_signaling_simple.py (ĐÃ SỬA LỖI LOGIC)
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, Optional, List
+from typing import Dict, Optional, Tuple
+import asyncio
+import base64
+import json
 import logging
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCConfiguration, RTCIceServer
+from aiortc.contrib.media import MediaRelay
 from aiortc.sdp import candidate_from_sdp
 
+from api.annotated_track import AnnotatedRoomTrack
+from api.config import PROFILING_ENABLED, ROOM_FORWARD_QUEUE, STREAM_ANNOTATED_VIDEO, STREAM_TARGET_FPS
+from api.metrics import registry as metrics
+from api.profiling import check_token, parse_frame_count, profile_stream
+from api.result_hub import ResultHub
+from api.room_backend import EVENTS_CHANNEL, RoomBackend, create_room_backend, node_channel
+from api.stream_processing import YOLOv8FrameProcessor, parse_target_fps, stream_scheduler
+from api.wire_format import negotiate_encoder
+
 router = APIRouter()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -114,128 +127,544 @@ STUN_SERVER = RTCConfiguration([
 ])
 
 class Room:
-    def __init__(self):
+    def __init__(self, room_name: str):
+        self.room_name = room_name
         self.broadcaster_pc: Optional[RTCPeerConnection] = None
         # *** THAY ĐỔI: Lưu cả PC và Websocket của Viewer ***
-        self.viewer_connections: Dict[str, Dict] = {} # { client_id: {"pc": pc, "ws": ws} }
+        # "track": nhánh relay đã gắn vào PC của viewer (dừng khi viewer rời)
+        self.viewer_connections: Dict[str, Dict] = {} # { client_id: {"pc": pc, "ws": ws, "track": t} }
+        # Kết quả YOLO đi qua hub: mỗi viewer một hàng đợi nhỏ (giữ message mới nhất) và task gửi riêng;
+        # encoder nhị phân (nếu viewer chọn) nằm trong subscription của viewer
+        self.hub = ResultHub(room_name)
+        # Track video của broadcaster; frame được giải mã MỘT lần rồi chia qua relay cho
+        # processor YOLO, track vẽ box và từng viewer (mỗi nhánh chỉ giữ frame mới nhất)
         self.video_track: Optional[MediaStreamTrack] = None
+        self.relay: Optional[MediaRelay] = None
+        # Bộ xử lý YOLO: một nhánh relay riêng, tự đọc frame, suy luận nền trên frame mới nhất
+        self.processor: Optional[YOLOv8FrameProcessor] = None
+        self.target_fps: float = STREAM_TARGET_FPS
+        # Video có vẽ box phía server (vẽ một lần, chia cho mọi viewer qua relay)
+        self.annotated_video: bool = STREAM_ANNOTATED_VIDEO
+        self.annotated_track: Optional[AnnotatedRoomTrack] = None
+        # Yêu cầu profile tới trước khi có video: (số frame, websocket người yêu cầu)
+        self.pending_profile: Optional[Tuple[int, WebSocket]] = None
+
+    def attach_video(self, track: MediaStreamTrack):
+        """Nhận track video của broadcaster: tạo relay, processor YOLO và (nếu bật) track vẽ box."""
+        self.detach_video()
+        self.video_track = track
+        self.relay = MediaRelay()
+        # buffered=False: nhánh nào đọc chậm chỉ nhận frame mới nhất, không làm chậm nhánh khác
+        self.processor = YOLOv8FrameProcessor(self.relay.subscribe(track, buffered=False), self.room_name,
+                                              self.hub.publish, target_fps=self.target_fps)
+        # Processor tự đọc frame: suy luận chạy kể cả khi phòng chưa có viewer
+        self.processor.start()
+        if self.annotated_video:
+            self.annotated_track = AnnotatedRoomTrack(self.processor, self.relay.subscribe(track, buffered=False))
+        if self.pending_profile:
+            frames, ws = self.pending_profile
+            self.pending_profile = None
+            self.start_profile(frames, ws)
+
+    def detach_video(self):
+        if self.annotated_track:
+            self.annotated_track.stop()
+            self.annotated_track = None
+        if self.processor:
+            self.processor.stop()
+            self.processor.track.stop()
+            self.processor = None
+
+    def add_viewer_track(self, conn: Dict):
+        # Phòng bật video vẽ box: mỗi viewer một bản sao từ relay, frame chỉ vẽ một lần
+        if self.annotated_track is not None:
+            track = self.annotated_track.subscribe()
+        else:
+            track = self.relay.subscribe(self.video_track, buffered=False)
+        conn["pc"].addTrack(track)
+        conn["track"] = track
+
+    def start_profile(self, frames: int, ws):
+        """Profile N frame suy luận tiếp theo của phòng; chưa có video thì chờ broadcaster gửi track."""
+        if self.processor is None:
+            self.pending_profile = (frames, ws)
+            return
+        asyncio.ensure_future(self._run_profile(frames, ws))
+
+    async def _run_profile(self, frames: int, ws):
+        try:
+            meta = await profile_stream(self.processor, frames, self.room_name)
+        except Exception as e:
+            logging.error(f"Lỗi khi profile phòng '{self.room_name}': {e}")
+            message = {"type": "profile_error", "detail": "Không profile được phòng"}
+        else:
+            if meta is None:
+                message = {"type": "profile_error", "detail": "Đang có quá nhiều profile chạy, thử lại sau"}
+            else:
+                message = {"type": "profile_ready", "profile_id": meta["id"], "frames": meta["frames_processed"],
+                           "duration_ms": meta["duration_ms"], "url": f"/admin/profiles/{meta['id']}"}
+        try:
+            await ws.send_json(message)
+        except Exception as e:
+            logging.warning(f"Không gửi được kết quả profile của phòng '{self.room_name}': {e}")
+
+    def set_target_fps(self, fps):
+        """Đổi FPS suy luận của phòng; ValueError nếu `fps` không phải số dương hữu hạn."""
+        self.target_fps = parse_target_fps(fps)
+        if self.processor:
+            self.processor.target_fps = self.target_fps
 
     async def close(self):
+        self.detach_video()
+        self.hub.close()
         if self.broadcaster_pc: await self.broadcaster_pc.close()
-        for conn in self.viewer_connections.values(): await conn["pc"].close()
+        for conn in self.viewer_connections.values(): await close_viewer(conn)
         self.viewer_connections.clear()
 
+
+async def _request_profile(room: Room, websocket, data: Dict, frames):
+    """Kiểm tra token và số frame trước khi bắt đầu profile; sai thì báo lỗi cho client."""
+    if not check_token(data.get("token")):
+        detail = "Sai hoặc thiếu token"
+    else:
+        try:
+            room.start_profile(parse_frame_count(frames), websocket)
+            return
+        except ValueError as e:
+            detail = str(e)
+    await websocket.send_json({"type": "profile_error", "detail": detail})
+
+
+async def _request_target_fps(room: Room, websocket, fps) -> bool:
+    """Đổi FPS mục tiêu theo yêu cầu client; giá trị sai thì báo lỗi cho client thay vì ngắt session."""
+    try:
+        room.set_target_fps(fps)
+        return True
+    except ValueError as e:
+        await websocket.send_json({"type": "target_fps_error", "detail": str(e)})
+        return False
+
+
+async def close_viewer(conn: Dict):
+    # Dừng nhánh relay của viewer để relay không còn đẩy frame cho nó
+    if conn.get("track"): conn["track"].stop()
+    await conn["pc"].close()
+
 rooms: Dict[str, Room] = {}
 
+# Trạng thái dùng chung giữa các worker / node (mặc định: trong bộ nhớ process này)
+backend: RoomBackend = create_room_backend()
+_backend_ready: Optional[asyncio.Task] = None
+# Client có WebSocket nối vào node này
+local_sessions: Dict[Tuple[str, str], "ClientSession"] = {}
+# Client nối vào node khác nhưng phòng do node này giữ (signaling + kết quả đi qua backend)
+remote_sessions: Dict[Tuple[str, str], "RemoteSession"] = {}
+
+
+async def ensure_backend():
+    global _backend_ready
+    if _backend_ready is None:
+        _backend_ready = asyncio.get_running_loop().create_task(_start_backend())
+    await _backend_ready
+
+
+async def _start_backend():
+    await backend.start()
+    await backend.subscribe(node_channel(backend.node_id), _on_node_message)
+    await backend.subscribe(EVENTS_CHANNEL, _on_room_event)
+    backend.on_ownership_lost(_on_ownership_lost)
+
+
+class RemoteClientSocket:
+    """Thay cho WebSocket của client đang nối vào node khác: mọi lần gửi thành message trên backend."""
+
+    def __init__(self, node_id: str, room_name: str, client_id: str):
+        self.node_id = node_id
+        self.room_name = room_name
+        self.client_id = client_id
+
+    def _forward(self, **message):
+        backend.publish(node_channel(self.node_id), {"op": "send", "room": self.room_name,
+                                                     "client_id": self.client_id, **message})
+
+    async def send_json(self, data):
+        self._forward(kind="text", payload=json.dumps(data))
+
+    async def send_text(self, data: str):
+        self._forward(kind="text", payload=data)
+
+    async def send_bytes(self, data: bytes):
+        self._forward(kind="bytes", payload=base64.b64encode(data).decode("ascii"))
+
+    async def close(self, code: int = 1000):
+        self._forward(kind="close", payload=code)
+
+
+class ClientSession:
+    """
+    Một client (broadcaster hoặc viewer) của một phòng. `ws` là WebSocket thật, hoặc
+    RemoteClientSocket khi client nối vào node khác. Nếu phòng do node khác giữ, session
+    chỉ chuyển tiếp message của client tới node đó (`owner`).
+    """
+
+    def __init__(self, room_name: str, client_id: str, ws):
+        self.room_name = room_name
+        self.client_id = client_id
+        self.ws = ws
+        if room_name not in rooms: rooms[room_name] = Room(room_name)
+        self.room = rooms[room_name]
+        self.is_broadcaster = False
+        self.pc: Optional[RTCPeerConnection] = None
+        self.join_data: Optional[Dict] = None
+        self.owner: Optional[str] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.room_name, self.client_id
+
+    async def route(self, data: Dict):
+        """Message từ WebSocket của client: xử lý tại node này hoặc chuyển tới node giữ phòng."""
+        msg_type = data.get("type")
+        if self.owner is None and msg_type in ("offer", "join_as_viewer"):
+            if msg_type == "offer":
+                owner = await backend.claim_room(self.room_name)
+            else:
+                self.join_data = data
+                owner = await backend.room_owner(self.room_name)
+            await backend.add_member(self.room_name, self.client_id,
+                                     "broadcaster" if msg_type == "offer" else "viewer")
+            if owner is not None and owner != backend.node_id:
+                logging.info(f"Phòng '{self.room_name}' do node '{owner}' giữ, chuyển tiếp client '{self.client_id}'.")
+                self.owner = owner
+            elif msg_type == "offer":
+                # Node này giữ phòng: báo các node khác để viewer đang chờ ở đó nối về đây
+                backend.publish(EVENTS_CHANNEL, {"event": "owner", "room": self.room_name, "node": backend.node_id})
+        if self.owner is not None:
+            self._forward(data)
+        else:
+            await self.handle(data)
+
+    def _forward(self, data: Dict):
+        backend.publish(node_channel(self.owner), {"op": "client", "room": self.room_name,
+                                                   "client_id": self.client_id, "from": backend.node_id,
+                                                   "data": data})
+
+    async def reroute(self, owner: str):
+        """Phòng đổi node giữ: viewer đang chờ / đang xem chuyển sang node mới."""
+        if self.owner == owner or self.is_broadcaster or self.join_data is None:
+            return
+        if self.owner is not None:
+            backend.publish(node_channel(self.owner), {"op": "client_left", "room": self.room_name,
+                                                       "client_id": self.client_id})
+        else:
+            await self._leave_room()
+        logging.info(f"Viewer '{self.client_id}' chuyển sang node '{owner}' (giữ phòng '{self.room_name}').")
+        self.owner = owner
+        self._forward(self.join_data)
+
+    def deliver(self, message: Dict):
+        """Message từ node giữ phòng gửi về client này; gửi theo thứ tự bằng task riêng."""
+        if self._outbox is None:
+            self._outbox = asyncio.Queue(maxsize=max(1, ROOM_FORWARD_QUEUE))
+            self._sender = asyncio.get_running_loop().create_task(self._send_forwarded())
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            # Client không nhận kịp: như viewer treo trên node giữ phòng -> ngắt
+            logging.warning(f"Client '{self.client_id}' không nhận kịp message chuyển tiếp, ngắt kết nối.")
+            self._sender.cancel()
+            asyncio.ensure_future(self.ws.close(code=1013))
+
+    async def _send_forwarded(self):
+        while True:
+            message = await self._outbox.get()
+            kind, payload = message["kind"], message["payload"]
+            try:
+                if kind == "text":
+                    await self.ws.send_text(payload)
+                elif kind == "bytes":
+                    await self.ws.send_bytes(base64.b64decode(payload))
+                else:
+                    await self.ws.close(code=payload)
+                    return
+            except Exception:
+                return
+
+    async def handle(self, data: Dict):
+        room, websocket, client_id, room_name = self.room, self.ws, self.client_id, self.room_name
+        msg_type = data.get("type")
+
+        if msg_type == "offer":
+            # --- XỬ LÝ BROADCASTER ---
+            self.is_broadcaster = True
+            pc = self.pc = RTCPeerConnection(STUN_SERVER)
+            room.broadcaster_pc = pc
+            if data.get("target_fps") is not None:
+                await _request_target_fps(room, websocket, data["target_fps"])
+            if "annotated_video" in data:
+                room.annotated_video = bool(data["annotated_video"])
+            if PROFILING_ENABLED and data.get("profile_frames") is not None:
+                await _request_profile(room, websocket, data, data["profile_frames"])
+
+            @pc.on("track")
+            async def on_track(track):
+                if track.kind == "video":
+                    logging.info(f"Đã nhận Video Track cho phòng '{room_name}'")
+                    # Giải mã một lần, chia qua relay cho YOLO và mọi viewer
+                    room.attach_video(track)
+
+                    # *** SỬA LỖI: Gửi offer cho tất cả viewer đang chờ ***
+                    for viewer_id, conn in room.viewer_connections.items():
+                        try:
+                            viewer_pc = conn["pc"]
+                            viewer_ws = conn["ws"]
+
+                            # 1. Thêm track
+                            room.add_viewer_track(conn)
+
+                            # 2. Tạo offer (BÂY GIỜ MỚI HỢP LỆ)
+                            offer = await viewer_pc.createOffer()
+                            await viewer_pc.setLocalDescription(offer)
+
+                            # 3. Gửi offer cho viewer (kèm cờ video đã vẽ box -> client không tự vẽ)
+                            await viewer_ws.send_json({"type": "offer", "sdp": viewer_pc.localDescription.__dict__,
+                                                       "annotated_video": room.annotated_track is not None})
+                            logging.info(f"Đã gửi offer (với track) cho viewer '{viewer_id}'.")
+                        except Exception as e:
+                            logging.error(f"Lỗi khi gửi offer cho viewer '{viewer_id}': {e}")
+
+            await pc.setRemoteDescription(RTCSessionDescription(**data["sdp"]))
+            answer = await pc.createAnswer()
+            await pc.setLocalDescription(answer)
+            await websocket.send_json({"type": "answer", "sdp": pc.localDescription.__dict__})
+
+        elif msg_type == "join_as_viewer":
+            # --- XỬ LÝ VIEWER ---
+            pc = self.pc = RTCPeerConnection(STUN_SERVER)
+            # *** SỬA LỖI: Lưu cả PC và Websocket ***
+            room.viewer_connections[client_id] = {"pc": pc, "ws": websocket}
+            room.hub.subscribe(client_id, websocket, negotiate_encoder(data))
+
+            # *** SỬA LỖI: Chỉ gửi offer NẾU track đã có sẵn ***
+            if room.video_track:
+                logging.info(f"Gửi track (đã có) cho viewer '{client_id}'")
+                room.add_viewer_track(room.viewer_connections[client_id])
+
+                offer = await pc.createOffer()
+                await pc.setLocalDescription(offer)
+                await websocket.send_json({"type": "offer", "sdp": pc.localDescription.__dict__,
+                                           "annotated_video": room.annotated_track is not None})
+            else:
+                # Nếu track chưa có, chỉ cần chờ.
+                logging.info(f"Viewer '{client_id}' đang chờ broadcaster...")
+
+        elif msg_type == "set_encoding":
+            # --- VIEWER ĐỔI ĐỊNH DẠNG KẾT QUẢ (json | binary) ---
+            room.hub.set_encoder(client_id, negotiate_encoder(data))
+
+        elif msg_type == "set_target_fps":
+            # --- ĐỔI FPS SUY LUẬN MỤC TIÊU CỦA PHÒNG ---
+            if await _request_target_fps(room, websocket, data.get("fps")):
+                logging.info(f"Phòng '{room_name}' đặt FPS suy luận mục tiêu = {room.target_fps}")
+
+        elif msg_type == "profile" and PROFILING_ENABLED:
+            # --- PROFILE N FRAME TIẾP THEO CỦA PHÒNG (YOLO_PROFILING_ENABLED=1) ---
+            await _request_profile(room, websocket, data, data.get("frames", 30))
+
+        elif msg_type == "answer":
+            # --- XỬ LÝ ANSWER TỪ VIEWER ---
+            if client_id in room.viewer_connections:
+                viewer_pc = room.viewer_connections[client_id]["pc"]
+                await viewer_pc.setRemoteDescription(RTCSessionDescription(**data["sdp"]))
+
+        elif msg_type == "candidate" and data.get("candidate"):
+            # --- XỬ LÝ ICE CANDIDATE ---
+            pc_to_update = None
+            if self.is_broadcaster:
+                pc_to_update = room.broadcaster_pc
+            elif client_id in room.viewer_connections:
+                pc_to_update = room.viewer_connections[client_id]["pc"]
+
+            if pc_to_update:
+                try:
+                    cand_data = data["candidate"]
+                    # Xử lý định dạng candidate linh hoạt hơn
+                    if isinstance(cand_data, dict):
+                        cand = candidate_from_sdp(cand_data['candidate'].split(":", 1)[1])
+                        cand.sdpMid = cand_data['sdpMid']
+                        cand.sdpMLineIndex = cand_data['sdpMLineIndex']
+                        await pc_to_update.addIceCandidate(cand)
+                    elif isinstance(cand_data, str):
+                        cand = candidate_from_sdp(cand_data.split(":", 1)[1])
+                        await pc_to_update.addIceCandidate(cand)
+                except Exception as e:
+                    logging.warning(f"Lỗi khi thêm ICE candidate: {e} - Data: {data.get('candidate')}")
+
+    async def _leave_room(self):
+        # Dọn phần của client trong phòng ở node này
+        room_name, client_id = self.room_name, self.client_id
+        if room_name in rooms:
+            if self.is_broadcaster:
+                logging.info(f"Broadcaster phòng '{room_name}' đã rời. Đóng phòng.")
+                await rooms[room_name].close()
+                if room_name in rooms: del rooms[room_name]
+                await backend.release_room(room_name)
+            elif client_id in rooms[room_name].viewer_connections:
+                logging.info(f"Viewer '{client_id}' đã rời.")
+                conn = rooms[room_name].viewer_connections.pop(client_id)
+                rooms[room_name].hub.unsubscribe(client_id)
+                await close_viewer(conn)
+
+    async def leave(self):
+        if self._sender is not None:
+            self._sender.cancel()
+        if self.owner is not None:
+            backend.publish(node_channel(self.owner), {"op": "client_left", "room": self.room_name,
+                                                       "client_id": self.client_id})
+            # Phòng chỉ có client chuyển tiếp thì không cần giữ Room ở node này
+            room = rooms.get(self.room_name)
+            if room is self.room and room.broadcaster_pc is None and not room.viewer_connections:
+                del rooms[self.room_name]
+        else:
+            await self._leave_room()
+
+
+class RemoteSession:
+    """Session của client nối qua node khác; message được xử lý lần lượt theo đúng thứ tự."""
+
+    def __init__(self, room_name: str, client_id: str, node_id: str):
+        self.node_id = node_id
+        self.session = ClientSession(room_name, client_id, RemoteClientSocket(node_id, room_name, client_id))
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            data = await self.inbox.get()
+            if data is None:
+                await self.session.leave()
+                return
+            try:
+                await self.session.handle(data)
+            except Exception as e:
+                logging.error(f"Lỗi khi xử lý message chuyển tiếp của client '{self.session.client_id}': {e}")
+
+
+def _on_node_message(message: Dict):
+    key = (message.get("room"), message.get("client_id"))
+    op = message.get("op")
+    if op == "client":
+        # Node này giữ phòng, client nối qua node khác
+        remote = remote_sessions.get(key)
+        if remote is None or remote.node_id != message["from"]:
+            if remote is not None:
+                remote.inbox.put_nowait(None)
+            remote = remote_sessions[key] = RemoteSession(*key, message["from"])
+        remote.inbox.put_nowait(message["data"])
+    elif op == "client_left":
+        remote = remote_sessions.pop(key, None)
+        if remote is not None:
+            remote.inbox.put_nowait(None)
+    elif op == "send":
+        # Node giữ phòng gửi về client đang nối vào node này
+        session = local_sessions.get(key)
+        if session is not None:
+            session.deliver(message)
+
+
+def _on_room_event(event: Dict):
+    if event.get("event") != "owner" or event.get("node") == backend.node_id:
+        return
+    for session in list(local_sessions.values()):
+        if session.room_name == event.get("room"):
+            asyncio.ensure_future(session.reroute(event["node"]))
+
+
+def _on_ownership_lost(room_name: str):
+    asyncio.ensure_future(_give_up_room(room_name))
+
+
+async def _give_up_room(room_name: str):
+    """
+    Node mất quyền giữ phòng (không gia hạn được trước khi hết TTL, node khác có thể đã nhận):
+    không phục vụ phòng như node giữ phòng nữa. Dừng media + YOLO của phòng và đóng kết nối của
+    mọi client đang được phục vụ tại đây (1012) để client nối lại và được định tuyến về node giữ phòng.
+    """
+    logging.warning(f"Dừng phục vụ phòng '{room_name}' tại node '{backend.node_id}' (mất quyền giữ phòng)")
+    room = rooms.pop(room_name, None)
+    if room is not None:
+        await room.close()
+    for key, remote in list(remote_sessions.items()):
+        if key[0] == room_name:
+            del remote_sessions[key]
+            await remote.session.ws.close(code=1012)
+            remote.inbox.put_nowait(None)
+    for session in list(local_sessions.values()):
+        # Client chỉ chuyển tiếp tới node khác (owner != None) không bị ảnh hưởng
+        if session.room_name == room_name and session.owner is None:
+            try:
+                await session.ws.close(code=1012)
+            except Exception as e:
+                logging.warning(f"Không đóng được kết nối của client '{session.client_id}': {e}")
+
+
 @router.websocket("/ws/{room_name}/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, room_name: str, client_id: str):
     await websocket.accept()
     logging.info(f"Client '{client_id}' kết nối vào phòng '{room_name}'.")
-    
-    if room_name not in rooms: rooms[room_name] = Room()
-    room = rooms[room_name]
-    
-    is_broadcaster = False
-    pc: Optional[RTCPeerConnection] = None
+    await ensure_backend()
+
+    session = ClientSession(room_name, client_id, websocket)
+    local_sessions[session.key] = session
 
     try:
         while True:
             data = await websocket.receive_json()
-            msg_type = data.get("type")
-
-            if msg_type == "offer":
-                # --- XỬ LÝ BROADCASTER ---
-                is_broadcaster = True
-                pc = RTCPeerConnection(STUN_SERVER)
-                room.broadcaster_pc = pc
-                
-                @pc.on("track")
-                async def on_track(track):
-                    if track.kind == "video":
-                        logging.info(f"Đã nhận Video Track cho phòng '{room_name}'")
-                        room.video_track = track
-                        
-                        # *** SỬA LỖI: Gửi offer cho tất cả viewer đang chờ ***
-                        for viewer_id, conn in room.viewer_connections.items():
-                            try:
-                                viewer_pc = conn["pc"]
-                                viewer_ws = conn["ws"]
-                                
-                                # 1. Thêm track
-                                viewer_pc.addTrack(track)
-                                
-                                # 2. Tạo offer (BÂY GIỜ MỚI HỢP LỆ)
-                                offer = await viewer_pc.createOffer()
-                                await viewer_pc.setLocalDescription(offer)
-                                
-                                # 3. Gửi offer cho viewer
-                                await viewer_ws.send_json({"type": "offer", "sdp": viewer_pc.localDescription.__dict__})
-                                logging.info(f"Đã gửi offer (với track) cho viewer '{viewer_id}'.")
-                            except Exception as e:
-                                logging.error(f"Lỗi khi gửi offer cho viewer '{viewer_id}': {e}")
-                
-                await pc.setRemoteDescription(RTCSessionDescription(**data["sdp"]))
-                answer = await pc.createAnswer()
-                await pc.setLocalDescription(answer)
-                await websocket.send_json({"type": "answer", "sdp": pc.localDescription.__dict__})
-
-            elif msg_type == "join_as_viewer":
-                # --- XỬ LÝ VIEWER ---
-                pc = RTCPeerConnection(STUN_SERVER)
-                # *** SỬA LỖI: Lưu cả PC và Websocket ***
-                room.viewer_connections[client_id] = {"pc": pc, "ws": websocket}
-
-                # *** SỬA LỖI: Chỉ gửi offer NẾU track đã có sẵn ***
-                if room.video_track:
-                    logging.info(f"Gửi track (đã có) cho viewer '{client_id}'")
-                    pc.addTrack(room.video_track)
-                    
-                    offer = await pc.createOffer()
-                    await pc.setLocalDescription(offer)
-                    await websocket.send_json({"type": "offer", "sdp": pc.localDescription.__dict__})
-                else:
-                    # Nếu track chưa có, chỉ cần chờ.
-                    logging.info(f"Viewer '{client_id}' đang chờ broadcaster...")
-
-            elif msg_type == "answer":
-                # --- XỬ LÝ ANSWER TỪ VIEWER ---
-                if client_id in room.viewer_connections:
-                    viewer_pc = room.viewer_connections[client_id]["pc"]
-                    await viewer_pc.setRemoteDescription(RTCSessionDescription(**data["sdp"]))
-            
-            elif msg_type == "candidate" and data.get("candidate"):
-                # --- XỬ LÝ ICE CANDIDATE ---
-                pc_to_update = None
-                if is_broadcaster:
-                    pc_to_update = room.broadcaster_pc
-                elif client_id in room.viewer_connections:
-                    pc_to_update = room.viewer_connections[client_id]["pc"]
-                
-                if pc_to_update:
-                    try:
-                        cand_data = data["candidate"]
-                        # Xử lý định dạng candidate linh hoạt hơn
-                        if isinstance(cand_data, dict):
-                            cand = candidate_from_sdp(cand_data['candidate'].split(":", 1)[1])
-                            cand.sdpMid = cand_data['sdpMid']
-                            cand.sdpMLineIndex = cand_data['sdpMLineIndex']
-                            await pc_to_update.addIceCandidate(cand)
-                        elif isinstance(cand_data, str):
-                            cand = candidate_from_sdp(cand_data.split(":", 1)[1])
-                            await pc_to_update.addIceCandidate(cand)
-                    except Exception as e:
-                        logging.warning(f"Lỗi khi thêm ICE candidate: {e} - Data: {data.get('candidate')}")
+            await session.route(data)
 
     except WebSocketDisconnect:
         logging.info(f"Client '{client_id}' ngắt kết nối.")
     finally:
         # Dọn dẹp
-        if room_name in rooms:
-            if is_broadcaster:
-                logging.info(f"Broadcaster phòng '{room_name}' đã rời. Đóng phòng.")
-                await rooms[room_name].close()
-                if room_name in rooms: del rooms[room_name]
-            elif client_id in rooms[room_name].viewer_connections:
-                logging.info(f"Viewer '{client_id}' đã rời.")
-                conn = rooms[room_name].viewer_connections.pop(client_id)
-                await conn["pc"].close()
\ No newline at end of file
+        if local_sessions.get(session.key) is session:
+            del local_sessions[session.key]
+        await session.leave()
+        await backend.remove_member(room_name, client_id)
+
+
+@router.get("/stats")
+def stream_stats():
+    """Thống kê batch suy luận chung và theo từng phòng (FPS, độ trễ, kích thước batch, frame bị bỏ)."""
+    return {
+        "scheduler": stream_scheduler.stats(),
+        # Node này trong cụm: client nối trực tiếp / nối qua node khác vào phòng do node này giữ
+        "node": {**backend.stats(), "local_clients": len(local_sessions), "remote_clients": len(remote_sessions),
+                 "forwarded_clients": sum(1 for s in local_sessions.values() if s.owner is not None)},
+        "rooms": {
+            name: {
+                "viewers": len(room.viewer_connections),
+                **room.hub.stats(),
+                "annotated_video": room.annotated_video,
+                **(room.processor.stats() if room.processor else {"target_fps": room.target_fps}),
+                **(room.annotated_track.stats() if room.annotated_track else {}),
+            }
+            for name, room in rooms.items()
+        },
+    }
+
+
+def _room_metric(value):
+    # Một mẫu mỗi phòng có processor, đọc lúc /metrics được gọi
+    return lambda: [({"room": name}, value(room)) for name, room in list(rooms.items()) if room.processor]
+
+
+metrics.gauge("yolo_stream_processed_fps", "FPS suy luận thực tế của phòng", ("room",)).add_collector(
+    _room_metric(lambda room: room.processor.processed_fps_ema))
+metrics.gauge("yolo_stream_frames_processed_total", "Số frame đã suy luận", ("room",), kind="counter").add_collector(
+    _room_metric(lambda room: room.processor.frames_processed))
+metrics.gauge("yolo_stream_frames_dropped_total", "Số frame bị bỏ (bị frame mới hơn thay thế trước khi suy luận)",
+              ("room",), kind="counter").add_collector(_room_metric(lambda room: room.processor.frames_dropped))
+metrics.gauge("yolo_stream_viewers", "Số viewer đang nối vào phòng", ("room",)).add_collector(
+    lambda: [({"room": name}, len(room.viewer_connections)) for name, room in list(rooms.items())])
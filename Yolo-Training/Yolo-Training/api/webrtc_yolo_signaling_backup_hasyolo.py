@@ -4,15 +4,14 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict, Set, Optional
 import logging
 import asyncio
-from asyncio import get_running_loop
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCConfiguration, RTCIceServer
 from aiortc.sdp import candidate_from_sdp
-from ultralytics import YOLO
+from api.config import STREAM_MODEL
+from api.inference_pool import PRIORITY_STREAM, inference_pool
 
 # --- CẤU HÌNH ---
 router = APIRouter()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-model = YOLO("yolov8n.pt") 
 STUN_SERVER = RTCConfiguration([
     RTCIceServer(urls="stun:stun.l.google.com:19302")
 ])
@@ -26,10 +25,9 @@ class YOLOv8FrameProcessor(MediaStreamTrack):
         self.track = track
         self.room_name = room_name
         self.clients = clients
-        self.yolo_model = model
+        self.yolo_model = STREAM_MODEL
         self.frame_skip = 3
         self._counter = 0
-        self.loop = get_running_loop()
 
     async def recv(self):
         frame = await self.track.recv()
@@ -42,9 +40,8 @@ class YOLOv8FrameProcessor(MediaStreamTrack):
             print(f"--- Xử lý frame {self._counter} ---") # DEBUG
             img_np = frame.to_ndarray(format="bgr24")
             
-            results = await self.loop.run_in_executor(
-                None,
-                lambda: self.yolo_model.predict(source=img_np, conf=0.25, verbose=False, imgsz=320)
+            results = await inference_pool.predict(
+                self.yolo_model, img_np, priority=PRIORITY_STREAM, conf=0.25, imgsz=320
             )
             
             detections = []
@@ -55,7 +52,7 @@ class YOLOv8FrameProcessor(MediaStreamTrack):
                     x1, y1, x2, y2 = map(float, box.xyxy[0])
                     conf = float(box.conf[0])
                     cls_id = int(box.cls[0])
-                    label = self.yolo_model.names[cls_id]
+                    label = r.names[cls_id]
                     detections.append({"label": label, "confidence": conf, "box": [x1, y1, x2, y2]})
             
             print(f"Model phát hiện được: {detections}") # DEBUG
@@ -0,0 +1,177 @@
+# /my_streaming_project/api/wire_format.py
+
+import math
+import struct
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Định dạng nhị phân gọn cho message "yolo_results" (little-endian), thoả thuận
+# riêng với từng viewer; viewer không yêu cầu thì vẫn nhận JSON như cũ.
+#
+# Header (20 byte):
+#   u8 version | u8 kind (1 = yolo_results) | u8 flags | u8 reserved
+#   u32 frame_seq | u16 orig_h | u16 orig_w | f32 latency_ms (NaN = không có)
+#   u16 n_boxes | u16 n_new_labels
+# Bảng nhãn bổ sung (chỉ gửi nhãn viewer chưa biết): n_new_labels x (u16 id, u8 len, utf-8)
+# Các cột, mỗi cột n_boxes phần tử:
+#   u16 label_id | [u32 track_id nếu FLAG_TRACK_IDS] | f32 confidence
+#   [u8 mode nếu FLAG_DELTA: 0 = toạ độ tuyệt đối, 1 = delta so với box cùng track ở frame trước]
+#   f32[4] x1 y1 x2 y2 cho các box tuyệt đối, rồi i16[4] (đơn vị 1/4 pixel) cho các box delta
+
+WIRE_VERSION = 1
+KIND_YOLO_RESULTS = 1
+
+FLAG_INTERPOLATED = 1 << 0
+FLAG_REUSED = 1 << 1
+FLAG_DELTA = 1 << 2
+FLAG_TRACK_IDS = 1 << 3
+
+_HEADER = struct.Struct("<BBBxIHHfHH")
+_LABEL = struct.Struct("<HB")
+_DELTA_SCALE = 4.0  # 1/4 pixel
+
+
+class BinaryResultEncoder:
+    """Bộ mã hoá cho MỘT viewer: nhớ bảng nhãn đã gửi và box của frame trước (cho delta)."""
+
+    def __init__(self, delta: bool = True):
+        self.delta = delta
+        self._label_ids: Dict[str, int] = {}
+        # track_id -> box mà viewer đã giải mã được (đã lượng tử hoá) ở frame trước
+        self._previous: Dict[int, np.ndarray] = {}
+        self.bytes_sent = 0
+        self.messages_sent = 0
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        detections = message.get("detections") or []
+        n = len(detections)
+
+        new_labels = []
+        label_ids = np.empty(n, dtype="<u2")
+        for i, det in enumerate(detections):
+            label = str(det.get("label", ""))
+            if label not in self._label_ids:
+                self._label_ids[label] = len(self._label_ids)
+                new_labels.append((self._label_ids[label], label))
+            label_ids[i] = self._label_ids[label]
+
+        track_ids = np.array([det.get("track_id") or 0 for det in detections], dtype="<u4")
+        has_tracks = bool(track_ids.any())
+        confidences = np.array([det.get("confidence", 0.0) for det in detections], dtype="<f4")
+        boxes = np.array([det["box"] for det in detections], dtype=np.float64).reshape(n, 4)
+
+        flags = 0
+        if message.get("interpolated"):
+            flags |= FLAG_INTERPOLATED
+        if message.get("reused"):
+            flags |= FLAG_REUSED
+        if has_tracks:
+            flags |= FLAG_TRACK_IDS
+
+        # Delta: box có cùng track ở frame trước và độ dịch nằm trong phạm vi int16
+        modes = np.zeros(n, dtype=np.uint8)
+        deltas = np.zeros((n, 4), dtype=np.float64)
+        if self.delta and has_tracks:
+            for i, track_id in enumerate(track_ids):
+                previous = self._previous.get(int(track_id)) if track_id else None
+                if previous is None:
+                    continue
+                q = np.round((boxes[i] - previous) * _DELTA_SCALE)
+                if np.all(np.abs(q) <= 32767):
+                    modes[i], deltas[i] = 1, q
+            if modes.any():
+                flags |= FLAG_DELTA
+
+        orig_shape = message.get("orig_shape") or (0, 0)
+        latency = message.get("latency_ms")
+        parts = [_HEADER.pack(WIRE_VERSION, KIND_YOLO_RESULTS, flags, int(message.get("frame_seq") or 0),
+                              int(orig_shape[0]), int(orig_shape[1]),
+                              float("nan") if latency is None else float(latency), n, len(new_labels))]
+        for label_id, label in new_labels:
+            raw = label.encode("utf-8")[:255]
+            parts.append(_LABEL.pack(label_id, len(raw)) + raw)
+        parts.append(label_ids.tobytes())
+        if has_tracks:
+            parts.append(track_ids.tobytes())
+        parts.append(confidences.tobytes())
+        if flags & FLAG_DELTA:
+            parts.append(modes.tobytes())
+        absolute = boxes[modes == 0].astype("<f4")
+        parts.append(absolute.tobytes())
+        parts.append(deltas[modes == 1].astype("<i2").tobytes())
+
+        # Ghi nhớ đúng giá trị viewer sẽ giải mã ra để delta không bị trôi dần
+        decoded = np.empty((n, 4), dtype=np.float64)
+        decoded[modes == 0] = absolute
+        for i in np.flatnonzero(modes == 1):
+            decoded[i] = self._previous[int(track_ids[i])] + deltas[i] / _DELTA_SCALE
+        self._previous = {int(t): decoded[i] for i, t in enumerate(track_ids) if t}
+
+        data = b"".join(parts)
+        self.bytes_sent += len(data)
+        self.messages_sent += 1
+        return data
+
+
+class BinaryResultDecoder:
+    """Giải mã phía client (bản Python, tương đương decoder trong ui/script.js)."""
+
+    def __init__(self):
+        self.labels: Dict[int, str] = {}
+        self._previous: Dict[int, np.ndarray] = {}
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        version, kind, flags, seq, orig_h, orig_w, latency, n, n_labels = _HEADER.unpack_from(data, 0)
+        if version != WIRE_VERSION or kind != KIND_YOLO_RESULTS:
+            raise ValueError(f"Không hỗ trợ message nhị phân version={version} kind={kind}")
+        offset = _HEADER.size
+        for _ in range(n_labels):
+            label_id, length = _LABEL.unpack_from(data, offset)
+            offset += _LABEL.size
+            self.labels[label_id] = data[offset:offset + length].decode("utf-8")
+            offset += length
+
+        def column(dtype: str, count: int) -> np.ndarray:
+            nonlocal offset
+            values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += values.nbytes
+            return values
+
+        label_ids = column("<u2", n)
+        track_ids = column("<u4", n) if flags & FLAG_TRACK_IDS else np.zeros(n, dtype="<u4")
+        confidences = column("<f4", n)
+        modes = column("u1", n) if flags & FLAG_DELTA else np.zeros(n, dtype=np.uint8)
+        n_delta = int(np.count_nonzero(modes))
+        absolute = column("<f4", (n - n_delta) * 4).reshape(-1, 4)
+        deltas = column("<i2", n_delta * 4).reshape(-1, 4)
+
+        boxes = np.empty((n, 4), dtype=np.float64)
+        boxes[modes == 0] = absolute
+        for j, i in enumerate(np.flatnonzero(modes == 1)):
+            boxes[i] = self._previous[int(track_ids[i])] + deltas[j] / _DELTA_SCALE
+        self._previous = {int(t): boxes[i] for i, t in enumerate(track_ids) if t}
+
+        detections: List[Dict[str, Any]] = []
+        for i in range(n):
+            det = {"label": self.labels.get(int(label_ids[i]), ""), "confidence": float(confidences[i]),
+                   "box": [float(v) for v in boxes[i]]}
+            if track_ids[i]:
+                det["track_id"] = int(track_ids[i])
+            detections.append(det)
+        return {
+            "type": "yolo_results",
+            "detections": detections,
+            "orig_shape": [orig_h, orig_w],
+            "frame_seq": seq,
+            "latency_ms": None if math.isnan(latency) else round(latency, 1),
+            "interpolated": bool(flags & FLAG_INTERPOLATED),
+            "reused": bool(flags & FLAG_REUSED),
+        }
+
+
+def negotiate_encoder(data: Dict[str, Any]) -> Optional[BinaryResultEncoder]:
+    """Viewer gửi {"encoding": "binary", "delta": true|false} -> encoder riêng; mặc định JSON."""
+    if data.get("encoding") == "binary":
+        return BinaryResultEncoder(delta=bool(data.get("delta", True)))
+    return None
@@ -0,0 +1,130 @@
+# /my_streaming_project/bench/corpus.py
+
+import hashlib
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Bộ ảnh cố định cho benchmark: ảnh vườn táo tổng hợp (sinh từ seed cố định nên
+# giống hệt nhau giữa các lần chạy / các máy) + ảnh thật lấy từ split val của
+# dataset.yaml nếu có. Hash của cả bộ ảnh được ghi vào kết quả để chỉ so sánh
+# hai lần chạy trên cùng một corpus.
+
+# (rộng, cao): webcam, HD, full HD, ảnh 12MP từ điện thoại
+SYNTHETIC_SIZES = [(640, 480), (1280, 720), (1920, 1080), (4032, 3024)]
+_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+class CorpusImage:
+    __slots__ = ("name", "data", "content_type")
+
+    def __init__(self, name: str, data: bytes, content_type: str = "image/jpeg"):
+        self.name = name
+        self.data = data
+        self.content_type = content_type
+
+
+def synthetic_orchard(width: int, height: int, seed: int) -> np.ndarray:
+    """Ảnh BGR giả lập tán cây: nền lá xanh nhiều sắc độ, cành, quả táo đỏ / vàng có bóng sáng."""
+    rng = np.random.default_rng(seed)
+    sky = np.linspace(235, 160, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = np.clip(sky + 10, 0, 255).astype(np.uint8)
+    image[..., 1] = np.clip(sky - 10, 0, 255).astype(np.uint8)
+    image[..., 2] = np.clip(sky - 60, 0, 255).astype(np.uint8)
+
+    unit = max(width, height) / 640.0
+    for _ in range(int(900 * unit)):
+        # Lá: elip xanh nhiều sắc độ, hướng ngẫu nhiên
+        center = (int(rng.integers(0, width)), int(rng.integers(int(height * 0.1), height)))
+        axes = (int(rng.integers(6, 18) * unit), int(rng.integers(3, 8) * unit))
+        color = (int(rng.integers(10, 60)), int(rng.integers(90, 190)), int(rng.integers(10, 70)))
+        cv2.ellipse(image, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+    for _ in range(int(12 * unit)):
+        # Cành: đường nâu
+        p1 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        p2 = (p1[0] + int(rng.integers(-120, 120) * unit), p1[1] + int(rng.integers(-80, 80) * unit))
+        cv2.line(image, p1, p2, (30, 55, 85), max(1, int(3 * unit)))
+    for _ in range(int(rng.integers(8, 30))):
+        # Quả táo: hình tròn đỏ / vàng + điểm sáng
+        radius = int(rng.integers(12, 30) * unit)
+        center = (int(rng.integers(radius, width - radius)), int(rng.integers(radius, height - radius)))
+        red = rng.random() < 0.75
+        color = (20, 30, int(rng.integers(170, 230))) if red else (30, int(rng.integers(170, 210)), 220)
+        cv2.circle(image, center, radius, color, -1)
+        cv2.circle(image, (center[0] - radius // 3, center[1] - radius // 3), max(1, radius // 4),
+                   (200, 210, 255), -1)
+    noise = rng.normal(0, 6, image.shape).astype(np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_images(per_size: int = 2, quality: int = 90) -> List[CorpusImage]:
+    images = []
+    for width, height in SYNTHETIC_SIZES:
+        for i in range(per_size):
+            ok, buffer = cv2.imencode(".jpg", synthetic_orchard(width, height, seed=width * 1000 + i),
+                                      [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                raise RuntimeError("Không mã hoá được ảnh tổng hợp")
+            images.append(CorpusImage(f"synthetic_{width}x{height}_{i}.jpg", buffer.tobytes()))
+    return images
+
+
+def default_real_dir() -> Optional[Path]:
+    """Split val trong dataset.yaml (nếu có trên máy)."""
+    try:
+        from api.backends import dataset_split_dir
+        path = dataset_split_dir()
+    except Exception:
+        return None
+    return path if path.is_dir() else None
+
+
+def real_images(directory: Optional[str], limit: int) -> List[CorpusImage]:
+    if not directory or not os.path.isdir(directory) or limit <= 0:
+        return []
+    # Sắp xếp theo tên -> cùng thư mục luôn cho cùng tập ảnh
+    paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in _IMAGE_EXTENSIONS)[:limit]
+    images = []
+    for path in paths:
+        content_type = "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
+        images.append(CorpusImage(f"real_{path.name}", path.read_bytes(), content_type))
+    return images
+
+
+def build_corpus(real_dir: Optional[str] = None, real_limit: int = 16,
+                 synthetic_per_size: int = 2) -> Tuple[List[CorpusImage], dict]:
+    """Trả về (danh sách ảnh, mô tả corpus gồm số ảnh và sha256 của cả bộ)."""
+    if real_dir is None:
+        found = default_real_dir()
+        real_dir = str(found) if found else None
+    real = real_images(real_dir, real_limit)
+    images = synthetic_images(synthetic_per_size) + real
+    digest = hashlib.sha256()
+    for image in images:
+        digest.update(image.name.encode())
+        digest.update(hashlib.sha256(image.data).digest())
+    info = {
+        "images": len(images),
+        "synthetic": len(images) - len(real),
+        "real": len(real),
+        "real_dir": real_dir if real else None,
+        "total_mb": round(sum(len(i.data) for i in images) / 1e6, 2),
+        "sha256": digest.hexdigest(),
+    }
+    return images, info
+
+
+if __name__ == "__main__":
+    # Ghi corpus ra thư mục để xem: python -m bench.corpus runs/bench_corpus
+    import sys
+
+    out = Path(sys.argv[1] if len(sys.argv) > 1 else "runs/bench_corpus")
+    out.mkdir(parents=True, exist_ok=True)
+    corpus, corpus_info = build_corpus()
+    for item in corpus:
+        (out / item.name).write_bytes(item.data)
+    print(corpus_info)
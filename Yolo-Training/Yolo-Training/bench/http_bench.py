@@ -0,0 +1,473 @@
+# /my_streaming_project/bench/http_bench.py
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bench.corpus import CorpusImage, build_corpus
+
+# --- Benchmark tải HTTP cho các API suy luận ---
+# Tự khởi động server (uvicorn) cho từng app, bắn request đồng thời vào từng endpoint
+# với các mức concurrency, đo throughput, độ trễ p50/p95/p99, CPU và RSS đỉnh của
+# server (cả process con: worker suy luận), rồi ghi kết quả JSON.
+#   python -m bench.http_bench run --concurrency 1,4,16 --duration 20
+#   python -m bench.http_bench compare runs/bench/truoc.json runs/bench/sau.json
+# Chỉ dùng thư viện chuẩn (+ numpy/cv2 để sinh ảnh); CPU / RSS đọc từ /proc (Linux).
+
+ROOT = Path(__file__).resolve().parent.parent
+# "app@endpoint": /predict/image nằm trong mainV5, /detect/ nằm trong main.py
+DEFAULT_TARGETS = ["mainV5:app@/predict/image", "main:app@/detect/"]
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# ==========================
+# Đo CPU / bộ nhớ của server
+# ==========================
+def _read_stat(pid: int) -> Optional[Tuple[int, int, int]]:
+    """(ppid, số tick CPU user+system, RSS bytes) của một process."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            text = f.read()
+    except OSError:
+        return None
+    fields = text[text.rfind(")") + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]) * _PAGE_SIZE
+
+
+def _process_tree(root: int) -> Dict[int, Tuple[int, int]]:
+    """{pid: (tick CPU, RSS)} của process gốc và mọi process con cháu."""
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            stat = _read_stat(int(entry))
+            if stat is not None:
+                stats[int(entry)] = stat
+    tree, frontier = {}, [root]
+    while frontier:
+        pid = frontier.pop()
+        if pid in stats and pid not in tree:
+            tree[pid] = stats[pid][1:]
+            frontier.extend(child for child, (ppid, _, _) in stats.items() if ppid == pid)
+    return tree
+
+
+class ResourceMonitor:
+    """Lấy mẫu RSS của cả cây process mỗi `interval` giây; CPU tính theo chênh lệch tick."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.available = pid is not None and os.path.isdir("/proc")
+        self._peak_rss = 0
+        self._cpu_ticks: Dict[int, int] = {}
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> Dict[int, Tuple[int, int]]:
+        tree = _process_tree(self.pid)
+        self._peak_rss = max(self._peak_rss, sum(rss for _, rss in tree.values()))
+        return tree
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            tree = self._sample()
+            # Giữ tick mới nhất của từng process (process con có thể thoát giữa chừng)
+            self._cpu_ticks.update({pid: ticks for pid, (ticks, _) in tree.items()})
+
+    def begin(self):
+        if not self.available:
+            return
+        self._peak_rss = 0
+        self._baseline = {pid: ticks for pid, (ticks, _) in self._sample().items()}
+        self._cpu_ticks = dict(self._baseline)
+        self._started = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def end(self) -> Dict[str, Optional[float]]:
+        if not self.available:
+            return {"cpu_percent": None, "peak_rss_mb": None}
+        self._stop.set()
+        self._thread.join()
+        self._cpu_ticks.update({pid: ticks for pid, (ticks, _) in self._sample().items()})
+        elapsed = time.perf_counter() - self._started
+        ticks = sum(t - self._baseline.get(pid, 0) for pid, t in self._cpu_ticks.items())
+        return {
+            # 100% = một core; server nhiều worker có thể vượt 100%
+            "cpu_percent": round(ticks / _CLK_TCK / max(elapsed, 1e-9) * 100.0, 1),
+            "cpu_seconds": round(ticks / _CLK_TCK, 3),
+            "peak_rss_mb": round(self._peak_rss / 1e6, 1),
+        }
+
+
+# ==========================
+# Server
+# ==========================
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    def __init__(self, app: str, port: int, env: Dict[str, str], startup_timeout: float):
+        self.app = app
+        self.port = port
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        cmd = [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1", "--port", str(self.port),
+               "--log-level", "warning"]
+        self.process = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **self.env})
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server {self.app} dừng khi khởi động (mã {self.process.returncode})")
+            status = _get_status(self.url, "/api/ready")
+            # 200: warmup xong; 404: app không có /api/ready -> warmup bằng request chạy thử
+            if status in (200, 404):
+                return
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"Server {self.app} không sẵn sàng sau {self.startup_timeout:g}s")
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _get_status(base_url: str, path: str) -> Optional[int]:
+    parts = urlsplit(base_url)
+    try:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return response.status
+    except OSError:
+        return None
+
+
+# ==========================
+# Tạo tải
+# ==========================
+def _multipart(image: CorpusImage) -> Tuple[str, bytes]:
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{image.name}\"\r\n"
+        f"Content-Type: {image.content_type}\r\n\r\n".encode(),
+        image.data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return f"multipart/form-data; boundary={boundary}", body
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nội suy tuyến tính giữa hai điểm gần nhất."""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def run_load(base_url: str, endpoint: str, bodies: List[Tuple[str, bytes]], concurrency: int,
+             duration_s: float, max_requests: int = 0, timeout_s: float = 60.0) -> Dict:
+    """`concurrency` client keep-alive gửi liên tục (ảnh xoay vòng trong corpus) tới khi hết giờ / đủ request."""
+    parts = urlsplit(base_url)
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    started = time.perf_counter()
+    deadline = started + duration_s if duration_s > 0 else float("inf")
+
+    def client():
+        conn = None
+        local_latencies, local_statuses = [], Counter()
+        while True:
+            index = next(counter)
+            if (max_requests and index >= max_requests) or time.perf_counter() >= deadline:
+                break
+            content_type, body = bodies[index % len(bodies)]
+            sent_at = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout_s)
+                conn.request("POST", endpoint, body, {"Content-Type": content_type})
+                response = conn.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException):
+                status = "error"
+                if conn is not None:
+                    conn.close()
+                conn = None
+            latency_ms = (time.perf_counter() - sent_at) * 1000.0
+            local_statuses[status] += 1
+            if status.startswith("2"):
+                local_latencies.append(latency_ms)
+        if conn is not None:
+            conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = sum(statuses.values())
+    ok = len(latencies)
+    return {
+        "requests": total,
+        "ok": ok,
+        "error_rate": round((total - ok) / total, 4) if total else 0.0,
+        "status_codes": dict(statuses),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / ok, 2) if ok else 0.0,
+            "max": round(latencies[-1], 2) if ok else 0.0,
+        },
+    }
+
+
+def _parse_targets(targets: List[str]) -> Dict[str, List[str]]:
+    """["app@endpoint", ...] -> {app: [endpoint, ...]} (giữ thứ tự)."""
+    grouped: Dict[str, List[str]] = {}
+    for target in targets:
+        app, sep, endpoint = target.partition("@")
+        if not sep or not endpoint.startswith("/"):
+            raise SystemExit(f"Target không hợp lệ: '{target}' (dạng module:app@/endpoint)")
+        grouped.setdefault(app, []).append(endpoint)
+    return grouped
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args) -> Dict:
+    images, corpus_info = build_corpus(args.real_dir, args.real_limit, args.synthetic_per_size)
+    bodies = [_multipart(image) for image in images]
+    concurrencies = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    env = dict(item.split("=", 1) for item in args.env)
+    print(f"📦 Corpus: {corpus_info['synthetic']} ảnh tổng hợp + {corpus_info['real']} ảnh thật "
+          f"({corpus_info['total_mb']} MB)")
+
+    results = []
+    for app, endpoints in _parse_targets(args.target).items():
+        server = None
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.server_pid
+        else:
+            server = ServerProcess(app, _free_port(), env, args.startup_timeout)
+            print(f"🚀 Khởi động {app} ({server.url})...")
+            server.start()
+            base_url, pid = server.url, server.process.pid
+        monitor = ResourceMonitor(pid)
+        try:
+            for endpoint in endpoints:
+                # Request chạy thử: load model / cold-start không tính vào kết quả
+                run_load(base_url, endpoint, bodies, 1, 0, max_requests=args.warmup_requests)
+                for concurrency in concurrencies:
+                    monitor.begin()
+                    load = run_load(base_url, endpoint, bodies, concurrency, args.duration,
+                                    max_requests=args.requests, timeout_s=args.timeout)
+                    usage = monitor.end()
+                    cpu_seconds = usage.pop("cpu_seconds", None)
+                    usage["cpu_ms_per_request"] = (round(cpu_seconds * 1000.0 / load["ok"], 2)
+                                                   if cpu_seconds is not None and load["ok"] else None)
+                    result = {"app": app, "endpoint": endpoint, "concurrency": concurrency, **load,
+                              "server": usage}
+                    results.append(result)
+                    lat = load["latency_ms"]
+                    print(f"   {endpoint:<16} c={concurrency:<3} {load['throughput_rps']:>8.2f} req/s  "
+                          f"p50 {lat['p50']:>8.1f}  p95 {lat['p95']:>8.1f}  p99 {lat['p99']:>8.1f} ms  "
+                          f"lỗi {load['error_rate']:.1%}  CPU {usage['cpu_percent']}%  "
+                          f"RSS {usage['peak_rss_mb']} MB")
+        finally:
+            if server is not None:
+                server.stop()
+
+    return {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "env": env,
+            "duration_s": args.duration,
+            "requests": args.requests,
+            "warmup_requests": args.warmup_requests,
+            "corpus": corpus_info,
+        },
+        "results": results,
+    }
+
+
+# ==========================
+# So sánh hai lần chạy
+# ==========================
+# (đường dẫn metric, True nếu lớn hơn là tốt hơn)
+COMPARED_METRICS = [
+    (("throughput_rps",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("server", "cpu_ms_per_request"), False),
+    (("server", "peak_rss_mb"), False),
+]
+
+
+def _metric(result: Dict, path: Tuple[str, ...]) -> Optional[float]:
+    value = result
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_runs(base: Dict, new: Dict, threshold_pct: float, min_abs_ms: float) -> Dict:
+    """Đánh dấu hồi quy khi metric tệ đi quá `threshold_pct` % (độ trễ: và quá `min_abs_ms` ms)."""
+    key = lambda r: (r["app"], r["endpoint"], r["concurrency"])
+    base_results = {key(r): r for r in base["results"]}
+    rows, regressions = [], 0
+    for result in new["results"]:
+        before = base_results.get(key(result))
+        if before is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            old, cur = _metric(before, path), _metric(result, path)
+            if old is None or cur is None:
+                continue
+            change_pct = (cur - old) / old * 100.0 if old else 0.0
+            worse = -change_pct if higher_is_better else change_pct
+            regression = worse > threshold_pct
+            if regression and path[0] == "latency_ms" and abs(cur - old) < min_abs_ms:
+                regression = False  # chênh vài phần mười ms là nhiễu
+            regressions += regression
+            rows.append({"app": result["app"], "endpoint": result["endpoint"],
+                         "concurrency": result["concurrency"], "metric": ".".join(path),
+                         "base": old, "new": cur, "change_pct": round(change_pct, 1),
+                         "regression": regression})
+        # Tỉ lệ lỗi so theo điểm phần trăm tuyệt đối
+        error_delta = (result["error_rate"] - before["error_rate"]) * 100.0
+        if error_delta > 1.0:
+            regressions += 1
+            rows.append({"app": result["app"], "endpoint": result["endpoint"],
+                         "concurrency": result["concurrency"], "metric": "error_rate",
+                         "base": before["error_rate"], "new": result["error_rate"],
+                         "change_pct": round(error_delta, 1), "regression": True})
+    same_corpus = base["meta"]["corpus"]["sha256"] == new["meta"]["corpus"]["sha256"]
+    return {"threshold_pct": threshold_pct, "same_corpus": same_corpus, "regressions": regressions,
+            "base_commit": base["meta"].get("git_commit"), "new_commit": new["meta"].get("git_commit"),
+            "rows": rows}
+
+
+def print_comparison(report: Dict):
+    if not report["same_corpus"]:
+        print("⚠️  Hai lần chạy dùng corpus khác nhau, so sánh có thể không công bằng.")
+    print(f"So sánh {report['base_commit']} -> {report['new_commit']} (ngưỡng {report['threshold_pct']:g}%)")
+    print("| Endpoint | c | Metric | Trước | Sau | Thay đổi | |")
+    print("|----------|---|--------|-------|-----|----------|-|")
+    for row in report["rows"]:
+        flag = "❌ HỒI QUY" if row["regression"] else ""
+        print(f"| {row['endpoint']} | {row['concurrency']} | {row['metric']} | {row['base']} | {row['new']} | "
+              f"{row['change_pct']:+.1f}% | {flag} |")
+    print()
+    print(f"{'❌' if report['regressions'] else '✅'} {report['regressions']} hồi quy")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tải HTTP cho /predict/image và /detect/")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Chạy benchmark và ghi kết quả JSON")
+    run.add_argument("--target", action="append", default=None,
+                     help="module:app@/endpoint, lặp lại được (mặc định: " + ", ".join(DEFAULT_TARGETS) + ")")
+    run.add_argument("--concurrency", default="1,4,16", help="Danh sách mức đồng thời, vd. 1,4,16")
+    run.add_argument("--duration", type=float, default=20.0, help="Số giây mỗi mức (0 = chỉ dừng theo --requests)")
+    run.add_argument("--requests", type=int, default=0, help="Số request tối đa mỗi mức (0 = không giới hạn)")
+    run.add_argument("--warmup-requests", type=int, default=5)
+    run.add_argument("--timeout", type=float, default=60.0, help="Timeout mỗi request (giây)")
+    run.add_argument("--real-dir", default=None, help="Thư mục ảnh thật (mặc định: split val của dataset.yaml)")
+    run.add_argument("--real-limit", type=int, default=16)
+    run.add_argument("--synthetic-per-size", type=int, default=2)
+    run.add_argument("--env", action="append", default=[], help="KEY=VALUE truyền cho server, lặp lại được")
+    run.add_argument("--url", default=None, help="Dùng server đang chạy thay vì tự khởi động")
+    run.add_argument("--server-pid", type=int, default=None, help="PID của server ở --url (để đo CPU / RSS)")
+    run.add_argument("--startup-timeout", type=float, default=300.0)
+    run.add_argument("--out", default=None, help="File JSON kết quả (mặc định runs/bench/<thời gian>.json)")
+
+    compare = sub.add_parser("compare", help="So sánh hai file kết quả, mã thoát 1 nếu có hồi quy")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold-pct", type=float, default=10.0)
+    compare.add_argument("--min-abs-ms", type=float, default=1.0)
+    compare.add_argument("--out", default=None, help="Ghi báo cáo so sánh ra file JSON")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        args.target = args.target or DEFAULT_TARGETS
+        report = run_benchmark(args)
+        out = Path(args.out or ROOT / "runs" / "bench" / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"📝 Kết quả: {out}")
+    else:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        report = compare_runs(base, new, args.threshold_pct, args.min_abs_ms)
+        print_comparison(report)
+        if args.out:
+            Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+# /my_streaming_project/bench/webrtc_replay.py
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+import uuid
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import av
+import numpy as np
+import websockets
+from aiortc import MediaStreamTrack, RTCConfiguration, RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import MediaStreamError
+
+from bench.http_bench import ROOT, ResourceMonitor, ServerProcess, _free_port, _git_commit, percentile
+
+# --- Ghi lại và phát lại luồng WebRTC để benchmark đường stream trực tiếp ---
+# record: ghi frame của broadcaster trong một phòng (vào phòng như một viewer) hoặc từ
+#   file video / webcam thành file MKV (H.264, giữ nguyên thời điểm từng frame).
+# replay: mỗi phòng một broadcaster aiortc không giao diện phát lại file đó (đúng nhịp
+#   gốc hoặc nhanh nhất có thể) + N viewer giả lập; đo độ trễ phát hiện đầu-cuối, FPS
+#   suy luận và tỉ lệ frame bị bỏ theo từng phòng. Không cần trình duyệt hay mạng.
+#   python -m bench.webrtc_replay record --source drone.mp4 --seconds 20 --out runs/recordings/drone.mkv
+#   python -m bench.webrtc_replay replay runs/recordings/drone.mkv --rooms 10 --viewers 1 --duration 30
+
+_TIME_BASE = Fraction(1, 1000)      # pts trong file ghi: mili giây
+_RTP_TIME_BASE = Fraction(1, 90000)  # clock video của RTP
+_NO_ICE_SERVERS = RTCConfiguration(iceServers=[])  # cùng máy: không cần STUN
+
+
+# ==========================
+# Định dạng file ghi
+# ==========================
+class RecordingWriter:
+    """Ghi frame (kèm thời điểm, giây) vào MKV H.264; codec không có thì dùng mpeg4."""
+
+    def __init__(self, path: str, width: int, height: int, codec: str = "libx264"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.container = av.open(path, mode="w", format="matroska")
+        try:
+            self.stream = self.container.add_stream(codec, rate=30)
+        except ValueError:
+            self.stream = self.container.add_stream("mpeg4", rate=30)
+        self.stream.width, self.stream.height = width - width % 2, height - height % 2
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.time_base = _TIME_BASE
+        self.stream.codec_context.time_base = _TIME_BASE
+        self.frames = 0
+        self._last_pts = -1
+
+    def write(self, frame: av.VideoFrame, at_s: float):
+        frame = frame.reformat(width=self.stream.width, height=self.stream.height, format="yuv420p")
+        # pts phải tăng dần: hai frame cùng mili giây thì lùi frame sau 1 ms
+        pts = max(int(round(at_s * 1000)), self._last_pts + 1)
+        frame.pts, frame.time_base = pts, _TIME_BASE
+        self._last_pts = pts
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+        self.frames += 1
+
+    def close(self):
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+
+
+class Recording:
+    """File ghi được giải mã MỘT lần vào bộ nhớ (yuv420p), dùng chung cho mọi phòng phát lại."""
+
+    def __init__(self, path: str, max_frames: int = 0):
+        self.path = path
+        self.frames: List[np.ndarray] = []
+        self.times: List[float] = []
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            for frame in container.decode(stream):
+                self.width, self.height = frame.width, frame.height
+                self.frames.append(frame.to_ndarray(format="yuv420p"))
+                self.times.append(float(frame.time or 0.0))
+                if max_frames and len(self.frames) >= max_frames:
+                    break
+        if not self.frames:
+            raise ValueError(f"File ghi không có frame nào: {path}")
+        start = self.times[0]
+        self.times = [t - start for t in self.times]
+        # Khoảng cách frame cuối -> frame đầu khi phát lặp lại
+        step = self.times[-1] / (len(self.times) - 1) if len(self.times) > 1 else 1 / 30
+        self.duration = self.times[-1] + step
+
+    @property
+    def fps(self) -> float:
+        return len(self.frames) / self.duration
+
+    def info(self) -> Dict:
+        return {"path": self.path, "frames": len(self.frames), "width": self.width, "height": self.height,
+                "duration_s": round(self.duration, 3), "fps": round(self.fps, 2)}
+
+
+def record_source(source: str, out: str, seconds: float, input_format: Optional[str] = None) -> Dict:
+    """Ghi từ file video hoặc thiết bị (vd. --source /dev/video0 --format v4l2), giữ thời điểm gốc."""
+    writer = None
+    with av.open(source, format=input_format) as container:
+        stream = container.streams.video[0]
+        first = None
+        for frame in container.decode(stream):
+            at = float(frame.time) if frame.time is not None else time.perf_counter()
+            first = at if first is None else first
+            if seconds and at - first > seconds:
+                break
+            if writer is None:
+                writer = RecordingWriter(out, frame.width, frame.height)
+            writer.write(frame, at - first)
+    if writer is None:
+        raise ValueError(f"Không đọc được frame nào từ {source}")
+    writer.close()
+    return {"out": out, "frames": writer.frames}
+
+
+# ==========================
+# Signaling (WebSocket của api/webrtc_yolo_signaling.py)
+# ==========================
+def _ws_url(base_url: str, prefix: str, room: str, client_id: str) -> str:
+    return base_url.replace("http", "ws", 1).rstrip("/") + f"{prefix}/ws/{room}/{client_id}"
+
+
+async def _answer_offer(pc: RTCPeerConnection, ws, message: Dict):
+    await pc.setRemoteDescription(RTCSessionDescription(**message["sdp"]))
+    await pc.setLocalDescription(await pc.createAnswer())
+    await ws.send(json.dumps({"type": "answer", "sdp": {"sdp": pc.localDescription.sdp,
+                                                        "type": pc.localDescription.type}}))
+
+
+async def record_room(base_url: str, prefix: str, room: str, out: str, seconds: float) -> Dict:
+    """Vào phòng như một viewer và ghi lại frame broadcaster gửi lên (đã qua relay của server)."""
+    pc = RTCPeerConnection(_NO_ICE_SERVERS)
+    done = asyncio.get_running_loop().create_future()
+    writer: Optional[RecordingWriter] = None
+
+    @pc.on("track")
+    def on_track(track):
+        async def consume():
+            nonlocal writer
+            started = None
+            try:
+                while True:
+                    frame = await track.recv()
+                    now = time.perf_counter()
+                    started = now if started is None else started
+                    if now - started > seconds:
+                        break
+                    if writer is None:
+                        writer = RecordingWriter(out, frame.width, frame.height)
+                    writer.write(frame, now - started)
+            except MediaStreamError:
+                pass
+            if not done.done():
+                done.set_result(None)
+        asyncio.ensure_future(consume())
+
+    async with websockets.connect(_ws_url(base_url, prefix, room, f"recorder-{uuid.uuid4().hex[:8]}")) as ws:
+        await ws.send(json.dumps({"type": "join_as_viewer"}))
+        reader = asyncio.ensure_future(_viewer_signaling(pc, ws, None))
+        await done
+        reader.cancel()
+    await pc.close()
+    if writer is None:
+        raise RuntimeError(f"Phòng '{room}' không có frame nào trong {seconds:g}s")
+    writer.close()
+    return {"out": out, "frames": writer.frames}
+
+
+# ==========================
+# Phát lại
+# ==========================
+class ReplayTrack(MediaStreamTrack):
+    """Track video phát lại Recording (lặp vòng); ghi lại thời điểm gửi của từng frame."""
+
+    kind = "video"
+
+    def __init__(self, recording: Recording, realtime: bool):
+        super().__init__()
+        self.recording = recording
+        self.realtime = realtime
+        self.sent_at: List[float] = []
+        self._start: Optional[float] = None
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        index = len(self.sent_at)
+        count = len(self.recording.frames)
+        if self._start is None:
+            self._start = time.perf_counter()
+        if self.realtime:
+            due = self._start + (index // count) * self.recording.duration + self.recording.times[index % count]
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+        frame = av.VideoFrame.from_ndarray(self.recording.frames[index % count], format="yuv420p")
+        now = time.perf_counter()
+        frame.pts, frame.time_base = int((now - self._start) * 90000), _RTP_TIME_BASE
+        self.sent_at.append(now)
+        return frame
+
+
+class ViewerStats:
+    def __init__(self):
+        self.results = 0
+        self.interpolated = 0
+        self.frames = 0
+        self.e2e_ms: List[float] = []
+        self.server_ms: List[float] = []
+
+
+async def _viewer_signaling(pc: RTCPeerConnection, ws, stats: Optional[ViewerStats],
+                            sent_at: Optional[List[float]] = None):
+    async for raw in ws:
+        if isinstance(raw, bytes):
+            continue
+        message = json.loads(raw)
+        if message.get("type") == "offer":
+            await _answer_offer(pc, ws, message)
+        elif message.get("type") == "yolo_results" and stats is not None:
+            arrived = time.perf_counter()
+            if message.get("interpolated"):
+                stats.interpolated += 1
+                continue
+            stats.results += 1
+            if message.get("latency_ms") is not None:
+                stats.server_ms.append(message["latency_ms"])
+            # frame_seq đếm frame processor nhận được (bắt đầu từ 1) ~ frame thứ seq-1 replayer đã gửi;
+            # frame mất trước processor làm lệch ánh xạ -> xem "network_loss" trong kết quả
+            seq = message.get("frame_seq")
+            if sent_at is not None and seq and seq <= len(sent_at):
+                stats.e2e_ms.append((arrived - sent_at[seq - 1]) * 1000.0)
+
+
+class ReplayRoom:
+    def __init__(self, name: str, recording: Recording, viewers: int, realtime: bool, target_fps: Optional[float],
+                 base_url: str, prefix: str):
+        self.name = name
+        self.track = ReplayTrack(recording, realtime)
+        self.viewer_count = viewers
+        self.target_fps = target_fps
+        self.base_url = base_url
+        self.prefix = prefix
+        self.viewer_stats = [ViewerStats() for _ in range(viewers)]
+        self._pcs: List[RTCPeerConnection] = []
+        self._sockets = []
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        # Viewer vào trước: nhận offer ngay khi track của broadcaster tới server
+        for i, stats in enumerate(self.viewer_stats):
+            await self._start_viewer(f"viewer-{i}", stats)
+        await self._start_broadcaster()
+
+    async def _start_broadcaster(self):
+        pc = RTCPeerConnection(_NO_ICE_SERVERS)
+        self._pcs.append(pc)
+        pc.addTrack(self.track)
+        await pc.setLocalDescription(await pc.createOffer())
+        ws = await websockets.connect(_ws_url(self.base_url, self.prefix, self.name, "broadcaster"))
+        self._sockets.append(ws)
+        offer = {"type": "offer", "sdp": {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}}
+        if self.target_fps:
+            offer["target_fps"] = self.target_fps
+        await ws.send(json.dumps(offer))
+        while True:
+            message = json.loads(await ws.recv())
+            if message.get("type") == "answer":
+                await pc.setRemoteDescription(RTCSessionDescription(**message["sdp"]))
+                return
+
+    async def _start_viewer(self, client_id: str, stats: ViewerStats):
+        pc = RTCPeerConnection(_NO_ICE_SERVERS)
+        self._pcs.append(pc)
+
+        @pc.on("track")
+        def on_track(track):
+            async def consume():
+                try:
+                    while True:
+                        await track.recv()
+                        stats.frames += 1
+                except MediaStreamError:
+                    pass
+            self._tasks.append(asyncio.ensure_future(consume()))
+
+        ws = await websockets.connect(_ws_url(self.base_url, self.prefix, self.name, client_id))
+        self._sockets.append(ws)
+        await ws.send(json.dumps({"type": "join_as_viewer", "encoding": "json"}))
+        self._tasks.append(asyncio.ensure_future(_viewer_signaling(pc, ws, stats, self.track.sent_at)))
+
+    async def stop(self):
+        self.track.stop()
+        for task in self._tasks:
+            task.cancel()
+        for ws in self._sockets:
+            await ws.close()
+        for pc in self._pcs:
+            await pc.close()
+
+    def report(self, elapsed: float, server_room: Optional[Dict]) -> Dict:
+        e2e = sorted(ms for s in self.viewer_stats for ms in s.e2e_ms)
+        server_ms = sorted(ms for s in self.viewer_stats for ms in s.server_ms)
+        sent = len(self.track.sent_at)
+        report = {
+            "frames_sent": sent,
+            "sent_fps": round(sent / elapsed, 2),
+            "results_received": sum(s.results for s in self.viewer_stats),
+            "viewer_video_fps": round(sum(s.frames for s in self.viewer_stats)
+                                      / max(len(self.viewer_stats), 1) / elapsed, 2),
+            "e2e_latency_ms": _summary(e2e),
+            "server_latency_ms": _summary(server_ms),
+        }
+        if server_room:
+            received = server_room.get("frames_received", 0)
+            processed = server_room.get("frames_processed", 0)
+            report.update({
+                "processed_fps": round(processed / elapsed, 2),
+                # Frame gửi đi nhưng không tới processor (mã hoá / mạng / relay bỏ)
+                "network_loss": round(1 - received / sent, 4) if sent else 0.0,
+                # Frame tới processor nhưng không được suy luận (latest-frame-wins)
+                "drop_rate": round(server_room.get("frames_dropped", 0) / received, 4) if received else 0.0,
+                "motion_skipped": server_room.get("frames_motion_skipped", 0),
+                "server": {k: server_room.get(k) for k in ("processed_fps", "inference_ms", "avg_batch_size",
+                                                           "frames_rejected", "lagging_viewers")},
+            })
+        return report
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {"count": len(values), "p50": round(percentile(values, 50), 1), "p95": round(percentile(values, 95), 1),
+            "p99": round(percentile(values, 99), 1)}
+
+
+def _fetch_json(url: str) -> Optional[Dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.loads(response.read())
+    except OSError as e:
+        logging.warning(f"Không đọc được {url}: {e}")
+        return None
+
+
+async def replay(args) -> Dict:
+    recording = Recording(args.recording, args.max_frames)
+    print(f"🎞️  {recording.info()}")
+    server = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.server_pid
+    else:
+        server = ServerProcess(args.app, _free_port(), dict(item.split("=", 1) for item in args.env),
+                               args.startup_timeout)
+        print(f"🚀 Khởi động {args.app} ({server.url})...")
+        await asyncio.get_running_loop().run_in_executor(None, server.start)
+        base_url, pid = server.url, server.process.pid
+
+    run_id = uuid.uuid4().hex[:6]
+    rooms = [ReplayRoom(f"replay-{run_id}-{i}", recording, args.viewers, args.speed == "realtime",
+                        args.target_fps, base_url, args.prefix) for i in range(args.rooms)]
+    monitor = ResourceMonitor(pid)
+    try:
+        for room in rooms:
+            await room.start()
+        monitor.begin()
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - started
+        usage = monitor.end()
+        usage.pop("cpu_seconds", None)
+        # Đọc thống kê phòng trước khi đóng kết nối (phòng bị xoá khi broadcaster rời)
+        stats = await asyncio.get_running_loop().run_in_executor(None, _fetch_json,
+                                                                 f"{base_url}{args.prefix}/stats")
+    finally:
+        for room in rooms:
+            await room.stop()
+        if server is not None:
+            server.stop()
+
+    server_rooms = (stats or {}).get("rooms", {})
+    per_room = {room.name: room.report(elapsed, server_rooms.get(room.name)) for room in rooms}
+    all_e2e = sorted(ms for room in rooms for s in room.viewer_stats for ms in s.e2e_ms)
+    reports = list(per_room.values())
+    return {
+        "meta": {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": _git_commit(),
+                 "cpu_count": os.cpu_count(), "recording": recording.info(), "rooms": args.rooms,
+                 "viewers_per_room": args.viewers, "speed": args.speed, "target_fps": args.target_fps,
+                 "duration_s": round(elapsed, 3)},
+        "summary": {
+            "e2e_latency_ms": _summary(all_e2e),
+            "processed_fps_total": round(sum(r.get("processed_fps", 0) for r in reports), 2),
+            "processed_fps_per_room": round(sum(r.get("processed_fps", 0) for r in reports) / len(reports), 2),
+            "drop_rate_mean": round(sum(r.get("drop_rate", 0) for r in reports) / len(reports), 4),
+            "network_loss_mean": round(sum(r.get("network_loss", 0) for r in reports) / len(reports), 4),
+            "server": usage,
+            "scheduler": (stats or {}).get("scheduler"),
+        },
+        "rooms": per_room,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ghi lại / phát lại luồng WebRTC để benchmark đường stream")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="Ghi frame thành file MKV (từ phòng đang phát hoặc file / webcam)")
+    record.add_argument("--out", required=True)
+    record.add_argument("--seconds", type=float, default=30.0)
+    record.add_argument("--source", default=None, help="File video hoặc thiết bị; bỏ trống để ghi từ --room")
+    record.add_argument("--format", default=None, help="Định dạng input của --source (vd. v4l2)")
+    record.add_argument("--room", default=None, help="Phòng cần ghi (vào phòng như một viewer)")
+    record.add_argument("--url", default="http://127.0.0.1:8000")
+    record.add_argument("--prefix", default="/stream", help="Tiền tố router signaling (mainV5: /stream)")
+
+    rep = sub.add_parser("replay", help="Phát lại file ghi vào nhiều phòng, đo độ trễ / FPS / frame bỏ")
+    rep.add_argument("recording")
+    rep.add_argument("--rooms", type=int, default=1)
+    rep.add_argument("--viewers", type=int, default=1, help="Số viewer giả lập mỗi phòng")
+    rep.add_argument("--speed", choices=["realtime", "max"], default="realtime")
+    rep.add_argument("--duration", type=float, default=30.0)
+    rep.add_argument("--target-fps", type=float, default=None, help="FPS suy luận mục tiêu gửi trong offer")
+    rep.add_argument("--max-frames", type=int, default=0, help="Chỉ nạp N frame đầu của file ghi (0 = tất cả)")
+    rep.add_argument("--url", default=None, help="Dùng server đang chạy thay vì tự khởi động --app")
+    rep.add_argument("--server-pid", type=int, default=None)
+    rep.add_argument("--app", default="mainV5:app")
+    rep.add_argument("--prefix", default="/stream")
+    rep.add_argument("--env", action="append", default=[], help="KEY=VALUE truyền cho server, lặp lại được")
+    rep.add_argument("--startup-timeout", type=float, default=300.0)
+    rep.add_argument("--out", default=None, help="File JSON kết quả (mặc định runs/bench/webrtc-<thời gian>.json)")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "record":
+        if args.source:
+            result = record_source(args.source, args.out, args.seconds, args.format)
+        elif args.room:
+            result = asyncio.run(record_room(args.url, args.prefix, args.room, args.out, args.seconds))
+        else:
+            raise SystemExit("Cần --source hoặc --room")
+        print(f"📝 Đã ghi {result['frames']} frame vào {result['out']}")
+        return
+
+    report = asyncio.run(replay(args))
+    out = Path(args.out or ROOT / "runs" / "bench" / f"webrtc-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    summary = report["summary"]
+    print(f"{args.rooms} phòng x {args.viewers} viewer, {args.speed}: "
+          f"e2e p50 {summary['e2e_latency_ms']['p50']} / p95 {summary['e2e_latency_ms']['p95']} ms, "
+          f"FPS suy luận {summary['processed_fps_per_room']}/phòng ({summary['processed_fps_total']} tổng), "
+          f"frame bỏ {summary['drop_rate_mean']:.1%}, mất {summary['network_loss_mean']:.1%}")
+    print(f"📝 Kết quả: {out}")
+
+
+if __name__ == "__main__":
+    main()
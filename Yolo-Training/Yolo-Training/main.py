@@ -1,19 +1,24 @@
 from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import StreamingResponse
-from ultralytics import YOLO
-from PIL import Image
-from io import BytesIO
-import numpy as np
-import cv2
+from fastapi.responses import Response
+
+from api.annotate import annotated_router, render_original_async
+from api.batching import BatchScheduler
+from api.config import DETECT_MODEL
+from api.inference_pool import install_overload_handler
+from api.ingest import decode_image
+from api.postprocess import extract
 
 # ==========================
 # 🚀 Khởi tạo FastAPI
 # ==========================
 app = FastAPI(title="Leaf and Apple Bounding Box Detection API")
+# Hàng đợi suy luận đầy -> 503 + Retry-After
+install_overload_handler(app)
 
-# 🔹 Load mô hình YOLO (đường dẫn mô hình detect đã train)
-# Thay đường dẫn này nếu mô hình của bạn nằm nơi khác
-model = YOLO("runs/detect/apple-leaf-detect2/weights/best.pt")
+# 🔹 Mô hình YOLO detect đã train ("apple-leaf" trong api/config.py, load lazy qua registry)
+# Đổi model bằng biến môi trường YOLO_DETECT_MODEL hoặc YOLO_MODELS="apple-leaf=<đường dẫn>"
+# 🔹 Gom các request đồng thời thành một lần predict
+scheduler = BatchScheduler(DETECT_MODEL, name="detect")
 
 # ==========================
 # 🔹 API phát hiện bounding boxes
@@ -25,32 +30,37 @@ async def detect_leaves(file: UploadFile = File(...)):
     """
     # Đọc file ảnh
     image_bytes = await file.read()
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    # JPEG 12MP từ điện thoại được giải mã thẳng ở độ phân giải gần kích thước suy luận
+    decoded = decode_image(image_bytes)
+    image = decoded.image
 
-    # Chạy dự đoán YOLO
-    results = model.predict(image, verbose=False)
+    # Chạy dự đoán YOLO (qua bộ gom batch)
+    result, timing = await scheduler.submit(image)
 
-    # Chuyển sang BGR để vẽ bằng OpenCV
-    img_bgr = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    # Lấy toạ độ, nhãn và độ tin cậy của mọi box một lần (dạng mảng)
+    dets = extract(result)
 
-    # Duyệt qua các bounding boxes
-    for box in results[0].boxes:
-        # Lấy toạ độ, nhãn và độ tin cậy
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-        conf = float(box.conf[0])
-        cls_id = int(box.cls[0])
-        label = results[0].names[cls_id]
+    # Vẽ khung + nhãn và mã hoá lại ảnh (trong thread pool, định dạng/chất lượng theo YOLO_ANNOTATE_*)
+    # Vẽ trên ảnh gốc (giải mã đầy đủ lại nếu cần) để ảnh trả về khớp kích thước ảnh client gửi lên
+    rendered = await render_original_async(image_bytes, decoded, dets)
+    return Response(
+        rendered.data,
+        media_type=rendered.media_type,
+        headers={"X-Inference-Total-Ms": str(timing["total_ms"]), "X-Batch-Size": str(timing["batch_size"]),
+                 "X-Original-Size": "{}x{}".format(*decoded.orig_size)}
+    )
 
-        # Vẽ khung và nhãn
-        color = (0, 255, 0)
-        cv2.rectangle(img_bgr, (x1, y1), (x2, y2), color, 2)
-        text = f"{label} {conf:.2f}"
-        cv2.putText(img_bgr, text, (x1, y1 - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+# ==========================
+# 🔹 API trả JSON kết quả + ảnh đã vẽ box (multipart hoặc JSON kèm URL ảnh)
+# ==========================
+app.include_router(annotated_router(scheduler))
 
-    # Mã hoá lại ảnh để trả về client
-    _, buffer = cv2.imencode(".jpg", img_bgr)
-    return StreamingResponse(BytesIO(buffer.tobytes()), media_type="image/jpeg")
+# ==========================
+# 🔹 Thống kê gom batch
+# ==========================
+@app.get("/detect/stats")
+def detect_stats():
+    return scheduler.stats()
 
 # ==========================
 # 🔹 API test (root)
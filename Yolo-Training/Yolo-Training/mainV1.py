@@ -1,15 +1,17 @@
 from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import StreamingResponse
-from PIL import Image
-from io import BytesIO
-from ultralytics import YOLO
-import cv2
-import numpy as np
+from fastapi.responses import Response
+
+from api.annotate import annotated_router, render_original_async
+from api.batching import BatchScheduler
+from api.inference_pool import install_overload_handler
+from api.ingest import decode_image
+from api.postprocess import extract
 
 app = FastAPI(title="YOLOv8 Object Detection API")
+install_overload_handler(app)
 
-# 🔹 Load model YOLO (bạn có thể đổi sang yolov8s.pt hoặc custom model)
-model = YOLO("yolov8n.pt")
+# 🔹 Model YOLO "coco" (yolov8n.pt) dùng chung qua registry; đổi bằng YOLO_MODELS="coco=yolov8s.pt"
+scheduler = BatchScheduler("coco", name="detect", conf=0.25)
 
 @app.post("/detect/")
 async def detect_object(file: UploadFile = File(...)):
@@ -18,38 +20,20 @@ async def detect_object(file: UploadFile = File(...)):
     """
     # Đọc ảnh từ request
     image_bytes = await file.read()
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    decoded = decode_image(image_bytes)
+    image = decoded.image
 
     # Chạy YOLO detect
-    results = model.predict(source=image, conf=0.25, verbose=False)
-
-    # Chuyển ảnh sang BGR để vẽ
-    img_bgr = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-    # Duyệt qua kết quả
-    for r in results:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            conf = float(box.conf[0])
-            cls_id = int(box.cls[0])
-            label = model.names[cls_id]
-
-            # Vẽ khung và nhãn
-            color = (0, 255, 0)
-            cv2.rectangle(img_bgr, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(
-                img_bgr,
-                f"{label} {conf:.2f}",
-                (x1, y1 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                color,
-                2
-            )
-
-    # Mã hoá lại ảnh để gửi về client
-    _, buffer = cv2.imencode(".jpg", img_bgr)
-    return StreamingResponse(BytesIO(buffer.tobytes()), media_type="image/jpeg")
+    r, _ = await scheduler.submit(image)
+
+    # Vẽ khung + nhãn và mã hoá lại ảnh để gửi về client (trong thread pool)
+    # Model chạy trên ảnh giải mã giảm, còn ảnh trả về được vẽ trên ảnh gốc (box quy về toạ độ gốc)
+    rendered = await render_original_async(image_bytes, decoded, extract(r))
+    return Response(rendered.data, media_type=rendered.media_type,
+                    headers={"X-Original-Size": "{}x{}".format(*decoded.orig_size)})
+
+# 🔹 JSON kết quả + ảnh đã vẽ box trong một response
+app.include_router(annotated_router(scheduler))
 
 @app.get("/")
 def root():
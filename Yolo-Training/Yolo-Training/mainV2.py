@@ -1,15 +1,17 @@
 from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse, StreamingResponse
-from PIL import Image
-from io import BytesIO
-from ultralytics import YOLO
-import cv2
 import numpy as np
 
+from api.annotate import annotated_router, multipart_response, render_annotated_async
+from api.batching import BatchScheduler
+from api.inference_pool import install_overload_handler
+from api.ingest import decode_image
+from api.postprocess import RECORD_BBOX, extract
+
 app = FastAPI(title="YOLOv8 Object Detection API")
+install_overload_handler(app)
 
-# 🔹 Load YOLOv8 model (COCO pre-trained)
-model = YOLO("yolov8n.pt")  # có thể đổi sang yolov8s.pt, yolov8m.pt,...
+# 🔹 YOLOv8 model "coco" (COCO pre-trained, load lazy qua registry dùng chung)
+scheduler = BatchScheduler("coco", name="detect", conf=0.3)
 
 @app.post("/detect/")
 async def detect_object(file: UploadFile = File(...)):
@@ -18,47 +20,27 @@ async def detect_object(file: UploadFile = File(...)):
     """
     # Đọc file ảnh từ request
     image_bytes = await file.read()
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
-    image_np = np.array(image)
-
-    # 🔹 Chạy YOLO detect
-    results = model.predict(source=image_np, conf=0.3, verbose=False)
-
-    detections = []
-    annotated_image = image_np.copy()
-
-    # 🔹 Vẽ khung + nhãn
-    for r in results:
-        for box in r.boxes:
-            cls_id = int(box.cls[0])
-            label = model.names[cls_id]
-            conf = float(box.conf[0])
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-
-            # Ghi nhận dữ liệu
-            detections.append({
-                "label": label,
-                "confidence": round(conf, 2),
-                "bbox": [x1, y1, x2, y2]
-            })
-
-            # 🔹 Vẽ khung bounding box
-            color = (0, 255, 0)  # xanh lá
-            cv2.rectangle(annotated_image, (x1, y1), (x2, y2), color, 2)
-
-            # 🔹 Hiển thị nhãn
-            text = f"{label} {conf:.2f}"
-            (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-            cv2.rectangle(annotated_image, (x1, y1 - 20), (x1 + tw, y1), color, -1)
-            cv2.putText(annotated_image, text, (x1, y1 - 5),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
-
-    # 🔹 Chuyển ảnh annotated sang dạng JPEG
-    _, buffer = cv2.imencode(".jpg", cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR))
-    image_bytes_out = BytesIO(buffer.tobytes())
-
-    # 🔹 Trả kết quả: JSON + Ảnh (ở dạng multipart)
-    return StreamingResponse(image_bytes_out, media_type="image/jpeg")
+    decoded = decode_image(image_bytes)
+    # 🔹 Chạy YOLO detect trên ảnh PIL (ultralytics tự đổi RGB -> BGR; ndarray được coi là BGR)
+    r, _ = await scheduler.submit(decoded.image)
+    image_np = np.asarray(decoded.image)  # RGB, chỉ dùng để vẽ box
+
+    # 🔹 Ghi nhận dữ liệu (theo cột, không duyệt từng box)
+    dets = extract(r)
+
+    # 🔹 Vẽ khung + nhãn (nền đặc, chữ đen) và mã hoá ảnh trong thread pool
+    rendered = await render_annotated_async(image_np, dets, label_background=True)
+
+    # 🔹 Trả kết quả: JSON + Ảnh (ở dạng multipart), box trong JSON theo toạ độ ảnh gốc
+    payload = {
+        "detections": decoded.to_original(dets).to_records(RECORD_BBOX, decimals=2, integer_boxes=True),
+        "orig_shape": [decoded.orig_size[1], decoded.orig_size[0]],
+        "image_size": list(rendered.size),
+    }
+    return multipart_response(payload, rendered)
+
+# 🔹 Như trên nhưng chọn được multipart hoặc JSON + URL ảnh, định dạng / chất lượng / kích thước ảnh
+app.include_router(annotated_router(scheduler, label_background=True, record_style=RECORD_BBOX))
 
 @app.get("/")
 def root():
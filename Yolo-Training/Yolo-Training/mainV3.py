@@ -1,12 +1,14 @@
 from fastapi import FastAPI, File, UploadFile
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-from io import BytesIO
-from ultralytics import YOLO
-import numpy as np
+
+from api.batching import BatchScheduler
+from api.inference_pool import install_overload_handler
+from api.ingest import decode_image
+from api.postprocess import RECORD_CORNERS, extract
 
 app = FastAPI(title="YOLOv8 Object Detection API")
+install_overload_handler(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,8 +18,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 🔹 Load model YOLO (có thể đổi sang yolov8s.pt hoặc custom model)
-model = YOLO("yolov8n.pt")
+# 🔹 Model YOLO "coco" (yolov8n.pt) dùng chung qua registry; đổi bằng YOLO_MODELS="coco=yolov8s.pt"
+scheduler = BatchScheduler("coco", name="detect", conf=0.25)
 
 @app.post("/detect/")
 async def detect_object(file: UploadFile = File(...)):
@@ -26,27 +28,14 @@ async def detect_object(file: UploadFile = File(...)):
     """
     # Đọc ảnh từ request
     image_bytes = await file.read()
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    decoded = decode_image(image_bytes)
 
     # Chạy YOLO detect
-    results = model.predict(source=image, conf=0.25, verbose=False)
-
-    detections = []
-    for r in results:
-        for box in r.boxes:
-            x1, y1, x2, y2 = map(float, box.xyxy[0])  # dùng float để chính xác hơn
-            conf = float(box.conf[0])
-            cls_id = int(box.cls[0])
-            label = model.names[cls_id]
-
-            detections.append({
-                "label": label,
-                "confidence": conf,
-                "x1": x1,
-                "y1": y1,
-                "x2": x2,
-                "y2": y2
-            })
+    r, _ = await scheduler.submit(decoded.image)
+
+    # Toạ độ float (chính xác hơn), tạo thẳng từ mảng box của cả ảnh
+    # (box được quy về toạ độ ảnh gốc nếu ảnh được giải mã ở độ phân giải giảm)
+    detections = decoded.to_original(extract(r)).to_records(RECORD_CORNERS)
 
     return JSONResponse(content={"detections": detections})
 
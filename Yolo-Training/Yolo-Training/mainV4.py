@@ -1,15 +1,13 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, APIRouter
-from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
-from PIL import Image
-import numpy as np
 import logging
-import asyncio
 
 # Thư viện quan trọng cho WebRTC trên Python
 from aiortc import RTCPeerConnection, RTCSessionDescription
-from aiortc.mediastreams import MediaStreamTrack
+
+from api.config import STREAM_MODEL
+from api.postprocess import RECORD_CORNERS
+from api.stream_processing import StreamBatchScheduler, YOLOv8FrameProcessor
 
 # Để chuyển đổi frame aiortc sang PIL/Numpy (cần opencv-python, av)
 # Lưu ý: Các thư viện này cần được cài đặt nếu chưa có: pip install opencv-python av
@@ -17,7 +15,6 @@ from aiortc.mediastreams import MediaStreamTrack
 
 # --- CẤU HÌNH ---
 router = APIRouter()
-model = YOLO("yolov8n.pt")
 logging.basicConfig(level=logging.INFO)
 
 # --- DANH SÁCH TÁI PHÂN LOẠI (Giữ nguyên) ---
@@ -26,69 +23,37 @@ FRUIT_LABELS_TO_BE_APPLE = ["APPLE", "ORANGE", "BALL", "GRAPE"]
 peer_connections: dict[str, RTCPeerConnection] = {}
 # Set để lưu trữ các WebSocket client cho signaling
 signaling_websockets: dict[str, WebSocket] = {}
+# Bộ xử lý YOLO đang chạy của mỗi phòng (dừng khi broadcaster ngắt hoặc gửi offer mới)
+yolo_tracks: dict[str, "YOLOv8DetectionTrack"] = {}
+# Scheduler riêng giữ imgsz=480 như trước (quả nhỏ cần ảnh vào lớn hơn),
+# thay vì YOLO_STREAM_IMGSZ=320 của scheduler stream mặc định
+scheduler = StreamBatchScheduler(conf=0.25, imgsz=480)
 
 # --- LỚP XỬ LÝ VIDEO VỚI YOLOV8 ---
-# Lớp này kế thừa từ MediaStreamTrack của aiortc để xử lý từng frame
-class YOLOv8DetectionTrack(MediaStreamTrack):
+# Kế thừa bộ xử lý dùng chung: frame đi thẳng, suy luận chạy nền trên frame mới nhất
+# với FPS tự điều chỉnh (thay cho việc bỏ cố định 2/3 số frame như trước)
+class YOLOv8DetectionTrack(YOLOv8FrameProcessor):
     """Một luồng video tùy chỉnh để xử lý YOLOv8 trên các frame nhận được."""
-    kind = "video"
+    # ÁP DỤNG LOGIC TÁI PHÂN LOẠI: tra bảng theo class id thay vì upper() từng box
+    relabel = {label: "apple" for label in FRUIT_LABELS_TO_BE_APPLE}
+    record_style = RECORD_CORNERS
 
-    def __init__(self, track_from_broadcaster, ws_to_send_results):
-        super().__init__()
-        self.track = track_from_broadcaster  # Luồng video nhận từ người phát sóng
+    def __init__(self, track_from_broadcaster, ws_to_send_results, room_name: str = ""):
         self.ws = ws_to_send_results         # WebSocket để gửi kết quả JSON về client
-        self.yolo_model = model              # Load mô hình YOLOv8
-        self.relabel_labels = FRUIT_LABELS_TO_BE_APPLE
-        self.frame_skip = 3                  # Bỏ qua 3 frame, chỉ xử lý 1 frame (ví dụ 10 FPS thay vì 30 FPS)
-        self._counter = 0
-
-    async def recv(self):
-        # Lấy frame tiếp theo từ luồng video WebRTC
-        frame = await self.track.recv()
-        self._counter += 1
-
-        if self._counter % self.frame_skip != 0:
-            # Bỏ qua frame để giảm tải xử lý và mô phỏng real-time tốt hơn
-            return frame 
-        
-        try:
-            # 1. Chuyển đổi frame aiortc sang numpy array (RGB)
-            img_np = frame.to_ndarray(format="rgb24")
-            image = Image.fromarray(img_np)
-
-            # 2. Chạy YOLOv8
-            # Giảm kích thước ảnh đầu vào để tăng tốc độ xử lý
-            results = self.yolo_model.predict(source=image, conf=0.25, verbose=False, imgsz=480) 
-
-            detections = []
-            for r in results:
-                for box in r.boxes:
-                    x1, y1, x2, y2 = map(float, box.xyxy[0])
-                    conf = float(box.conf[0])
-                    cls_id = int(box.cls[0])
-                    original_label = self.yolo_model.names[cls_id]
-
-                    # 3. ÁP DỤNG LOGIC TÁI PHÂN LOẠI
-                    if original_label.upper() in self.relabel_labels:
-                        final_label = "apple"
-                    else:
-                        final_label = original_label
-
-                    detections.append({
-                        "label": final_label,
-                        "confidence": conf,
-                        "x1": x1, "y1": y1, "x2": x2, "y2": y2
-                    })
-            
-            # 4. Gửi kết quả JSON về client (người xem) qua WebSocket
-            if self.ws and detections:
-                await self.ws.send_json({"type": "detection_result", "detections": detections})
-                
-        except Exception as e:
-            logging.error(f"Lỗi xử lý YOLOv8 frame: {e}")
-        
-        # Trả lại frame gốc (hoặc frame đã được vẽ bounding box)
-        return frame 
+        super().__init__(track_from_broadcaster, room_name, self._send_detections, model=STREAM_MODEL,
+                         scheduler=scheduler)
+
+    async def _send_detections(self, message):
+        # Gửi kết quả JSON về client (người xem) qua WebSocket
+        if self.ws and message["detections"]:
+            await self.ws.send_json({"type": "detection_result", "detections": message["detections"]})
+
+
+def stop_yolo_track(room_name: str):
+    # stop() gỡ bộ xử lý khỏi scheduler và huỷ task đọc frame
+    yolo_track = yolo_tracks.pop(room_name, None)
+    if yolo_track is not None:
+        yolo_track.stop()
 
 
 # --- WEBSOCKET ENDPOINT CHO SIGNALING VÀ XỬ LÝ WEBRTC ---
@@ -105,7 +70,12 @@ async def websocket_endpoint(websocket: WebSocket, room_name: str):
             # --- XỬ LÝ OFFER TỪ CLIENT (Người phát sóng) ---
             if 'offer' in data:
                 offer_sdp = data['offer']
-                
+
+                # Offer mới trong cùng phòng thay cho kết nối cũ
+                stop_yolo_track(room_name)
+                if old_pc := peer_connections.pop(room_name, None):
+                    await old_pc.close()
+
                 # Tạo RTCPeerConnection mới
                 pc = RTCPeerConnection()
                 peer_connections[room_name] = pc
@@ -121,9 +91,12 @@ async def websocket_endpoint(websocket: WebSocket, room_name: str):
                     logging.info(f"Đã nhận luồng {track.kind} từ người phát sóng")
                     if track.kind == "video":
                         # Khởi tạo lớp xử lý YOLOv8
-                        yolo_track = YOLOv8DetectionTrack(track, websocket)
-                        # Bắt đầu xử lý frame video
-                        await yolo_track.recv() 
+                        stop_yolo_track(room_name)
+                        yolo_track = YOLOv8DetectionTrack(track, websocket, room_name)
+                        yolo_tracks[room_name] = yolo_track
+                        # Bộ xử lý tự đọc frame để luôn có frame mới nhất; khi track nguồn kết thúc
+                        # nó tự dừng và gỡ khỏi scheduler
+                        yolo_track.start()
 
                 # Thiết lập Offer và tạo Answer
                 await pc.setRemoteDescription(RTCSessionDescription(**offer_sdp))
@@ -141,6 +114,7 @@ async def websocket_endpoint(websocket: WebSocket, room_name: str):
     except WebSocketDisconnect:
         logging.info(f"Signaling Client đã ngắt kết nối: {room_name}")
     finally:
+        stop_yolo_track(room_name)
         if room_name in peer_connections:
             await peer_connections[room_name].close()
             del peer_connections[room_name]
@@ -1,12 +1,21 @@
 # /my_streaming_project/main.py
 
+import asyncio
+import logging
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 # Import router từ file chứa logic của bạn
-from api import webrtc_yolo_signaling, image_processing
+from api import webrtc_yolo_signaling, image_processing, bulk_processing, video_processing
+from api.config import WARMUP_MODELS
+from api.inference_pool import inference_pool, install_overload_handler
+from api.metrics import metrics_router
+from api.model_registry import registry
+from api.profiling import install_profiling
 
 # --- 1. KHỞI TẠO ỨNG DỤNG FASTAPI CHÍNH ---
 app = FastAPI(
@@ -25,6 +34,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Hàng đợi suy luận đầy -> trả 503 + Retry-After thay vì để độ trễ dồn lên
+install_overload_handler(app)
+
+# Profile theo yêu cầu (header X-Profile / message "profile" trên WebSocket); tắt thì không gắn gì
+install_profiling(app)
+
 # --- 3. GẮN ROUTER VÀO ỨNG DỤNG ---
 # Tất cả các endpoint trong webrtc_yolo_signaling sẽ có tiền tố là /stream
 app.mount("/ui", StaticFiles(directory="ui"), name="ui")
@@ -43,11 +58,61 @@ app.include_router(
     tags=["YOLO Prediction"]
 )
 
+# Xử lý hàng loạt (nhiều ảnh / ZIP / tar -> NDJSON), chạy ở độ ưu tiên nền
+app.include_router(
+    bulk_processing.router,
+    prefix="/predict",
+    tags=["YOLO Prediction"]
+)
+
+# Suy luận trên file video (PyAV giải mã từng frame -> NDJSON, tuỳ chọn video có vẽ box)
+app.include_router(
+    video_processing.router,
+    prefix="/predict",
+    tags=["YOLO Prediction"]
+)
+
+# Metric dạng Prometheus: thời gian từng bước, hàng đợi, FPS / frame bỏ / viewer theo phòng
+app.include_router(metrics_router(), tags=["Root"])
+
+# --- WARMUP MODEL KHI KHỞI ĐỘNG ---
+# Load + chạy thử model ở nền, server vẫn nhận kết nối ngay; /api/ready chỉ báo
+# sẵn sàng khi warmup xong để request đầu tiên không phải trả giá cold-start.
+app.state.ready = False
+
+
+async def _warmup_models():
+    try:
+        await inference_pool.warmup(WARMUP_MODELS)
+        app.state.ready = True
+        logging.info(f"✅ Warmup xong các model: {WARMUP_MODELS}")
+    except Exception as e:
+        logging.error(f"Lỗi khi warmup model {WARMUP_MODELS}: {e}")
+
+
+@app.on_event("startup")
+async def start_warmup():
+    app.state.warmup_task = asyncio.create_task(_warmup_models())
+
+
+@app.on_event("shutdown")
+def stop_inference_workers():
+    # Dừng các worker suy luận và giải phóng vùng nhớ chia sẻ (chế độ shm)
+    inference_pool.close()
+
+
 # --- ENDPOINT GỐC ĐỂ KIỂM TRA SỨC KHỎE ---
 @app.get("/api/status", tags=["Root"])
 def read_root():
     return {"status": "✅ Server is running!"}
 
+
+@app.get("/api/ready", tags=["Root"])
+def read_ready():
+    """Readiness probe: 200 khi model đã load + warmup xong, 503 khi chưa."""
+    content = {"ready": app.state.ready, "models": registry.status()}
+    return JSONResponse(status_code=200 if app.state.ready else 503, content=content)
+
 # --- 4. CHẠY SERVER (Tùy chọn, để tiện phát triển) ---
 if __name__ == "__main__":
     # Chạy server với Uvicorn trên cổng 8000
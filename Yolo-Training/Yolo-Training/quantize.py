@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+from ultralytics import YOLO
+
+from api.backends import dataset_split_dir, export_model, load_parity_samples
+from api.config import EXPORT_IMGSZ, INT8_BACKEND, QUANT_DATA
+from api.model_registry import registry
+
+# --- Lượng tử hoá INT8 model detect táo/lá + báo cáo mAP / độ trễ so với FP32 ---
+# Chạy: python quantize.py --model apple-leaf --backend openvino
+# Sau đó phục vụ bản INT8 bằng: YOLO_DETECT_MODEL=apple-leaf:int8 (hoặc YOLO_PREDICT_MODEL=...)
+
+
+def measure_latency(model, images, imgsz, warmup=3):
+    """Độ trễ CPU mỗi ảnh (batch 1), bỏ qua vài lần chạy đầu để tránh cold-start."""
+    for image in images[:warmup]:
+        model.predict(source=image, verbose=False, imgsz=imgsz, device="cpu")
+    timings = []
+    for image in images:
+        started = time.perf_counter()
+        model.predict(source=image, verbose=False, imgsz=imgsz, device="cpu")
+        timings.append((time.perf_counter() - started) * 1000.0)
+    timings = np.array(timings)
+    return {
+        "mean_ms": round(float(timings.mean()), 2),
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+    }
+
+
+def evaluate(model, data, imgsz):
+    """mAP trên split val của dataset.yaml."""
+    metrics = model.val(data=data, imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False)
+    return {"mAP50": round(float(metrics.box.map50), 4), "mAP50-95": round(float(metrics.box.map), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lượng tử hoá INT8 và so sánh với FP32")
+    parser.add_argument("--model", default="apple-leaf", help="Tên model trong registry hoặc đường dẫn .pt")
+    parser.add_argument("--backend", default=INT8_BACKEND, choices=["openvino", "onnx"])
+    parser.add_argument("--data", default=QUANT_DATA)
+    parser.add_argument("--imgsz", type=int, default=EXPORT_IMGSZ)
+    parser.add_argument("--latency-images", type=int, default=50)
+    parser.add_argument("--out", default="runs/quantize")
+    args = parser.parse_args()
+
+    weights = registry.resolve(args.model)
+    print(f"🚀 Lượng tử hoá INT8 '{weights}' bằng {args.backend} (calibration: split val của {args.data})...")
+    int8_path = export_model(weights, args.backend, imgsz=args.imgsz, int8=True)
+    print(f"   Model INT8: {int8_path}")
+
+    fp32 = YOLO(weights)
+    int8 = YOLO(int8_path, task="detect")
+    images = load_parity_samples(str(dataset_split_dir(args.data)), args.latency_images)
+
+    print("📏 Đánh giá mAP và độ trễ CPU...")
+    report = {
+        "weights": weights,
+        "int8_model": int8_path,
+        "backend": args.backend,
+        "imgsz": args.imgsz,
+        "latency_images": len(images),
+        "fp32": {**evaluate(fp32, args.data, args.imgsz), **measure_latency(fp32, images, args.imgsz)},
+        "int8": {**evaluate(int8, args.data, args.imgsz), **measure_latency(int8, images, args.imgsz)},
+    }
+    report["speedup"] = round(report["fp32"]["mean_ms"] / max(report["int8"]["mean_ms"], 1e-9), 2)
+    report["mAP50-95_drop"] = round(report["fp32"]["mAP50-95"] - report["int8"]["mAP50-95"], 4)
+
+    os.makedirs(args.out, exist_ok=True)
+    safe_name = re.sub(r"[^\w.-]", "_", args.model)  # "apple-leaf:int8" -> tên file hợp lệ trên Windows
+    report_path = os.path.join(args.out, f"{safe_name}_int8_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print("| Model | mAP50 | mAP50-95 | mean ms | p95 ms |")
+    print("|-------|-------|----------|---------|--------|")
+    for key in ("fp32", "int8"):
+        row = report[key]
+        print(f"| {key.upper()} | {row['mAP50']} | {row['mAP50-95']} | {row['mean_ms']} | {row['p95_ms']} |")
+    print()
+    print(f"🎉 Tăng tốc x{report['speedup']}, mAP50-95 giảm {report['mAP50-95_drop']}. Báo cáo: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# Cho phép `import api...` khi chạy pytest từ thư mục gốc của project
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
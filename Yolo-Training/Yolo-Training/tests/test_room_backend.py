@@ -0,0 +1,369 @@
+# /my_streaming_project/tests/test_room_backend.py
+#
+# Kiểm tra room backend dùng chung (api/room_backend.py) và định tuyến signaling giữa các
+# node (api/webrtc_yolo_signaling.py) trên một server Redis giả lập trong process (fakeredis),
+# không cần Redis thật. Backend dùng script Lua (EVAL) nên fakeredis cần thêm lupa.
+#   pip install pytest redis "fakeredis[lua]"
+#   python -m pytest -q tests
+
+import asyncio
+import importlib.util
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.room_backend import EVENTS_CHANNEL, InMemoryBackend, RedisBackend, RoomBackend, node_channel  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_for(predicate, timeout: float = 3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Hết thời gian chờ điều kiện")
+        await asyncio.sleep(0.02)
+
+
+async def start_nodes(*node_ids, **kwargs):
+    # Nhả / gia hạn quyền giữ phòng chạy bằng EVAL: fakeredis chỉ hỗ trợ khi có lupa
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+    nodes = [RedisBackend(node_id, client=fakeredis.aioredis.FakeRedis(server=server), **kwargs)
+             for node_id in node_ids]
+    for node in nodes:
+        await node.start()
+    return nodes
+
+
+def stall_keepalive(node: RedisBackend):
+    """Giả lập node treo: dừng task gia hạn nền, key giữ phòng sẽ hết hạn theo TTL."""
+    for task in node._tasks:
+        if task.get_name() == "room-backend-keepalive":
+            task.cancel()
+
+
+async def close_nodes(*nodes):
+    for node in nodes:
+        await node.close()
+
+
+# ==========================
+# RoomBackend
+# ==========================
+def test_incomplete_backend_fails_at_construction():
+    class PartialBackend(RoomBackend):
+        async def claim_room(self, room_name: str) -> str:
+            return self.node_id
+
+    with pytest.raises(TypeError):
+        PartialBackend("A")
+
+
+def test_memory_backend_claim_and_publish():
+    async def scenario():
+        backend = InMemoryBackend("A")
+        assert await backend.claim_room("r") == "A"
+        received = []
+        await backend.subscribe("c", received.append)
+        backend.publish("c", {"x": 1})
+        assert received == [{"x": 1}]
+        await backend.release_room("r")
+        assert await backend.room_owner("r") is None
+
+    run(scenario())
+
+
+def test_claim_and_release_room():
+    async def scenario():
+        a, b = await start_nodes("A", "B")
+        try:
+            assert await a.claim_room("r1") == "A"
+            assert await b.claim_room("r1") == "A"
+            # Node không giữ phòng không xoá được quyền của node khác
+            await b.release_room("r1")
+            assert await b.room_owner("r1") == "A"
+            await a.release_room("r1")
+            assert await b.room_owner("r1") is None
+            assert await b.claim_room("r1") == "B"
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
+
+
+def test_keepalive_extends_ownership():
+    async def scenario():
+        a, b = await start_nodes("A", "B", owner_ttl_s=1.0)
+        try:
+            await a.claim_room("r1")
+            await asyncio.sleep(1.5)
+            # Đã quá TTL ban đầu nhưng task nền vẫn gia hạn
+            assert await b.room_owner("r1") == "A"
+            assert await b.claim_room("r1") == "A"
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
+
+
+def test_ownership_expires_and_loss_is_reported():
+    async def scenario():
+        a, b = await start_nodes("A", "B", owner_ttl_s=1.0)
+        lost = []
+        a.on_ownership_lost(lost.append)
+        try:
+            await a.claim_room("r1")
+            stall_keepalive(a)
+            await asyncio.sleep(1.2)  # không gia hạn -> key hết hạn
+            assert await b.room_owner("r1") is None
+            assert await b.claim_room("r1") == "B"
+            await a.refresh_owned()
+            assert lost == ["r1"]
+            assert a.stats()["rooms_owned"] == 0
+            # A không được gia hạn / xoá quyền giữ phòng của B
+            await a.release_room("r1")
+            assert await a.room_owner("r1") == "B"
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
+
+
+def test_members_are_shared_between_nodes():
+    async def scenario():
+        a, b = await start_nodes("A", "B")
+        try:
+            await a.add_member("r1", "bc", "broadcaster")
+            await b.add_member("r1", "v1", "viewer")
+            assert await a.members("r1") == {"bc": {"role": "broadcaster", "node": "A"},
+                                             "v1": {"role": "viewer", "node": "B"}}
+            await b.remove_member("r1", "v1")
+            assert set(await a.members("r1")) == {"bc"}
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
+
+
+def test_publish_is_forwarded_in_order():
+    async def scenario():
+        a, b = await start_nodes("A", "B")
+        received = []
+        try:
+            await a.subscribe(node_channel("A"), received.append)
+            for i in range(20):
+                b.publish(node_channel("A"), {"seq": i})
+            await wait_for(lambda: len(received) == 20)
+            assert [m["seq"] for m in received] == list(range(20))
+            await a.unsubscribe(node_channel("A"), received.append)
+            b.publish(node_channel("A"), {"seq": 99})
+            await asyncio.sleep(0.2)
+            assert len(received) == 20
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
+
+
+# ==========================
+# Signaling nhiều node
+# ==========================
+class FakeDescription:
+    def __init__(self, sdp: str, type: str):
+        self.sdp = sdp
+        self.type = type
+
+
+class FakePeerConnection:
+    """Đủ cho luồng offer / answer của signaling, không mở kết nối mạng."""
+
+    def __init__(self, *args):
+        self.localDescription = None
+        self.tracks = []
+
+    def on(self, event):
+        return lambda handler: handler
+
+    def addTrack(self, track):
+        self.tracks.append(track)
+
+    async def createOffer(self):
+        return FakeDescription("offer-sdp", "offer")
+
+    async def createAnswer(self):
+        return FakeDescription("answer-sdp", "answer")
+
+    async def setLocalDescription(self, description):
+        self.localDescription = description
+
+    async def setRemoteDescription(self, description):
+        self.remoteDescription = description
+
+    async def close(self):
+        pass
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+    def types(self):
+        return [m.get("type") for m in self.sent if isinstance(m, dict)]
+
+
+def load_signaling(name: str, backend):
+    """Mỗi node là một bản module signaling riêng (trạng thái phòng / session riêng)."""
+    pytest.importorskip("aiortc")
+    spec = importlib.util.spec_from_file_location(name, ROOT / "api" / "webrtc_yolo_signaling.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.RTCPeerConnection = FakePeerConnection
+    module.RTCSessionDescription = FakeDescription
+    module.backend = backend
+    return module
+
+
+async def start_signaling_nodes(**kwargs):
+    a_backend, b_backend = await start_nodes("A", "B", **kwargs)
+    a, b = load_signaling("signaling_node_a", a_backend), load_signaling("signaling_node_b", b_backend)
+    await a.ensure_backend()
+    await b.ensure_backend()
+    return a, b
+
+
+async def connect(node, room_name: str, client_id: str):
+    ws = FakeWebSocket()
+    session = node.ClientSession(room_name, client_id, ws)
+    node.local_sessions[session.key] = session
+    return session, ws
+
+
+OFFER = {"type": "offer", "sdp": {"sdp": "offer-sdp", "type": "offer"}}
+
+
+def test_viewer_on_other_node_is_forwarded_to_owner():
+    async def scenario():
+        a, b = await start_signaling_nodes()
+        try:
+            broadcaster, broadcaster_ws = await connect(a, "r1", "bc")
+            await broadcaster.route(OFFER)
+            assert broadcaster_ws.types() == ["answer"]
+
+            viewer, viewer_ws = await connect(b, "r1", "v1")
+            await viewer.route({"type": "join_as_viewer"})
+            assert viewer.owner == "A"
+            await wait_for(lambda: ("r1", "v1") in a.remote_sessions)
+            await wait_for(lambda: "v1" in a.rooms["r1"].viewer_connections)
+
+            # Kết quả YOLO của phòng (ở A) tới viewer đang nối vào B
+            a.rooms["r1"].hub.publish({"type": "yolo_results", "detections": [1]})
+            await wait_for(lambda: "yolo_results" in viewer_ws.types())
+
+            # Viewer rời B -> A dọn session chuyển tiếp
+            b.local_sessions.pop(viewer.key)
+            await viewer.leave()
+            await wait_for(lambda: ("r1", "v1") not in a.remote_sessions)
+            assert "v1" not in a.rooms["r1"].viewer_connections
+        finally:
+            await close_nodes(a.backend, b.backend)
+
+    run(scenario())
+
+
+def test_waiting_viewer_is_rerouted_when_owner_appears():
+    async def scenario():
+        a, b = await start_signaling_nodes()
+        try:
+            viewer, _ = await connect(b, "r2", "v2")
+            await viewer.route({"type": "join_as_viewer"})
+            assert viewer.owner is None and "v2" in b.rooms["r2"].viewer_connections
+
+            broadcaster, _ = await connect(a, "r2", "bc2")
+            await broadcaster.route(OFFER)
+            await wait_for(lambda: viewer.owner == "A")
+            await wait_for(lambda: ("r2", "v2") in a.remote_sessions)
+            assert "v2" not in b.rooms["r2"].viewer_connections
+        finally:
+            await close_nodes(a.backend, b.backend)
+
+    run(scenario())
+
+
+def test_broadcaster_on_non_owner_is_forwarded():
+    async def scenario():
+        a, b = await start_signaling_nodes()
+        try:
+            first, _ = await connect(a, "r3", "bc")
+            await first.route(OFFER)
+            second, second_ws = await connect(b, "r3", "bc-2")
+            await second.route(OFFER)
+            assert second.owner == "A"
+            await wait_for(lambda: "answer" in second_ws.types())
+        finally:
+            await close_nodes(a.backend, b.backend)
+
+    run(scenario())
+
+
+def test_lost_ownership_tears_down_room_and_disconnects_clients():
+    async def scenario():
+        a, b = await start_signaling_nodes(owner_ttl_s=1.0)
+        try:
+            broadcaster, broadcaster_ws = await connect(a, "r4", "bc")
+            await broadcaster.route(OFFER)
+            viewer, viewer_ws = await connect(b, "r4", "v1")
+            await viewer.route({"type": "join_as_viewer"})
+            await wait_for(lambda: ("r4", "v1") in a.remote_sessions)
+
+            # Node B nhận phòng sau khi quyền của A bị mất (vd. A treo lâu hơn TTL)
+            await a.backend._redis.delete(a.backend._owner_key("r4"))
+            assert await b.backend.claim_room("r4") == "B"
+            await a.backend.refresh_owned()
+
+            await wait_for(lambda: broadcaster_ws.closed == 1012)
+            await wait_for(lambda: viewer_ws.closed == 1012)  # đóng qua node B
+            assert "r4" not in a.rooms
+            assert ("r4", "v1") not in a.remote_sessions
+            # Quyền giữ phòng mới của B không bị A đụng tới
+            assert await b.backend.room_owner("r4") == "B"
+        finally:
+            await close_nodes(a.backend, b.backend)
+
+    run(scenario())
+
+
+def test_events_channel_reaches_every_node():
+    async def scenario():
+        a, b = await start_nodes("A", "B")
+        events = []
+        try:
+            await b.subscribe(EVENTS_CHANNEL, events.append)
+            a.publish(EVENTS_CHANNEL, {"event": "owner", "room": "r", "node": "A"})
+            await wait_for(lambda: events == [{"event": "owner", "room": "r", "node": "A"}])
+        finally:
+            await close_nodes(a, b)
+
+    run(scenario())
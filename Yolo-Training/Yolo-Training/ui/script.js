@@ -109,6 +109,91 @@ let state = {
 let clockInterval = null; 
 let dataFetchInterval = null; 
 
+// --- Giải mã kết quả YOLO dạng nhị phân (xem api/wire_format.py) ---
+// Server chỉ gửi nhị phân khi viewer yêu cầu { encoding: 'binary' }; ngược lại vẫn là JSON.
+const YoloBinaryDecoder = {
+    FLAG_INTERPOLATED: 1,
+    FLAG_REUSED: 2,
+    FLAG_DELTA: 4,
+    FLAG_TRACK_IDS: 8,
+    DELTA_SCALE: 4,
+    labels: {},
+    previousBoxes: new Map(), // track_id -> box đã giải mã ở frame trước (cho delta)
+
+    reset: function() {
+        this.labels = {};
+        this.previousBoxes = new Map();
+    },
+
+    decode: function(buffer) {
+        const view = new DataView(buffer);
+        const version = view.getUint8(0);
+        const kind = view.getUint8(1);
+        if (version !== 1 || kind !== 1) throw new Error(`Unsupported binary message v${version} kind ${kind}`);
+        const flags = view.getUint8(2);
+        const frameSeq = view.getUint32(4, true);
+        const origShape = [view.getUint16(8, true), view.getUint16(10, true)];
+        const latency = view.getFloat32(12, true);
+        const n = view.getUint16(16, true);
+        const nLabels = view.getUint16(18, true);
+        let offset = 20;
+
+        const textDecoder = new TextDecoder();
+        for (let i = 0; i < nLabels; i++) {
+            const labelId = view.getUint16(offset, true);
+            const length = view.getUint8(offset + 2);
+            offset += 3;
+            this.labels[labelId] = textDecoder.decode(new Uint8Array(buffer, offset, length));
+            offset += length;
+        }
+
+        // DataView đọc được cả vị trí không căn hàng, không cần copy buffer
+        const readColumn = (size, reader, count) => {
+            const values = new Array(count);
+            for (let i = 0; i < count; i++) values[i] = reader(offset + i * size);
+            offset += size * count;
+            return values;
+        };
+        const labelIds = readColumn(2, (o) => view.getUint16(o, true), n);
+        const trackIds = (flags & this.FLAG_TRACK_IDS) ? readColumn(4, (o) => view.getUint32(o, true), n) : new Array(n).fill(0);
+        const confidences = readColumn(4, (o) => view.getFloat32(o, true), n);
+        const modes = (flags & this.FLAG_DELTA) ? readColumn(1, (o) => view.getUint8(o), n) : new Array(n).fill(0);
+        const nDelta = modes.filter((m) => m === 1).length;
+        const absolute = readColumn(4, (o) => view.getFloat32(o, true), (n - nDelta) * 4);
+        const deltas = readColumn(2, (o) => view.getInt16(o, true), nDelta * 4);
+
+        const detections = [];
+        const nextBoxes = new Map();
+        let a = 0, d = 0;
+        for (let i = 0; i < n; i++) {
+            let box;
+            if (modes[i] === 1) {
+                const prev = this.previousBoxes.get(trackIds[i]);
+                box = [0, 1, 2, 3].map((k) => prev[k] + deltas[d * 4 + k] / this.DELTA_SCALE);
+                d++;
+            } else {
+                box = absolute.slice(a * 4, a * 4 + 4);
+                a++;
+            }
+            if (trackIds[i]) nextBoxes.set(trackIds[i], box);
+            const det = { label: this.labels[labelIds[i]] || '', confidence: confidences[i], box: box };
+            if (trackIds[i]) det.track_id = trackIds[i];
+            detections.push(det);
+        }
+        this.previousBoxes = nextBoxes;
+
+        return {
+            type: 'yolo_results',
+            detections: detections,
+            orig_shape: origShape,
+            frame_seq: frameSeq,
+            latency_ms: Number.isNaN(latency) ? null : latency,
+            interpolated: Boolean(flags & this.FLAG_INTERPOLATED),
+            reused: Boolean(flags & this.FLAG_REUSED),
+        };
+    }
+};
+
 // --- WebRTC Service (Không đổi) ---
 const WebRTCService = {
     ws: null,
@@ -127,6 +212,9 @@ const WebRTCService = {
         
         try {
             this.ws = new WebSocket(fullUrl);
+            // Kết quả YOLO dạng nhị phân đến dưới dạng ArrayBuffer
+            this.ws.binaryType = 'arraybuffer';
+            YoloBinaryDecoder.reset();
         } catch (error) {
             console.error("WebSocket connection error:", error);
             streamStatus.textContent = "Failed to connect. (Check URL or network)";
@@ -135,12 +223,26 @@ const WebRTCService = {
 
         this.ws.onopen = () => {
             streamStatus.textContent = "Connected, requesting video...";
-            this.ws.send(JSON.stringify({ type: 'join_as_viewer' }));
+            // Yêu cầu kết quả YOLO dạng nhị phân (gọn hơn JSON), có delta theo track
+            this.ws.send(JSON.stringify({ type: 'join_as_viewer', encoding: 'binary', delta: true }));
         };
         this.ws.onmessage = async (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                try {
+                    this.handleDetections(YoloBinaryDecoder.decode(event.data));
+                } catch (e) {
+                    console.warn("Failed to decode binary detection message:", e);
+                }
+                return;
+            }
             try {
                 const message = JSON.parse(event.data);
-                if (message.type === 'offer') this.handleOffer(message.sdp);
+                if (message.type === 'offer') {
+                    // Server đã vẽ box sẵn trên video -> không vẽ overlay nữa
+                    this.annotatedVideo = !!message.annotated_video;
+                    this.handleOffer(message.sdp);
+                }
+                else if (message.type === 'yolo_results') this.handleDetections(message);
                 else if (message.error) {
                     streamStatus.textContent = `Server Error: ${message.error}`;
                     this.disconnect();
@@ -194,8 +296,13 @@ const WebRTCService = {
         }
     },
     
+    handleDetections: function(detectionData) {
+        this.lastDetections = detectionData;
+        this.renderStaticDetections(detectionData);
+    },
+
     renderStaticDetections: function(detectionData) {
-        if (!this.canvasContext || !detectionData || !detectionData.detections) return;
+        if (this.annotatedVideo || !this.canvasContext || !detectionData || !detectionData.detections) return;
         const { detections, orig_shape } = detectionData;
         const canvas = this.canvasContext.canvas;
         if (!orig_shape) return;